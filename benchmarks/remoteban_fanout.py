@@ -0,0 +1,279 @@
+"""
+Fan-out benchmark for RemoteBan's ban engine.
+
+Runs ``RemoteBan.translate_users``, ``RemoteBan.ban_users`` and ``RemoteBan.unban_users`` against
+fake guilds backed by a local stand-in of Discord's HTTP layer. The fake layer models per-route
+buckets answering with ``429`` and a ``Retry-After`` header, server errors and latency.
+
+This requires Red-DiscordBot to be installed. Run it from the root of the repository::
+
+    python -m benchmarks.remoteban_fanout --users 10,100 --guilds 5,25 --profiles clean,ratelimited
+
+Each line of the output is one point of the parameter grid, giving the wall time, the number of
+requests per second made to the fake HTTP layer, the number of 429 and 5xx answered, the pairs
+that failed for good and the peak memory allocated during the run.
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import discord
+from redbot.core import data_manager
+
+PROFILES: Dict[str, "Profile"] = {}
+
+
+@dataclass
+class Profile:
+    name: str
+    # Requests allowed per route bucket during ``bucket_window`` seconds.
+    bucket_limit: int = 50
+    bucket_window: float = 1.0
+    # Probability for a request to fail with a server error.
+    server_error_rate: float = 0.0
+
+    def __post_init__(self):
+        PROFILES[self.name] = self
+
+
+Profile("clean", bucket_limit=10_000)
+Profile("ratelimited", bucket_limit=5, bucket_window=1.0)
+Profile("flaky", bucket_limit=10_000, server_error_rate=0.05)
+Profile("incident", bucket_limit=5, bucket_window=1.0, server_error_rate=0.05)
+
+
+class FakeResponse:
+    """
+    The bits of ``aiohttp.ClientResponse`` read by ``discord.HTTPException``.
+    """
+
+    def __init__(self, status: int, reason: str, headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeHTTP:
+    """
+    A stand-in for Discord's HTTP API, keeping one bucket per route and major parameter.
+    """
+
+    def __init__(self, profile: Profile, *, latency: float, jitter: float, seed: int = 0):
+        self.profile = profile
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        # (route, major parameter): (window start, requests made in window)
+        self.buckets: Dict[Tuple[str, int], List[float]] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+
+    async def request(self, route: str, major: int):
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        now = time.monotonic()
+        bucket = self.buckets.setdefault((route, major), [now, 0])
+        if now - bucket[0] >= self.profile.bucket_window:
+            bucket[0], bucket[1] = now, 0
+        if bucket[1] >= self.profile.bucket_limit:
+            self.rate_limited += 1
+            retry_after = self.profile.bucket_window - (now - bucket[0])
+            raise discord.HTTPException(
+                FakeResponse(429, "Too Many Requests", {"Retry-After": f"{retry_after:.3f}"}),
+                {"message": "You are being rate limited.", "code": 0},
+            )
+        bucket[1] += 1
+
+        if self.random.random() < self.profile.server_error_rate:
+            self.server_errors += 1
+            raise discord.DiscordServerError(FakeResponse(502, "Bad Gateway"), "Bad Gateway")
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, http: FakeHTTP):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.owner = None
+        # The bot can always ban in fake guilds.
+        self.me = SimpleNamespace(guild_permissions=discord.Permissions(ban_members=True))
+        self._http = http
+
+    async def ban(self, user, *, reason: Optional[str] = None):
+        await self._http.request("PUT /guilds/{guild_id}/bans/{user_id}", self.id)
+
+    async def unban(self, user, *, reason: Optional[str] = None):
+        await self._http.request("DELETE /guilds/{guild_id}/bans/{user_id}", self.id)
+
+
+class FakeBot:
+    def __init__(self, http: FakeHTTP, guilds: List[FakeGuild]):
+        self.user = FakeUser(0)
+        self._http = http
+        self._guilds = {guild.id: guild for guild in guilds}
+
+    @property
+    def guilds(self) -> List[FakeGuild]:
+        return list(self._guilds.values())
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self._guilds.get(guild_id)
+
+    async def get_or_fetch_user(self, user_id: int) -> FakeUser:
+        await self._http.request("GET /users/{user_id}", 0)
+        return FakeUser(user_id)
+
+    async def cog_disabled_in_guild(self, cog, guild) -> bool:
+        return False
+
+
+@dataclass
+class Result:
+    profile: str
+    action: str
+    users: int
+    guilds: int
+    wall: float
+    requests: int
+    rate_limited: int
+    server_errors: int
+    failures: int
+    peak_memory: int
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.wall if self.wall else 0.0
+
+    def format(self) -> str:
+        return (
+            f"{self.profile:<12} {self.action:<10} {self.users:>6} {self.guilds:>6} "
+            f"{self.wall:>9.3f} {self.requests_per_second:>9.1f} {self.rate_limited:>6} "
+            f"{self.server_errors:>6} {self.failures:>6} {self.peak_memory / 1024:>9.1f}"
+        )
+
+
+HEADER = (
+    f"{'profile':<12} {'action':<10} {'users':>6} {'guilds':>6} {'wall (s)':>9} "
+    f"{'req/s':>9} {'429':>6} {'5xx':>6} {'failed':>6} {'peak KiB':>9}"
+)
+
+
+def setup_red_data():
+    """
+    Point Red's data manager to a temporary folder so the cog's Config can be used.
+    """
+    data_manager.basic_config = {
+        "DATA_PATH": tempfile.mkdtemp(prefix="remoteban-benchmark-"),
+        "COG_PATH_APPEND": "cogs",
+        "CORE_PATH_APPEND": "core",
+        "STORAGE_TYPE": "JSON",
+        "STORAGE_DETAILS": {},
+    }
+    data_manager.instance_name = "remoteban-benchmark"
+
+
+async def run_point(
+    profile: Profile, users_count: int, guilds_count: int, *, latency: float, jitter: float
+) -> List[Result]:
+    from remoteban.remoteban import RemoteBan, UserTranslator
+
+    http = FakeHTTP(profile, latency=latency, jitter=jitter)
+    guilds = [FakeGuild(guild_id, http) for guild_id in range(1, guilds_count + 1)]
+    bot = FakeBot(http, guilds)
+    cog = RemoteBan(bot)
+    user_ids = list(range(10_000, 10_000 + users_count))
+    # Ban and unban runs are measured with every user, whatever the translation step gave.
+    users = UserTranslator(
+        users=[FakeUser(user_id) for user_id in user_ids], not_found=[], errored={}
+    )
+
+    results = []
+    steps = (
+        ("translate", lambda: cog.translate_users(user_ids)),
+        ("ban", lambda: cog.ban_users(users, guilds, bot.user, "Benchmark")),
+        ("unban", lambda: cog.unban_users(users, guilds, bot.user, "Benchmark")),
+    )
+    for action, step in steps:
+        before = (http.requests, http.rate_limited, http.server_errors)
+        tracemalloc.start()
+        start = time.perf_counter()
+        outcome = await step()
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if action == "translate":
+            failures = len(outcome["not_found"]) + len(outcome["errored"])
+        else:
+            failures = sum(len(case.fails) for case in outcome)
+        results.append(
+            Result(
+                profile=profile.name,
+                action=action,
+                users=users_count,
+                guilds=guilds_count,
+                wall=wall,
+                requests=http.requests - before[0],
+                rate_limited=http.rate_limited - before[1],
+                server_errors=http.server_errors - before[2],
+                failures=failures,
+                peak_memory=peak,
+            )
+        )
+    cog.mirror.cancel()
+    return results
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--users", type=parse_ints, default=[10, 100], help="e.g. 10,100,500")
+    parser.add_argument("--guilds", type=parse_ints, default=[5, 25], help="e.g. 5,25,100")
+    parser.add_argument(
+        "--profiles",
+        type=lambda value: value.split(","),
+        default=["clean", "flaky", "ratelimited"],
+        help=f"Any of {', '.join(PROFILES)}",
+    )
+    parser.add_argument("--latency", type=float, default=0.002, help="Base latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.001, help="Extra random latency")
+    args = parser.parse_args()
+
+    setup_red_data()
+    print(HEADER)
+    for profile_name in args.profiles:
+        profile = PROFILES[profile_name]
+        for users_count in args.users:
+            for guilds_count in args.guilds:
+                for result in asyncio.run(
+                    run_point(
+                        profile,
+                        users_count,
+                        guilds_count,
+                        latency=args.latency,
+                        jitter=args.jitter,
+                    )
+                ):
+                    print(result.format(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
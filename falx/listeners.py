@@ -4,6 +4,8 @@ from contextlib import suppress
 import discord
 from redbot.core import commands
 
+from restscheduler import Priority, get_scheduler
+
 from .abc import MixinMeta
 from .falxclass import Allowance
 
@@ -13,15 +15,23 @@ class Listeners(MixinMeta, metaclass=ABCMeta):
     async def on_guild_join(self, guild: discord.Guild):
         if not self.is_enabled:
             return
+        scheduler = get_scheduler(self.bot)
         if await self.should_leave_guild(guild):
             if guild.owner:
                 with suppress(discord.HTTPException):
-                    await guild.owner.send(await self.get_leaving_message())
-            await guild.leave()
+                    await scheduler.run(
+                        guild.owner.send,
+                        await self.get_leaving_message(),
+                        route="dm",
+                        priority=Priority.NOTIFICATION,
+                    )
+            await scheduler.run(
+                guild.leave, route="leave", guild_id=guild.id, priority=Priority.MODERATION
+            )
         allowance = await Allowance.from_guild(guild, self.config)
         embed = self.generate_join_embed_for_guild(guild, is_accepted=allowance.is_allowed)
         if channel := await self.get_notification_channel():
-            await channel.send(embed=embed)
+            await scheduler.run(channel.send, embed=embed, route="send", guild_id=channel.guild.id)
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
@@ -34,4 +44,6 @@ class Listeners(MixinMeta, metaclass=ABCMeta):
             await guild_info.disallow_guild(self.bot.user, "Automatic Removal")
         embed = await self.generate_leave_embed_for_guild(guild)
         if channel := await self.get_notification_channel():
-            await channel.send(embed=embed)
+            await get_scheduler(self.bot).run(
+                channel.send, embed=embed, route="send", guild_id=channel.guild.id
+            )
@@ -1,25 +1,68 @@
+import asyncio
 from abc import (  # Importing ABCMeta in an effort to use it in other files
     ABC,
+    ABCMeta,
     abstractmethod,
 )
+from typing import Optional, Union
 
 from redbot.core import Config
 from redbot.core.bot import Red
 from redbot.core.commands import Cog
 
+from .availability import AvailabilityTracker
+from .cases import CaseTracker
+from .cluster import ClusterAggregator, ClusterCollector
+from .delivery import AlertDelivery
+from .eventlog import EventLog
+from .latency import LatencySampler
+from .looplag import LoopLagMonitor
+from .metrics import Metrics, MetricsServer
 from .no_class import Event
+from .shards import ShardMonitor
 
 
 class MixinMeta(ABC):
     bot: Red
     config: Config
+    shard_monitor: ShardMonitor
+    delivery: AlertDelivery
+    cases: CaseTracker
+    latency: LatencySampler
+    availability: AvailabilityTracker
+    event_log: EventLog
+    loop_lag: LoopLagMonitor
+    metrics: Metrics
+    metrics_server: MetricsServer
+    cluster: Optional[Union[ClusterAggregator, ClusterCollector]]
+    _resync_task: Optional[asyncio.Task]
 
     def __init__(self, *_args):
         self.bot: Red
         self.config: Config
 
     @abstractmethod
-    async def declare_event(self, event: Event):
+    async def start_cluster(self):
+        pass
+
+    @abstractmethod
+    async def stop_cluster(self):
+        pass
+
+    @abstractmethod
+    def log_event(self, event_type: str, shard_id: Optional[int]):
+        pass
+
+    @abstractmethod
+    def declare_event(self, event: Event):
+        pass
+
+    @abstractmethod
+    def take_snapshot(self):
+        pass
+
+    @abstractmethod
+    async def fetch_from_last_connect(self):
         pass
 
 
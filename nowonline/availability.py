@@ -0,0 +1,140 @@
+import asyncio
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+
+from .no_class import EVENT_TYPE, Event
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# Time a shard can stay under the availability threshold after being ready, in seconds.
+AVAILABILITY_GRACE = 60.0
+
+
+class GuildCounts:
+    """
+    The guilds of a single shard, and those that are unavailable.
+    """
+
+    __slots__ = ("guild_ids", "unavailable", "alerted", "timer")
+
+    def __init__(self):
+        self.guild_ids: Set[int] = set()
+        self.unavailable: Set[int] = set()
+        # Whether the shard was alerted for being under the threshold.
+        self.alerted = False
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def available(self) -> int:
+        return len(self.guild_ids) - len(self.unavailable)
+
+
+class AvailabilityTracker:
+    """
+    Count the available and unavailable guilds of every shard.
+
+    Counts are updated from guild events, and recounted from the known guilds of a shard when it
+    is ready, since an identify replaces them without dispatching anything. Guilds that never
+    become available are not dispatched at all, so the cache is read once when the bot is ready.
+    A shard still under ``threshold`` of available guilds ``AVAILABILITY_GRACE`` seconds after
+    being ready is alerted once, until it goes back above.
+    """
+
+    def __init__(self, cog: "NowOnline"):
+        self.cog = cog
+        self.threshold = 0.9
+        self._shards: Dict[int, GuildCounts] = {}
+
+    async def load_settings(self):
+        self.threshold = await self.cog.config.availability_threshold()
+
+    def get(self, shard_id: int) -> GuildCounts:
+        if shard_id not in self._shards:
+            self._shards[shard_id] = GuildCounts()
+        return self._shards[shard_id]
+
+    @property
+    def shards(self) -> List[Tuple[int, GuildCounts]]:
+        return sorted(self._shards.items())
+
+    def seed(self, guilds: Iterable[discord.Guild]):
+        for guild in guilds:
+            self.update(guild)
+
+    def update(self, guild: discord.Guild):
+        counts = self.get(guild.shard_id)
+        counts.guild_ids.add(guild.id)
+        if guild.unavailable:
+            counts.unavailable.add(guild.id)
+            return
+        counts.unavailable.discard(guild.id)
+        if counts.alerted and self.ratio(guild.shard_id) >= self.threshold:
+            counts.alerted = False
+
+    def remove(self, guild: discord.Guild):
+        counts = self.get(guild.shard_id)
+        counts.guild_ids.discard(guild.id)
+        counts.unavailable.discard(guild.id)
+
+    def counts(self, shard_id: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Return the number of available guilds and the total, for a shard or the whole bot.
+        """
+        shards = self._shards.values() if shard_id is None else [self.get(shard_id)]
+        return (
+            sum(counts.available for counts in shards),
+            sum(len(counts.guild_ids) for counts in shards),
+        )
+
+    def ratio(self, shard_id: Optional[int] = None) -> float:
+        available, total = self.counts(shard_id)
+        return available / total if total else 1.0
+
+    def describe(self, shard_id: Optional[int] = None) -> str:
+        available, total = self.counts(shard_id)
+        if not total:
+            return "No server in cache."
+        return f"{available}/{total} servers available ({self.ratio(shard_id):.0%})."
+
+    def shard_ready(self, shard_id: int):
+        counts = self.get(shard_id)
+        bot = self.cog.bot
+        for guild_id in list(counts.guild_ids):
+            guild = bot.get_guild(guild_id)
+            if guild is None:
+                counts.guild_ids.discard(guild_id)
+                counts.unavailable.discard(guild_id)
+            elif guild.unavailable:
+                counts.unavailable.add(guild_id)
+            else:
+                counts.unavailable.discard(guild_id)
+        if counts.timer:
+            counts.timer.cancel()
+            counts.timer = None
+        if self.ratio(shard_id) < self.threshold:
+            counts.timer = asyncio.get_running_loop().call_later(
+                AVAILABILITY_GRACE, self._still_partial, shard_id
+            )
+
+    def _still_partial(self, shard_id: int):
+        counts = self.get(shard_id)
+        counts.timer = None
+        if counts.alerted or self.ratio(shard_id) >= self.threshold:
+            return
+        counts.alerted = True
+        self.cog.declare_event(
+            Event(
+                EVENT_TYPE.ON_SHARD_PARTIAL,
+                self.cog.bot,
+                shard_id=shard_id,
+                details=self.describe(shard_id),
+            )
+        )
+
+    def stop(self):
+        for counts in self._shards.values():
+            if counts.timer:
+                counts.timer.cancel()
+                counts.timer = None
@@ -0,0 +1,244 @@
+import asyncio
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+)
+
+from redbot.core.bot import Red
+
+from .const import LOG
+from .no_class import Case
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# Size of the buckets of each rollup, in seconds.
+PERIODS = {"hour": 3600, "day": 86400}
+# Buckets older than this are deleted, in seconds.
+RETENTION = {"hour": 14 * 86400, "day": 400 * 86400}
+# Closed cases are deleted after this time, in seconds. Rollups keep their downtime.
+CASE_RETENTION = 30 * 86400
+# Closed cases past their retention are looked for at most this often, in seconds.
+CASE_PRUNE_INTERVAL = 86400
+# Windows up to this size are computed from hourly rollups, larger ones from daily rollups.
+HOURLY_WINDOW_LIMIT = 2 * 86400
+# The exit code Red keeps until it is asked to shut down or restart.
+RUNNING_EXIT_CODE = 1
+
+
+def is_shutting_down(bot: Red) -> bool:
+    """
+    Tell if the bot is going down, as opposed to the cog being unloaded or reloaded.
+    """
+    return (
+        bot.is_closed() or getattr(bot, "_shutdown_mode", RUNNING_EXIT_CODE) != RUNNING_EXIT_CODE
+    )
+
+
+def split_interval(start: float, end: float, size: int) -> Iterator[Tuple[int, float]]:
+    """
+    Split an interval into the buckets of ``size`` seconds it overlaps, yielding the start of
+    each bucket and the time of the interval spent in it.
+    """
+    bucket = int(start // size * size)
+    while bucket < end:
+        yield bucket, min(end, bucket + size) - max(start, bucket)
+        bucket += size
+
+
+class ShardAvailability(NamedTuple):
+    shard_id: int
+    downtime: float
+    outages: int
+    repair_time: float
+
+    @property
+    def mttr(self) -> float:
+        return self.repair_time / self.outages if self.outages else 0.0
+
+
+class SLAReport(NamedTuple):
+    window: float
+    shard_count: int
+    shards: List[ShardAvailability]
+    open_cases: List[Case]
+
+    @property
+    def downtime(self) -> float:
+        return sum(shard.downtime for shard in self.shards)
+
+    @property
+    def uptime(self) -> float:
+        """
+        Percentage of the time the shards were up during the window.
+        """
+        return max(0.0, 100 * (1 - self.downtime / (self.window * self.shard_count)))
+
+    @property
+    def mttr(self) -> float:
+        outages = sum(shard.outages for shard in self.shards)
+        return sum(shard.repair_time for shard in self.shards) / outages if outages else 0.0
+
+
+class CaseTracker:
+    """
+    Open a case when a shard goes down and close it when the shard is back.
+
+    Closed cases are folded into hourly and daily rollups of downtime, number of outages and
+    repair time per shard, so availability over a window only reads the buckets it covers.
+    Listeners only update the open cases in memory, writes happen in the background in order.
+    Closed cases are deleted after ``CASE_RETENTION``, the rollups keeping what they counted for.
+    """
+
+    def __init__(self, cog: "NowOnline"):
+        self.cog = cog
+        # Open cases, by shard ID.
+        self._open: Dict[int, Case] = {}
+        self._lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_prune = 0.0
+
+    async def load(self):
+        """
+        Load cases left open, and delete closed cases and rollups past their retention.
+
+        Cases opened by a shutdown are dropped if the bot is still connected, which means the cog
+        was only reloaded.
+        """
+        config = self.cog.config
+        for case_id, data in (await config.custom("case").all()).items():
+            if data.get("opened_at") is None or data.get("closed_at") is not None:
+                continue
+            case = Case.from_json(self.cog.bot, int(case_id), data)
+            if case.reason == "shutdown" and self.cog.bot.is_ready():
+                await config.custom("case", case_id).clear()
+                continue
+            self._open[case.shard_id] = case
+        await self._prune_cases()
+        now = time.time()
+        for period, retention in RETENTION.items():
+            for bucket in await config.custom("rollup", period).all():
+                if int(bucket) < now - retention:
+                    await config.custom("rollup", period, bucket).clear()
+
+    def _schedule(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def open(self, shard_id: int, reason: str = "disconnect"):
+        if shard_id in self._open:
+            return
+        case = Case(self.cog.bot, case_id=None, shard_id=shard_id, reason=reason)
+        self._open[shard_id] = case
+        self._schedule(self._save_open(case))
+
+    def close(self, shard_id: int):
+        case = self._open.pop(shard_id, None)
+        if case is None:
+            return
+        case.closed_at = time.time()
+        self._schedule(self._save_close(case))
+
+    async def shutdown(self, shard_ids: Iterable[int]):
+        """
+        Open a case for every shard as the bot goes down, and wait for pending writes.
+        """
+        for shard_id in shard_ids:
+            self.open(shard_id, "shutdown")
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _save_open(self, case: Case):
+        # The lock is fair, so a case is always saved before being closed.
+        async with self._lock:
+            try:
+                case.case_id = await self.cog.config.next_case_id()
+                await self.cog.config.next_case_id.set(case.case_id + 1)
+                await self.cog.config.custom("case", str(case.case_id)).set(case.to_json())
+            except Exception:
+                LOG.exception("Unable to open a case for shard %s.", case.shard_id)
+
+    async def _save_close(self, case: Case):
+        async with self._lock:
+            if case.case_id is None:
+                return
+            try:
+                await self.cog.config.custom("case", str(case.case_id)).set(case.to_json())
+                await self._add_to_rollups(case)
+                if time.time() - self._last_prune > CASE_PRUNE_INTERVAL:
+                    await self._prune_cases()
+            except Exception:
+                LOG.exception("Unable to save case #%s.", case.case_id)
+
+    async def _prune_cases(self):
+        """
+        Delete the cases closed for longer than ``CASE_RETENTION``, in a single write.
+        """
+        self._last_prune = now = time.time()
+        async with self.cog.config.custom("case").all() as cases:
+            expired = [
+                case_id
+                for case_id, data in cases.items()
+                if data.get("closed_at") is not None and data["closed_at"] < now - CASE_RETENTION
+            ]
+            for case_id in expired:
+                del cases[case_id]
+        if expired:
+            LOG.debug("Deleted %s closed case(s) past their retention.", len(expired))
+
+    async def _add_to_rollups(self, case: Case):
+        """
+        Add a closed case to the buckets it overlaps, writing each period once however long the
+        outage was.
+        """
+        shard = str(case.shard_id)
+        for period, size in PERIODS.items():
+            async with self.cog.config.custom("rollup", period).all() as buckets:
+                # Values left to their default are not stored.
+                for bucket, seconds in split_interval(case.opened_at, case.closed_at, size):
+                    data = buckets.setdefault(str(bucket), {}).setdefault(shard, {})
+                    data["downtime"] = data.get("downtime", 0.0) + seconds
+                # Outages are counted in the bucket they ended in.
+                bucket = int(case.closed_at // size * size)
+                data = buckets.setdefault(str(bucket), {}).setdefault(shard, {})
+                data["outages"] = data.get("outages", 0) + 1
+                data["repair_time"] = data.get("repair_time", 0.0) + case.duration()
+
+    async def sla(self, window: float) -> SLAReport:
+        """
+        Compute the availability of every shard over the last ``window`` seconds.
+
+        Buckets are counted whole, so the start of the window is rounded down to an hour, or a
+        day for windows over two days.
+        """
+        period = "hour" if window <= HOURLY_WINDOW_LIMIT else "day"
+        now = time.time()
+        since = now - window
+        totals: Dict[int, List[float]] = {}
+        for bucket, shards in (await self.cog.config.custom("rollup", period).all()).items():
+            if int(bucket) + PERIODS[period] <= since:
+                continue
+            for shard_id, data in shards.items():
+                total = totals.setdefault(int(shard_id), [0.0, 0, 0.0])
+                total[0] += data.get("downtime", 0.0)
+                total[1] += data.get("outages", 0)
+                total[2] += data.get("repair_time", 0.0)
+        for case in self._open.values():
+            # Ongoing outages only count toward downtime.
+            totals.setdefault(case.shard_id, [0.0, 0, 0.0])[0] += now - max(case.opened_at, since)
+        return SLAReport(
+            window=window,
+            shard_count=self.cog.bot.shard_count or 1,
+            shards=[
+                ShardAvailability(shard_id, *total) for shard_id, total in sorted(totals.items())
+            ],
+            open_cases=sorted(self._open.values(), key=lambda case: case.opened_at),
+        )
@@ -0,0 +1,395 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import socket
+import sys
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, Union
+
+from .const import LOG
+from .no_class import EVENT_TYPE, Event
+from .shards import ShardState
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# A Unix socket path, or a host and port on the loopback interface.
+Address = Union[str, Tuple[str, int]]
+
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+# Collectors send their shard map at least this often, in seconds.
+MAP_INTERVAL = 15.0
+# Maximum time between two connection attempts of a collector, in seconds.
+RECONNECT_MAX_DELAY = 30.0
+# The same event of the same shard received again within this window is dropped, in seconds.
+DEDUP_WINDOW = 60.0
+# Maximum size of a record, in bytes.
+RECORD_LIMIT = 2**20
+# Time a collector has to answer the challenge of the aggregator, in seconds.
+HANDSHAKE_TIMEOUT = 10.0
+SECRET_REQUIRED = (
+    "A shared secret is required to use a port. Set the same one on every instance with "
+    "`[p]set api nowonline cluster_secret,<secret>`."
+)
+
+
+def parse_address(text: str) -> Address:
+    """
+    Parse a port, a ``host:port`` on the loopback interface, or the path of a Unix socket.
+    """
+    if text.isdigit():
+        return "127.0.0.1", int(text)
+    host, _, port = text.rpartition(":")
+    if port.isdigit() and host:
+        host = host.strip("[]")
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError("Only the loopback interface can be used.")
+        return host, int(port)
+    if sys.platform == "win32":
+        raise ValueError("Unix sockets are not available on Windows, use a port instead.")
+    return os.path.abspath(os.path.expanduser(text))
+
+
+def format_address(address: Address) -> str:
+    return address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+
+
+def default_instance_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def encode(record: dict) -> bytes:
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def sign(secret: Optional[str], challenge: str) -> str:
+    """
+    Answer a challenge of the aggregator, proving the secret is known without sending it.
+    """
+    return hmac.new((secret or "").encode(), challenge.encode(), "sha256").hexdigest()
+
+
+class InstanceStatus:
+    """
+    The last known state of the shards of another instance.
+    """
+
+    __slots__ = ("name", "shards", "last_seen", "connected")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shards: Dict[int, ShardState] = {}
+        self.last_seen = time.time()
+        self.connected = True
+
+
+class ClusterCollector:
+    """
+    Forward declared events and the shard map of this instance to an aggregator.
+
+    Records are single lines of compact JSON. The collector first answers a challenge of the
+    aggregator with the shared secret. Events are only forwarded while connected, and they are
+    recorded in the local outbox first. They are acknowledged there once the aggregator confirms
+    it took them over. Events not confirmed when the connection is lost are alerted by this
+    instance, and so are the events left in the outbox after a restart.
+    """
+
+    def __init__(
+        self, cog: "NowOnline", address: Address, name: str, secret: Optional[str] = None
+    ):
+        self.cog = cog
+        self.address = address
+        self.name = name
+        self.secret = secret
+        self._queue: "asyncio.Queue[Event]" = asyncio.Queue()
+        # Events written to the aggregator and not confirmed yet, by outbox ID.
+        self._unconfirmed: Dict[int, Event] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._fall_back()
+
+    def forward(self, event: Event) -> bool:
+        """
+        Record an event in the outbox and queue it for the aggregator. Returns False if it must
+        be alerted locally.
+        """
+        if self._writer is None:
+            return False
+        self.cog.outbox.record(event)
+        self._queue.put_nowait(event)
+        return True
+
+    def _fall_back(self):
+        events = list(self._unconfirmed.values())
+        self._unconfirmed.clear()
+        while not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        # Already recorded in the outbox.
+        self.cog.coalescer.replay(events)
+
+    def _map_record(self) -> dict:
+        return {
+            "k": "m",
+            "i": self.name,
+            "s": [
+                [status.shard_id, int(status.state)] for status in self.cog.shard_monitor.shards
+            ],
+        }
+
+    def _event_record(self, event: Event) -> dict:
+        return {
+            "k": "e",
+            "i": self.name,
+            "n": event.outbox_id,
+            "t": event.event_type,
+            "s": event.shard_id,
+            "d": event.details,
+            "c": event.created_at.timestamp(),
+        }
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if isinstance(self.address, str):
+            reader, writer = await asyncio.open_unix_connection(self.address, limit=RECORD_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(*self.address, limit=RECORD_LIMIT)
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=HANDSHAKE_TIMEOUT)
+            challenge = json.loads(line)["c"]
+            writer.write(encode({"k": "h", "i": self.name, "m": sign(self.secret, challenge)}))
+            await writer.drain()
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _read_confirmations(self, reader: asyncio.StreamReader):
+        while line := await reader.readline():
+            try:
+                record = json.loads(line)
+                if record["k"] == "a":
+                    self.cog.outbox.ack(
+                        [
+                            self._unconfirmed.pop(event_id)
+                            for event_id in record["n"]
+                            if event_id in self._unconfirmed
+                        ]
+                    )
+            except (ValueError, KeyError, TypeError):
+                LOG.warning("Ignoring an invalid record from the aggregator.")
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError) as error:
+                LOG.debug("Unable to reach the aggregator: %s", error)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            connected_at = time.monotonic()
+            LOG.info("Forwarding events to the aggregator at %s.", format_address(self.address))
+            self._writer = writer
+            confirmations = asyncio.create_task(self._read_confirmations(reader))
+            try:
+                writer.write(encode(self._map_record()))
+                await writer.drain()
+                while not confirmations.done():
+                    try:
+                        event = await asyncio.wait_for(self._queue.get(), timeout=MAP_INTERVAL)
+                    except asyncio.TimeoutError:
+                        record = self._map_record()
+                    else:
+                        self._unconfirmed[event.outbox_id] = event
+                        record = self._event_record(event)
+                    writer.write(encode(record))
+                    await writer.drain()
+                # The aggregator closed the connection, such as for a wrong secret.
+                LOG.warning("The aggregator closed the connection.")
+            except (OSError, ConnectionError) as error:
+                LOG.warning("Lost the connection to the aggregator: %s", error)
+            finally:
+                self._writer = None
+                confirmations.cancel()
+                writer.close()
+                # Anything not confirmed yet is alerted by this instance.
+                self._fall_back()
+            if time.monotonic() - connected_at < RECONNECT_MAX_DELAY:
+                # Connections closed right away, such as for a wrong secret, are retried later.
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            else:
+                delay = 1.0
+
+
+class ClusterAggregator:
+    """
+    Receive events and shard maps from collectors, and alert them along with local events.
+
+    Events go through the same coalescer as local ones, so an outage spanning several instances
+    ends up in a single message. Each event is confirmed to its collector once recorded in the
+    outbox of this instance. An event received again within ``DEDUP_WINDOW`` seconds, such as
+    after a collector reconnects before getting its confirmation, is dropped. Collectors must
+    answer a challenge with the shared secret before sending anything.
+    """
+
+    def __init__(self, cog: "NowOnline", address: Address, secret: Optional[str] = None):
+        self.cog = cog
+        self.address = address
+        self.secret = secret
+        self.instances: Dict[str, InstanceStatus] = {}
+        self._seen: Dict[Tuple[str, Union[int, str], float], float] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        if self._server is not None:
+            return
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                # Left by a previous process.
+                os.unlink(self.address)
+            # The socket is created only accessible by this user, rather than restricted after.
+            umask = os.umask(0o077)
+            try:
+                self._server = await asyncio.start_unix_server(
+                    self._handle, self.address, limit=RECORD_LIMIT
+                )
+            finally:
+                os.umask(umask)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, *self.address, limit=RECORD_LIMIT
+            )
+        LOG.info("Aggregating events from collectors at %s.", format_address(self.address))
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Open connections are closed too, or waiting for the server would never end.
+        for writer in self._writers:
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def forward(self, event: Event) -> bool:
+        # Local events are alerted by this instance.
+        return False
+
+    async def _handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        challenge = secrets.token_hex(16)
+        writer.write(encode({"k": "c", "c": challenge}))
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout=HANDSHAKE_TIMEOUT)
+        record = json.loads(line)
+        return record.get("k") == "h" and hmac.compare_digest(
+            str(record.get("m")), sign(self.secret, challenge)
+        )
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        instance: Optional[InstanceStatus] = None
+        self._writers.add(writer)
+        try:
+            if not await self._handshake(reader, writer):
+                LOG.warning("Refused a collector that does not know the shared secret.")
+                return
+            while line := await reader.readline():
+                try:
+                    record = json.loads(line)
+                    instance = self.receive(record)
+                except (ValueError, KeyError, TypeError):
+                    LOG.warning("Ignoring an invalid record from a collector.")
+                    continue
+                if record["k"] == "e" and record.get("n") is not None:
+                    writer.write(encode({"k": "a", "n": [record["n"]]}))
+                    await writer.drain()
+        except (
+            OSError,
+            ConnectionError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+            ValueError,
+            AttributeError,
+        ):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+            if instance is not None:
+                instance.connected = False
+                LOG.warning("The collector %s disconnected.", instance.name)
+
+    def receive(self, record: dict) -> InstanceStatus:
+        name = str(record["i"])
+        instance = self.instances.get(name)
+        if instance is None:
+            instance = self.instances[name] = InstanceStatus(name)
+        instance.last_seen = time.time()
+        instance.connected = True
+        if record["k"] == "m":
+            instance.shards = {int(shard_id): ShardState(state) for shard_id, state in record["s"]}
+        elif record["k"] == "e":
+            self._receive_event(instance, record)
+        return instance
+
+    def _receive_event(self, instance: InstanceStatus, record: dict):
+        event_type, shard_id = EVENT_TYPE[record["t"]], record["s"]
+        now = time.time()
+        # Bot-wide events are told apart by instance, shard events by shard only. The time the
+        # event happened at keeps real repeated events, such as a shard going down twice.
+        key = (
+            event_type.name,
+            instance.name if shard_id is None else int(shard_id),
+            float(record["c"]),
+        )
+        if now - self._seen.get(key, 0.0) < DEDUP_WINDOW:
+            return
+        self._seen[key] = now
+        if len(self._seen) > 1024:
+            self._seen = {
+                seen_key: seen_at
+                for seen_key, seen_at in self._seen.items()
+                if now - seen_at < DEDUP_WINDOW
+            }
+        details = f"From {instance.name}."
+        if record.get("d"):
+            details += f"\n{record['d']}"
+        event = Event(event_type, self.cog.bot, shard_id=shard_id, details=details)
+        event.created_at = datetime.fromtimestamp(record["c"])
+        self.cog.log_event(event.event_type, event.shard_id)
+        self.cog.coalescer.push(event)
+
+    def shard_map(self) -> Dict[int, Tuple[str, ShardState]]:
+        """
+        Merge the shards of every instance with the local ones, by shard ID.
+        """
+        shards = {
+            status.shard_id: ("local", status.state) for status in self.cog.shard_monitor.shards
+        }
+        for instance in sorted(self.instances.values(), key=lambda instance: instance.last_seen):
+            for shard_id, state in instance.shards.items():
+                shards[shard_id] = (instance.name, state)
+        return shards
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from typing import TYPE_CHECKING, List, Optional, Set
+
+from .const import LOG
+from .no_class import Event, EventSummary
+from .outbox import Outbox
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# Events arriving less than this many seconds apart are merged into the same message.
+COALESCE_WINDOW = 5.0
+# A message is sent after this many seconds even if events keep coming.
+MAX_WINDOW = 30.0
+# Time to wait before sending again events that could not be delivered.
+RETRY_DELAY = 30.0
+# Events still not delivered to some destinations after this many retries are dropped.
+MAX_RETRIES = 10
+
+
+class EventCoalescer:
+    """
+    Collect declared events in a queue and send them in batches.
+
+    Listeners only push events, they never wait for Discord. A single task drains the queue: it
+    waits for a quiet period of ``window`` seconds (``max_window`` at most) and sends everything
+    collected so far as one message, so a reconnect storm over many shards does not turn into
+    hundreds of messages.
+
+    Events are recorded in the outbox when pushed and acknowledged once delivered to every
+    destination. If some destinations failed, the same message is sent again later to those
+    only, so the others do not get it twice, up to ``max_retries`` times before it is dropped.
+    Retries run on their own, so new events keep being sent to every destination meanwhile.
+    """
+
+    def __init__(
+        self,
+        cog: "NowOnline",
+        outbox: Outbox,
+        *,
+        window: float = COALESCE_WINDOW,
+        max_window: float = MAX_WINDOW,
+        retry_delay: float = RETRY_DELAY,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.cog = cog
+        self.outbox = outbox
+        self.window = window
+        self.max_window = max_window
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._queue: "asyncio.Queue[Event]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._retries: Set[asyncio.Task] = set()
+
+    def push(self, event: Event):
+        """
+        Record an event in the outbox and queue it for delivery.
+        """
+        self.outbox.record(event)
+        self._queue.put_nowait(event)
+
+    def replay(self, events: List[Event]):
+        """
+        Queue events loaded from the outbox, which are already recorded.
+        """
+        for event in events:
+            self._queue.put_nowait(event)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._retries:
+            task.cancel()
+        self._retries.clear()
+
+    async def _collect(self) -> List[Event]:
+        events = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_window
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                events.append(
+                    await asyncio.wait_for(self._queue.get(), timeout=min(self.window, remaining))
+                )
+            except asyncio.TimeoutError:
+                break
+        return events
+
+    async def _send(self, events: List[Event], channel_ids: Optional[Set[int]]) -> Set[int]:
+        await self.outbox.flush()
+        try:
+            return await self.cog.send_alert(
+                EventSummary(events, self.cog.bot).to_embed(), channel_ids=channel_ids
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            LOG.exception("Unable to send %s event(s).", len(events))
+            return set()
+
+    async def _loop(self):
+        while True:
+            events = await self._collect()
+            # Events keep being collected while Red is not ready, and are sent all at once.
+            await self.cog.bot.wait_until_red_ready()
+            while not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            failed = await self._send(events, None)
+            if not failed:
+                self.outbox.ack(events)
+                continue
+            task = asyncio.create_task(self._retry(events, failed))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    async def _retry(self, events: List[Event], failed: Set[int]):
+        """
+        Send a message again to the channels that did not get it, without new events mixed in.
+        """
+        for _ in range(self.max_retries):
+            LOG.info(
+                "%s event(s) will be sent again to %s channel(s) in %ss.",
+                len(events),
+                len(failed),
+                self.retry_delay,
+            )
+            await asyncio.sleep(self.retry_delay)
+            failed = await self._send(events, failed)
+            if not failed:
+                break
+        else:
+            LOG.warning(
+                "Dropping %s event(s) that could not be sent to %s channel(s) after %s retries.",
+                len(events),
+                len(failed),
+                self.max_retries,
+            )
+        self.outbox.ack(events)
@@ -0,0 +1,413 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import discord
+from redbot.core import commands
+from redbot.core.utils.chat_formatting import bold, pagify
+
+from .abc import ABCMeta, MixinMeta
+from .cluster import ClusterAggregator, format_address, parse_address
+from .eventlog import EVENT_CODES
+from .no_class import Case, format_shard_ranges
+from .shards import humanize_duration
+
+SLA_PERIOD = commands.TimedeltaConverter(
+    minimum=timedelta(hours=1), maximum=timedelta(days=400), default_unit="days"
+)
+# Number of events listed by the events command, the others are only counted.
+EVENTS_SHOWN = 50
+EVENTS_WINDOW = commands.TimedeltaConverter(
+    minimum=timedelta(minutes=1), maximum=timedelta(days=400), default_unit="days"
+)
+LATENCY_WINDOW = commands.TimedeltaConverter(
+    minimum=timedelta(minutes=1), maximum=timedelta(days=7), default_unit="hours"
+)
+
+
+def find_event_type(name: str) -> str:
+    """
+    Find an event type from a short name, such as `disconnect` for shard disconnections.
+    """
+    name = name.upper()
+    for candidate in (f"ON_SHARD_{name}", f"ON_{name}", name):
+        if candidate in EVENT_CODES:
+            return candidate
+    raise commands.BadArgument(
+        f"Unknown event type. Available types: {', '.join(name.lower() for name in EVENT_CODES)}."
+    )
+
+
+class Commands(MixinMeta, metaclass=ABCMeta):
+    @commands.group(name="nowonline")
+    @commands.is_owner()
+    async def nowonline(self, ctx: commands.Context):
+        """
+        Get alerted about your bot's connection status.
+        """
+
+    @nowonline.group(name="set")
+    async def settings(self, ctx: commands.Context):
+        """
+        Change when alerts are sent.
+        """
+
+    @settings.command(name="downthreshold")
+    async def set_down_threshold(self, ctx: commands.Context, seconds: float):
+        """
+        Set how long a shard must stay disconnected before being alerted.
+
+        Shards coming back sooner are counted as flaps instead.
+        """
+        if seconds < 0:
+            return await ctx.send("The threshold cannot be negative.")
+        await self.config.down_threshold.set(seconds)
+        await self.shard_monitor.load_settings()
+        await ctx.send(
+            f"Shards will be alerted after being down for {humanize_duration(seconds)}."
+        )
+
+    @settings.command(name="flaps")
+    async def set_flap_rate(self, ctx: commands.Context, count: int, window: float):
+        """
+        Alert when a shard reconnects `count` times within `window` seconds.
+        """
+        if count < 1 or window <= 0:
+            return await ctx.send("The count and the window must be positive.")
+        await self.config.flap_threshold.set(count)
+        await self.config.flap_window.set(window)
+        await self.shard_monitor.load_settings()
+        await ctx.send(
+            f"Shards reconnecting {count} times within {humanize_duration(window)} will be alerted."
+        )
+
+    @settings.command(name="latencythreshold")
+    async def set_latency_threshold(self, ctx: commands.Context, milliseconds: int):
+        """
+        Alert when the p95 heartbeat latency of a shard goes above this value.
+        """
+        if milliseconds <= 0:
+            return await ctx.send("The threshold must be positive.")
+        await self.config.latency_threshold.set(milliseconds / 1000)
+        await self.latency.load_settings()
+        await ctx.send(f"Shards will be alerted above a p95 latency of {milliseconds} ms.")
+
+    @settings.command(name="availability")
+    async def set_availability_threshold(self, ctx: commands.Context, percent: int):
+        """
+        Alert when a shard stays under this percentage of available servers once ready.
+        """
+        if not 0 <= percent <= 100:
+            return await ctx.send("The percentage must be between 0 and 100.")
+        await self.config.availability_threshold.set(percent / 100)
+        await self.availability.load_settings()
+        await ctx.send(
+            f"Shards with less than {percent}% of their servers available will be alerted."
+        )
+
+    @settings.command(name="metrics")
+    async def set_metrics_port(self, ctx: commands.Context, port: Optional[int] = None):
+        """
+        Serve metrics for Prometheus on this port, at `http://127.0.0.1:<port>/metrics`.
+
+        The endpoint is only reachable from this machine. Leave empty to stop serving metrics.
+        """
+        if port is None:
+            await self.config.metrics_port.clear()
+            await self.metrics_server.stop()
+            return await ctx.send("Metrics are no longer served.")
+        if not 1024 <= port <= 65535:
+            return await ctx.send("The port must be between 1024 and 65535.")
+        try:
+            await self.metrics_server.start(port)
+        except OSError as error:
+            return await ctx.send(f"Unable to listen on port {port}: {error}")
+        await self.config.metrics_port.set(port)
+        await ctx.send(f"Metrics are served at `http://127.0.0.1:{port}/metrics`.")
+
+    @nowonline.command(name="channel")
+    @commands.guild_only()
+    async def set_alert_channel(
+        self, ctx: commands.Context, channel: Optional[discord.TextChannel] = None
+    ):
+        """
+        Set the channel of this guild where alerts are sent. Leave empty to stop sending alerts here.
+        """
+        if channel is None:
+            await self.config.guild(ctx.guild).channel.clear()
+            self.delivery.invalidate()
+            return await ctx.send("Alerts will no longer be sent in this guild.")
+        permissions = channel.permissions_for(ctx.guild.me)
+        if not (permissions.send_messages and permissions.embed_links):
+            return await ctx.send("I need to send messages and embed links in this channel.")
+        await self.config.guild(ctx.guild).channel.set(channel.id)
+        self.delivery.invalidate()
+        await ctx.send(f"Alerts will be sent in {channel.mention}.")
+
+    @nowonline.command(name="pingrole")
+    @commands.guild_only()
+    async def set_ping_role(self, ctx: commands.Context, *, role: Optional[discord.Role] = None):
+        """
+        Set a role to mention along with alerts in this guild. Leave empty to stop mentioning.
+        """
+        if role is None:
+            await self.config.guild(ctx.guild).ping_role.clear()
+            self.delivery.invalidate()
+            return await ctx.send("No role will be mentioned with alerts.")
+        await self.config.guild(ctx.guild).ping_role.set(role.id)
+        self.delivery.invalidate()
+        await ctx.send(f"{role.name} will be mentioned with alerts.")
+
+    @nowonline.command(name="shards")
+    async def show_shards(self, ctx: commands.Context):
+        """
+        Show the state of every shard.
+        """
+        shards = self.shard_monitor.shards
+        if not shards:
+            return await ctx.send("No shard event has been seen yet.")
+        lines = [
+            f"Shard {status.shard_id}: {status.state.name.lower()} since <t:{int(status.since)}:R>"
+            + (f", {status.flaps} flap(s) recently" if status.flaps else "")
+            for status in shards
+        ]
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @nowonline.command(name="sla")
+    async def show_sla(
+        self,
+        ctx: commands.Context,
+        *,
+        period: SLA_PERIOD = timedelta(days=30),
+    ):
+        """
+        Show the availability of the bot over a period, 30 days by default.
+
+        Examples:
+        - `[p]nowonline sla 30d`
+        - `[p]nowonline sla 12h`
+        """
+        report = await self.cases.sla(period.total_seconds())
+        lines = [
+            f"Uptime: {bold(f'{report.uptime:.3f}%')} over {humanize_duration(report.window)} "
+            f"and {report.shard_count} shard(s).",
+            f"Downtime: {humanize_duration(report.downtime)}, "
+            f"MTTR: {humanize_duration(report.mttr)}.",
+        ]
+        if report.open_cases:
+            lines.append(
+                f"Ongoing: {len(report.open_cases)} shard(s) down since "
+                f"<t:{int(report.open_cases[0].opened_at)}:R>."
+            )
+        if report.shards:
+            lines.append("")
+            lines.extend(
+                f"Shard {shard.shard_id}: {shard.outages} outage(s), down for "
+                f"{humanize_duration(shard.downtime)}, MTTR {humanize_duration(shard.mttr)}"
+                for shard in sorted(report.shards, key=lambda shard: -shard.downtime)
+            )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @nowonline.command(name="case")
+    async def show_case(self, ctx: commands.Context, case: Case):
+        """
+        Show a downtime case.
+
+        Cases are deleted 30 days after they were closed.
+        """
+        await ctx.send(embed=case.to_embed())
+
+    @nowonline.command(name="latency")
+    async def show_latency(
+        self,
+        ctx: commands.Context,
+        window: LATENCY_WINDOW = timedelta(hours=1),
+        chart: bool = False,
+    ):
+        """
+        Show the heartbeat latency of every shard over a window, 1 hour by default.
+
+        Set `chart` to `True` to get a chart as well, which requires matplotlib.
+
+        Examples:
+        - `[p]nowonline latency 6h`
+        - `[p]nowonline latency 1d True`
+        """
+        stats = self.latency.stats(window.total_seconds())
+        if not stats:
+            return await ctx.send("No latency was sampled during this window yet.")
+        lines = [
+            f"Shard {shard.shard_id}: p50 {shard.p50 * 1000:.0f} ms, p95 {shard.p95 * 1000:.0f} ms, "
+            f"p99 {shard.p99 * 1000:.0f} ms, max {shard.max * 1000:.0f} ms ({shard.samples} samples)"
+            for shard in stats
+        ]
+        pages = list(pagify("\n".join(lines)))
+        for page in pages[:-1]:
+            await ctx.send(page)
+        file = None
+        if chart:
+            try:
+                file = await asyncio.get_running_loop().run_in_executor(
+                    None, self.latency.render_chart, window.total_seconds()
+                )
+            except ImportError:
+                pages[-1] += "\n\nInstall `matplotlib` in the bot's environment to get charts."
+        await ctx.send(pages[-1], file=file)
+
+    @nowonline.command(name="events")
+    async def show_events(
+        self,
+        ctx: commands.Context,
+        window: EVENTS_WINDOW = timedelta(days=7),
+        shard_id: Optional[int] = None,
+        event_type: Optional[find_event_type] = None,
+    ):
+        """
+        Search the event log, 7 days by default.
+
+        Examples:
+        - `[p]nowonline events 7d 7 disconnect`: Disconnections of shard 7 in the last week.
+        - `[p]nowonline events 1d`: Every event of the last day.
+        """
+        since = time.time() - window.total_seconds()
+        events = self.event_log.query(since, event_type=event_type, shard_id=shard_id)
+        if not events:
+            return await ctx.send("No event matches this search.")
+        counts = Counter(event.event_type for event in events)
+        lines = [
+            f"{bold(str(len(events)))} event(s) found: "
+            + ", ".join(f"{count} {name.lower()}" for name, count in counts.most_common()),
+            "",
+        ]
+        if len(events) > EVENTS_SHOWN:
+            lines.append(f"Latest {EVENTS_SHOWN} events:")
+        lines.extend(
+            f"<t:{int(event.timestamp)}:f> - {event.event_type.lower()}"
+            + (f" - Shard {event.shard_id}" if event.shard_id is not None else "")
+            for event in events[-EVENTS_SHOWN:]
+        )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @nowonline.command(name="looplag")
+    async def show_loop_lag(self, ctx: commands.Context):
+        """
+        Show how late the event loop wakes up, and what blocked it recently.
+
+        A blocked event loop delays every cog and can make shards miss their heartbeat.
+        """
+        monitor = self.loop_lag
+        lines = monitor.histogram_lines()
+        if not lines:
+            return await ctx.send("The event loop has not been measured yet.")
+        lines = [
+            f"Event loop lag, measured every {monitor.interval}s "
+            f"(max {monitor.max_lag * 1000:.0f} ms):",
+            *lines,
+        ]
+        if monitor.spikes:
+            lines.extend(["", "Recent spikes:"])
+            lines.extend(
+                f"<t:{int(spike.timestamp)}:T> - {spike.lag * 1000:.0f} ms"
+                + (f" - {spike.culprit}" if spike.culprit else "")
+                for spike in reversed(monitor.spikes)
+            )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @nowonline.group(name="cluster")
+    async def cluster(self, ctx: commands.Context):
+        """
+        Alert events of several instances of this bot together.
+
+        One instance aggregates events, the others collect and forward theirs to it, over a Unix
+        socket or a port on the loopback interface. The aggregator merges them, drops duplicates
+        and alerts them as usual. Collectors alert their events themselves while the aggregator
+        cannot be reached.
+
+        A port requires a shared secret, set the same one on every instance with
+        `[p]set api nowonline cluster_secret,<secret>`.
+        """
+
+    @cluster.command(name="aggregate")
+    async def cluster_aggregate(self, ctx: commands.Context, address: str):
+        """
+        Receive events from collectors on this address.
+
+        The address is either a port, such as `8765`, or the path of a Unix socket.
+        """
+        await self._set_cluster_mode(ctx, "aggregator", address)
+
+    @cluster.command(name="collect")
+    async def cluster_collect(
+        self, ctx: commands.Context, address: str, *, name: Optional[str] = None
+    ):
+        """
+        Forward events to the aggregator at this address.
+
+        The name tells this instance apart in alerts, it defaults to the host and process ID.
+        """
+        await self.config.cluster_name.set(name)
+        await self._set_cluster_mode(ctx, "collector", address)
+
+    async def _set_cluster_mode(self, ctx: commands.Context, mode: str, address: str):
+        try:
+            parse_address(address)
+        except ValueError as error:
+            return await ctx.send(str(error))
+        await self.config.cluster_mode.set(mode)
+        await self.config.cluster_address.set(address)
+        try:
+            await self.start_cluster()
+        except (OSError, ValueError) as error:
+            await self.config.cluster_mode.clear()
+            return await ctx.send(
+                f"Unable to use `{address}`: {str(error).replace('[p]', ctx.clean_prefix)}"
+            )
+        await ctx.send(f"This instance is now the {mode} at `{address}`.")
+
+    @cluster.command(name="off")
+    async def cluster_off(self, ctx: commands.Context):
+        """
+        Alert the events of this instance alone.
+        """
+        await self.config.cluster_mode.clear()
+        await self.stop_cluster()
+        await ctx.send("This instance now alerts its events alone.")
+
+    @cluster.command(name="status")
+    async def cluster_status(self, ctx: commands.Context):
+        """
+        Show the cluster mode, and the shards of every instance for an aggregator.
+        """
+        cluster = self.cluster
+        if cluster is None:
+            return await ctx.send("This instance alerts its events alone.")
+        if not isinstance(cluster, ClusterAggregator):
+            state = "connected" if cluster.connected else "not connected"
+            return await ctx.send(
+                f"Collecting events as {bold(cluster.name)}, {state} to the aggregator at "
+                f"`{format_address(cluster.address)}`."
+            )
+        lines = [f"Aggregating events at `{format_address(cluster.address)}`."]
+        for instance in sorted(cluster.instances.values(), key=lambda instance: instance.name):
+            lines.append(
+                f"{bold(instance.name)}: "
+                + ("connected" if instance.connected else "disconnected")
+                + f", last seen <t:{int(instance.last_seen)}:R>"
+            )
+        by_state: Dict[str, List[int]] = {}
+        for shard_id, (_instance, state) in cluster.shard_map().items():
+            by_state.setdefault(state.name.lower(), []).append(shard_id)
+        if by_state:
+            lines.append("")
+            lines.extend(
+                f"{state.capitalize()}: {format_shard_ranges(shard_ids)}"
+                for state, shard_ids in sorted(by_state.items())
+            )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
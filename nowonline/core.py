@@ -1,18 +1,63 @@
-from typing import Optional
+import asyncio
+from typing import Collection, List, Optional, Set, Union
 
+import discord
 from redbot.core import Config, commands
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 
 from .abc import CompositeMetaClass
+from .availability import AvailabilityTracker
+from .cases import CaseTracker, is_shutting_down
+from .cluster import (
+    SECRET_REQUIRED,
+    ClusterAggregator,
+    ClusterCollector,
+    default_instance_name,
+    parse_address,
+)
+from .coalescer import EventCoalescer
+from .commands import Commands
 from .const import LOG
+from .delivery import AlertDelivery
+from .eventlog import EventLog
 from .events import Events
-from .no_class import Event
+from .latency import LatencySampler
+from .looplag import LoopLagMonitor
+from .metrics import Metrics, MetricsServer
+from .no_class import EVENT_TYPE, Event, format_shard_ranges
+from .outbox import Outbox
+from .resync import GuildSnapshot
+from .shards import ShardMonitor, humanize_duration
 
-DEFAULT_CASE_CONFIG = {}
+# Number of servers listed for each change in the resync report, the others are only counted.
+RESYNC_LISTED = 10
+
+DEFAULT_CASE_CONFIG = {"shard_id": None, "reason": None, "opened_at": None, "closed_at": None}
+DEFAULT_ROLLUP_CONFIG = {"downtime": 0.0, "outages": 0, "repair_time": 0.0}
 DEFAULT_GUILD_CONFIG = {"channel": None, "ping_role": None}
+DEFAULT_GLOBAL_CONFIG = {
+    # Seconds a shard must stay down before being alerted.
+    "down_threshold": 30.0,
+    # Number of short outages within flap_window seconds to alert a flapping shard.
+    "flap_threshold": 3,
+    "flap_window": 300.0,
+    "next_case_id": 1,
+    # Seconds of p95 heartbeat latency above which a shard is alerted.
+    "latency_threshold": 1.0,
+    # Port of the local metrics endpoint, disabled when None.
+    "metrics_port": None,
+    # Ratio of available servers under which a shard is alerted once ready.
+    "availability_threshold": 0.9,
+    # "aggregator" or "collector" to alert along with other instances, alone when None.
+    "cluster_mode": None,
+    "cluster_address": None,
+    # Name of this instance in the aggregator's alerts, defaults to the host and process ID.
+    "cluster_name": None,
+}
 
 
-class NowOnline(Events, commands.Cog, name="NowOnline", metaclass=CompositeMetaClass):
+class NowOnline(Commands, Events, commands.Cog, name="NowOnline", metaclass=CompositeMetaClass):
     def __init__(self, bot: Red):
         self.bot = bot
         self.config: Config = Config.get_conf(
@@ -23,12 +68,32 @@ class NowOnline(Events, commands.Cog, name="NowOnline", metaclass=CompositeMetaC
         )
 
         self.config.register_guild(**DEFAULT_GUILD_CONFIG)
+        self.config.register_global(**DEFAULT_GLOBAL_CONFIG)
 
-        # I still would like to determine how to make things correct here before registering anything.
-        # self.config.init_custom("case", 1)
-        # self.config.register_custom("case", **DEFAULT_CASE_CONFIG)
+        self.config.init_custom("case", 1)
+        self.config.register_custom("case", **DEFAULT_CASE_CONFIG)
+        # Identified by period ("hour" or "day"), start of the bucket and shard ID.
+        self.config.init_custom("rollup", 3)
+        self.config.register_custom("rollup", **DEFAULT_ROLLUP_CONFIG)
 
         self._last_known_name: Optional[str] = None
+        self.outbox = Outbox(cog_data_path(self) / "outbox.jsonl")
+        self.coalescer = EventCoalescer(self, self.outbox)
+        self.shard_monitor = ShardMonitor(self)
+        self.delivery = AlertDelivery(self)
+        self.cases = CaseTracker(self)
+        self.latency = LatencySampler(self)
+        self.availability = AvailabilityTracker(self)
+        self.loop_lag = LoopLagMonitor(self)
+        self.metrics = Metrics(self)
+        self.metrics_server = MetricsServer(self.metrics)
+        self.event_log = EventLog(cog_data_path(self) / "events")
+        # Guilds the bot was in when the first shard went down, compared once all are back.
+        self._snapshot: Optional[GuildSnapshot] = None
+        self.cluster: Optional[Union[ClusterAggregator, ClusterCollector]] = None
+        self._name_task: Optional[asyncio.Task] = None
+        # Reports the resync if some shards are still not back after a while.
+        self._resync_task: Optional[asyncio.Task] = None
 
     def find_bot_name(self):
         """
@@ -42,14 +107,89 @@ class NowOnline(Events, commands.Cog, name="NowOnline", metaclass=CompositeMetaC
             )
             self._last_known_name = self.bot.user.name
 
+    def take_snapshot(self):
+        """
+        Remember the guilds the bot is in, unless an outage is already ongoing.
+        """
+        if self._snapshot is None:
+            self._snapshot = GuildSnapshot.take(guild.id for guild in self.bot.guilds)
+
     async def fetch_from_last_connect(self):
         """
         A function to call when we're reconnected to the gateway, so we can fetch all needed
         informations we might need to insert in the cache.
+
+        The guilds in cache are compared with the snapshot taken at disconnect, and the servers
+        joined, left and still unavailable are reported along with the shards that are not back,
+        in a single event. Nothing is fetched per guild. This runs once every shard is back, or
+        ``down_threshold`` after the first one came back if others are still missing.
         """
-        pass
+        snapshot, self._snapshot = self._snapshot, None
+        if snapshot is None:
+            return
+        current = GuildSnapshot.take(guild.id for guild in self.bot.guilds)
+        left, joined = snapshot.diff(current)
+        unavailable = [guild.id for guild in self.bot.guilds if guild.unavailable]
+        missing = self.shard_monitor.not_up(range(self.bot.shard_count or 1))
+        away = current.taken_at - snapshot.taken_at
+        if not (left or joined or unavailable or missing) and away < (
+            self.shard_monitor.down_threshold
+        ):
+            return
+
+        def listed(guild_ids: List[int]) -> str:
+            names = []
+            for guild_id in guild_ids[:RESYNC_LISTED]:
+                guild = self.bot.get_guild(guild_id)
+                names.append(guild.name if guild and guild.name else str(guild_id))
+            if len(guild_ids) > RESYNC_LISTED:
+                names.append(f"and {len(guild_ids) - RESYNC_LISTED} more")
+            return ", ".join(names)
+
+        lines = [f"Away for {humanize_duration(away)}."]
+        if joined:
+            lines.append(f"Joined {len(joined)} server(s): {listed(joined)}")
+        if left:
+            lines.append(f"Left {len(left)} server(s): {listed(left)}")
+        if unavailable:
+            lines.append(f"{len(unavailable)} server(s) still unavailable: {listed(unavailable)}")
+        if missing:
+            lines.append(f"{format_shard_ranges(missing)} not back yet.")
+        if len(lines) == 1:
+            lines.append("No server was joined or left.")
+        self.declare_event(Event(EVENT_TYPE.ON_RESYNC, self.bot, details="\n".join(lines)))
 
     async def cog_load(self):
+        self.event_log.open()
+        snapshot = GuildSnapshot.load(cog_data_path(self) / "guilds.snapshot")
+        if snapshot is not None and not self.bot.is_ready():
+            # Saved when the bot shut down, compared once it is ready again.
+            self._snapshot = snapshot
+        await self.shard_monitor.load_settings()
+        await self.cases.load()
+        await self.latency.load_settings()
+        await self.availability.load_settings()
+        if self.bot.is_ready():
+            # Reloaded while connected, guild events will keep the counts up to date.
+            self.availability.seed(self.bot.guilds)
+        if pending := self.outbox.load(self.bot):
+            LOG.info("[cog_load] %s undelivered event(s) will be sent again.", len(pending))
+            self.coalescer.replay(pending)
+        self.coalescer.start()
+        self.latency.start()
+        self.loop_lag.start()
+        if port := await self.config.metrics_port():
+            try:
+                await self.metrics_server.start(port)
+            except OSError:
+                LOG.exception("[cog_load] Unable to serve metrics on port %s.", port)
+        try:
+            await self.start_cluster()
+        except (OSError, ValueError):
+            LOG.exception("[cog_load] Unable to start the cluster mode.")
+        self._name_task = asyncio.create_task(self._retrieve_bot_name())
+
+    async def _retrieve_bot_name(self):
         LOG.debug("[cog_load] Waiting until Red is connected to retrieve name.")
         await self.bot.wait_until_red_ready()
         LOG.debug("[cog_load] Retrieving bot's name.")
@@ -57,24 +197,82 @@ class NowOnline(Events, commands.Cog, name="NowOnline", metaclass=CompositeMetaC
 
         LOG.info("[cog_load] NowOnline is now loaded and available.")
 
-    async def declare_event(self, event: Event):
+    async def start_cluster(self):
+        """
+        Start aggregating or collecting events as configured, stopping the previous mode.
+        """
+        await self.stop_cluster()
+        mode = await self.config.cluster_mode()
+        if mode is None:
+            return
+        address = parse_address(await self.config.cluster_address())
+        secret = (await self.bot.get_shared_api_tokens("nowonline")).get("cluster_secret")
+        if not isinstance(address, str) and not secret:
+            raise ValueError(SECRET_REQUIRED)
+        if mode == "aggregator":
+            cluster = ClusterAggregator(self, address, secret)
+        else:
+            name = await self.config.cluster_name() or default_instance_name()
+            cluster = ClusterCollector(self, address, name, secret)
+        await cluster.start()
+        self.cluster = cluster
+
+    async def stop_cluster(self):
+        if self.cluster is not None:
+            await self.cluster.stop()
+            self.cluster = None
+
+    def log_event(self, event_type: str, shard_id: Optional[int]):
+        """
+        Keep track of an event in the event log and the metrics, without alerting it.
+        """
+        self.event_log.append(event_type, shard_id)
+        self.metrics.count_event(event_type, shard_id)
+
+    def declare_event(self, event: Event):
         """
         Alert an ongoing event on the bot.
+
+        The event is recorded in the outbox and sent later, possibly along with other events.
+        In collector mode, it is forwarded to the aggregator instead, once recorded.
         """
         LOG.debug(f"Declared event: {event.event_type}")
-        if self.bot.is_ready:
-            LOG.warning("Red is not ready, waiting before sending event into channel.")
-            await self.bot.wait_until_red_ready()
-            LOG.debug("Red is now ready.")
+        self.log_event(event.event_type, event.shard_id)
+        if self.cluster is not None and self.cluster.forward(event):
+            return
+        self.coalescer.push(event)
 
-        await self.bot.get_channel(133251234164375552).send(embed=event.to_embed())
+    async def send_alert(
+        self, embed: discord.Embed, *, channel_ids: Optional[Collection[int]] = None
+    ) -> Set[int]:
+        return await self.delivery.send(embed, channel_ids=channel_ids)
 
-    def cog_unload(self):
-        LOG.info(f"[cog_unload] Is shard 0 closed: {self.bot.shards[0].is_closed()}.")
+    async def cog_unload(self):
+        # Shards only go down with the bot, not when the cog is reloaded.
+        await self.cases.shutdown(self.bot.shards if is_shutting_down(self.bot) else [])
+        self.take_snapshot()
+        try:
+            self._snapshot.save(cog_data_path(self) / "guilds.snapshot")
+        except OSError:
+            LOG.exception("Unable to save the guild snapshot.")
+        # Events not forwarded yet are recorded in the outbox before it is flushed.
+        await self.stop_cluster()
+        self.coalescer.stop()
+        self.shard_monitor.stop()
+        self.latency.stop()
+        self.availability.stop()
+        self.loop_lag.stop()
+        await self.outbox.flush()
+        await self.metrics_server.stop()
+        self.event_log.close()
+        if self._name_task:
+            self._name_task.cancel()
+        if self._resync_task:
+            self._resync_task.cancel()
+        if self.bot.shards:
+            LOG.info(f"[cog_unload] Is shard 0 closed: {self.bot.shards[0].is_closed()}.")
 
 
-def setup(bot: Red):
+async def setup(bot: Red):
     LOG.info("Loading NowOnline...\n\t\t\tMade by Capt. Pred#0495 - Red-Administrator.")
-    cog = NowOnline(bot)
-    bot.add_cog(cog)
-    bot.loop.create_task(cog.cog_load())
+    await bot.add_cog(NowOnline(bot))
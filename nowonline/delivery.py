@@ -0,0 +1,103 @@
+import asyncio
+from typing import TYPE_CHECKING, Collection, List, NamedTuple, Optional, Set
+
+import discord
+
+from restscheduler import Priority, get_scheduler
+
+from .const import LOG
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+
+class Destination(NamedTuple):
+    channel: discord.TextChannel
+    ping_role: Optional[discord.Role]
+
+
+class AlertDelivery:
+    """
+    Send alerts to the channel set in every guild.
+
+    Destinations are resolved from the config once and cached until a setting changes or a
+    channel, role or guild goes away. Alerts are sent to every destination through the REST
+    scheduler shared with the other cogs, as notifications, so they never delay moderation.
+    """
+
+    def __init__(self, cog: "NowOnline"):
+        self.cog = cog
+        self._destinations: Optional[List[Destination]] = None
+
+    def invalidate(self):
+        self._destinations = None
+
+    def is_destination(self, channel_id: int) -> bool:
+        return self._destinations is not None and any(
+            destination.channel.id == channel_id for destination in self._destinations
+        )
+
+    async def destinations(self) -> List[Destination]:
+        if self._destinations is not None:
+            return self._destinations
+        destinations = []
+        for guild_id, data in (await self.cog.config.all_guilds()).items():
+            if not data["channel"] or not (guild := self.cog.bot.get_guild(guild_id)):
+                continue
+            channel = guild.get_channel(data["channel"])
+            if not isinstance(channel, discord.TextChannel):
+                continue
+            role = guild.get_role(data["ping_role"]) if data["ping_role"] else None
+            destinations.append(Destination(channel, role))
+        self._destinations = destinations
+        return destinations
+
+    async def send(
+        self, embed: discord.Embed, *, channel_ids: Optional[Collection[int]] = None
+    ) -> Set[int]:
+        """
+        Send an alert to every destination, or only to the given channels. Return the IDs of the
+        channels that failed with an error that may go away by retrying, such as a server error
+        or a network issue.
+        """
+        destinations = await self.destinations()
+        if channel_ids is not None:
+            destinations = [
+                destination
+                for destination in destinations
+                if destination.channel.id in channel_ids
+            ]
+        if not destinations:
+            LOG.debug("No alert channel is set, an alert was not sent.")
+            return set()
+        scheduler = get_scheduler(self.cog.bot)
+
+        async def send(destination: Destination) -> bool:
+            try:
+                await scheduler.run(
+                    destination.channel.send,
+                    content=destination.ping_role.mention if destination.ping_role else None,
+                    embed=embed,
+                    allowed_mentions=discord.AllowedMentions(roles=True),
+                    route="send",
+                    guild_id=destination.channel.guild.id,
+                    priority=Priority.NOTIFICATION,
+                )
+            except (discord.HTTPException, OSError, asyncio.TimeoutError) as error:
+                LOG.warning(
+                    "Unable to send an alert in %s (%s): %s",
+                    destination.channel.id,
+                    destination.channel.guild.id,
+                    error,
+                )
+                return isinstance(error, discord.HTTPException) and not (
+                    error.status == 429 or error.status >= 500
+                )
+            return True
+
+        results = await asyncio.gather(*(send(destination) for destination in destinations))
+        return {
+            destination.channel.id
+            for destination, delivered in zip(destinations, results)
+            if not delivered
+        }
@@ -0,0 +1,185 @@
+import mmap
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from .const import LOG
+from .no_class import EVENT_TYPE
+
+# Timestamp, event type code and shard ID (-1 for the whole bot), padded to 16 bytes.
+RECORD = struct.Struct("<dHixx")
+# Number of records in the segment.
+HEADER = struct.Struct("<Q8x")
+TIMESTAMP = struct.Struct("<d")
+RECORDS_PER_SEGMENT = 65536
+MAX_SEGMENTS = 8
+
+# Codes are the position of the type in EVENT_TYPE, new types must be added at its end.
+EVENT_CODES: Dict[str, int] = {event_type.name: code for code, event_type in enumerate(EVENT_TYPE)}
+EVENT_NAMES: List[str] = [event_type.name for event_type in EVENT_TYPE]
+
+
+class LoggedEvent(NamedTuple):
+    timestamp: float
+    event_type: str
+    shard_id: Optional[int]
+
+
+class Segment:
+    """
+    A preallocated, memory-mapped file of fixed-size records, sorted by time.
+    """
+
+    __slots__ = ("path", "file", "map", "count", "first")
+
+    def __init__(self, path: Path):
+        self.path = path
+        size = HEADER.size + RECORD.size * RECORDS_PER_SEGMENT
+        new = not path.exists()
+        self.file = path.open("w+b" if new else "r+b")
+        if new:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.count = HEADER.unpack_from(self.map, 0)[0]
+        self.first = self.timestamp(0) if self.count else None
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= RECORDS_PER_SEGMENT
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.timestamp(self.count - 1) if self.count else None
+
+    def timestamp(self, index: int) -> float:
+        return TIMESTAMP.unpack_from(self.map, HEADER.size + index * RECORD.size)[0]
+
+    def append(self, timestamp: float, code: int, shard_id: int):
+        RECORD.pack_into(
+            self.map, HEADER.size + self.count * RECORD.size, timestamp, code, shard_id
+        )
+        self.count += 1
+        HEADER.pack_into(self.map, 0, self.count)
+        if self.first is None:
+            self.first = timestamp
+
+    def bisect(self, timestamp: float) -> int:
+        """
+        Index of the first record at or after a time.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read(self, start: int, end: int):
+        for timestamp, code, shard_id in RECORD.iter_unpack(
+            self.map[HEADER.size + start * RECORD.size : HEADER.size + end * RECORD.size]
+        ):
+            yield timestamp, code, shard_id
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class EventLog:
+    """
+    A rotating log of every gateway event and alert, made of memory-mapped segments.
+
+    Records have a fixed size and are written in place, so appending does not allocate. Segments
+    are kept in time order with their first timestamp in memory, a query finds its range with a
+    binary search over the segments then over the records, and only reads that slice.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self._segments: List[Segment] = []
+        self._next_number = 0
+
+    def _segment_paths(self) -> List[Path]:
+        # Other files in the folder are not segments.
+        paths = [path for path in self.folder.glob("*.log") if path.stem.isdigit()]
+        return sorted(paths, key=lambda path: int(path.stem))
+
+    def _prune(self):
+        """
+        Delete segment files older than the last ``MAX_SEGMENTS`` ones.
+        """
+        for path in self._segment_paths()[:-MAX_SEGMENTS]:
+            try:
+                path.unlink()
+            except OSError as error:
+                LOG.warning("Unable to delete the event log segment %s: %s", path.name, error)
+
+    def open(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._prune()
+        paths = self._segment_paths()
+        for path in paths:
+            try:
+                self._segments.append(Segment(path))
+            except (OSError, ValueError, struct.error) as error:
+                LOG.warning("Ignoring the event log segment %s: %s", path.name, error)
+        if paths:
+            self._next_number = int(paths[-1].stem) + 1
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def _rotate(self) -> Segment:
+        segment = Segment(self.folder / f"{self._next_number}.log")
+        self._next_number += 1
+        self._segments.append(segment)
+        while len(self._segments) > MAX_SEGMENTS:
+            self._segments.pop(0).close()
+        # Also catches segments that could not be opened.
+        self._prune()
+        return segment
+
+    def append(self, event_type: str, shard_id: Optional[int], timestamp: Optional[float] = None):
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment.is_full:
+            segment = self._rotate()
+        timestamp = timestamp or time.time()
+        last = segment.last
+        if last is not None and timestamp < last:
+            # Keep records sorted if the clock goes backward.
+            timestamp = last
+        segment.append(timestamp, EVENT_CODES[event_type], -1 if shard_id is None else shard_id)
+
+    def query(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        *,
+        event_type: Optional[str] = None,
+        shard_id: Optional[int] = None,
+    ) -> List[LoggedEvent]:
+        until = until if until is not None else time.time()
+        code = EVENT_CODES[event_type] if event_type else None
+        events = []
+        for segment in self._segments:
+            if not segment.count or segment.first > until or segment.last < since:
+                continue
+            start, end = segment.bisect(since), segment.bisect(until + 1e-6)
+            for timestamp, record_code, record_shard in segment.read(start, end):
+                if code is not None and record_code != code:
+                    continue
+                if shard_id is not None and record_shard != shard_id:
+                    continue
+                events.append(
+                    LoggedEvent(
+                        timestamp,
+                        EVENT_NAMES[record_code] if record_code < len(EVENT_NAMES) else "UNKNOWN",
+                        None if record_shard == -1 else record_shard,
+                    )
+                )
+        return events
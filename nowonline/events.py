@@ -1,52 +1,112 @@
+import asyncio
+
+import discord
 from redbot.core.commands import Cog
 
 from .abc import ABCMeta, MixinMeta
+from .const import LOG
 from .no_class import EVENT_TYPE, Event
 
 
 class Events(MixinMeta, metaclass=ABCMeta):
-    # Listener: On Connect/Ready
+    # Shard transitions are logged, then go through the shard monitor, which decides what is
+    # worth an alert.
+    # The bot-wide connect, resume and disconnect events are dispatched along with the shard ones
+    # and are not alerted.
 
-    @Cog.listener()
-    async def on_connect(self):
-        event = Event(EVENT_TYPE.ON_CONNECT, self.bot)
-        await self.declare_event(event)
+    # Listener: On Connect/Ready
 
     @Cog.listener()
     async def on_ready(self):
-        event = Event(EVENT_TYPE.ON_READY, self.bot)
-        await self.declare_event(event)
+        # Channels are recreated when the bot identifies again.
+        self.delivery.invalidate()
+        self.availability.seed(self.bot.guilds)
+        event = Event(EVENT_TYPE.ON_READY, self.bot, details=self.availability.describe())
+        self.declare_event(event)
+        await self.fetch_from_last_connect()
 
     @Cog.listener()
     async def on_shard_connect(self, shard_id: int):
-        event = Event(EVENT_TYPE.ON_SHARD_CONNECT, self.bot, shard_id=shard_id)
-        await self.declare_event(event)
+        self.log_event("ON_SHARD_CONNECT", shard_id)
+        self.shard_monitor.connecting(shard_id)
 
     @Cog.listener()
     async def on_shard_ready(self, shard_id: int):
-        event = Event(EVENT_TYPE.ON_SHARD_READY, self.bot, shard_id=shard_id)
-        await self.declare_event(event)
+        self.log_event("ON_SHARD_READY", shard_id)
+        self.availability.shard_ready(shard_id)
+        self.shard_monitor.up(shard_id)
+        await self._resync_when_back()
 
     # Listener: On Resume/Resumed/Reconnect
 
-    @Cog.listener()
-    async def on_resumed(self):
-        event = Event(EVENT_TYPE.ON_RESUMED, self.bot)
-        await self.declare_event(event)
-
     @Cog.listener()
     async def on_shard_resumed(self, shard_id: int):
-        event = Event(EVENT_TYPE.ON_SHARD_RESUMED, self.bot, shard_id=shard_id)
-        await self.declare_event(event)
+        self.log_event("ON_SHARD_RESUMED", shard_id)
+        self.shard_monitor.up(shard_id)
+        await self._resync_when_back()
 
     # Listener: On Disconnect
 
     @Cog.listener()
-    async def on_disconnect(self):
-        event = Event(EVENT_TYPE.ON_DISCONNECT, self.bot)
-        await self.declare_event(event)
+    async def on_shard_disconnect(self, shard_id: int):
+        self.log_event("ON_SHARD_DISCONNECT", shard_id)
+        self.take_snapshot()
+        self.shard_monitor.down(shard_id)
+
+    async def _resync_when_back(self):
+        # Once every shard is back, or ``down_threshold`` after the first one came back if some
+        # never do, so the report lists those still missing.
+        if not self.shard_monitor.not_up(range(self.bot.shard_count or 1)):
+            if self._resync_task is not None:
+                self._resync_task.cancel()
+                self._resync_task = None
+            await self.fetch_from_last_connect()
+        elif self._resync_task is None:
+            self._resync_task = asyncio.create_task(self._resync_later())
+
+    async def _resync_later(self):
+        await asyncio.sleep(self.shard_monitor.down_threshold)
+        self._resync_task = None
+        await self.fetch_from_last_connect()
+
+    # Listener: Alert destinations
 
     @Cog.listener()
-    async def on_shard_disconnect(self, shard_id: int):
-        event = Event(EVENT_TYPE.ON_SHARD_DISCONNECT, self.bot, shard_id=shard_id)
-        await self.declare_event(event)
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        if self.delivery.is_destination(channel.id):
+            self.delivery.invalidate()
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.delivery.invalidate()
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.availability.remove(guild)
+        self.delivery.invalidate()
+
+    @Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        self.availability.update(guild)
+        self.delivery.invalidate()
+
+    # Listener: Settings
+
+    @Cog.listener()
+    async def on_red_api_tokens_update(self, service_name: str, api_tokens: dict):
+        if service_name == "nowonline" and self.cluster is not None:
+            # The shared secret may have changed.
+            try:
+                await self.start_cluster()
+            except (OSError, ValueError):
+                LOG.exception("Unable to restart the cluster mode.")
+
+    # Listener: Guild availability
+
+    @Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        self.availability.update(guild)
+
+    @Cog.listener()
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        self.availability.update(guild)
@@ -0,0 +1,218 @@
+import asyncio
+import io
+import math
+import time
+from array import array
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+import discord
+
+from .const import LOG
+from .no_class import EVENT_TYPE, Event
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# Time between two samples, in seconds.
+SAMPLE_INTERVAL = 30.0
+# Samples are kept for this long, in seconds.
+RETENTION = 7 * 86400
+# The p95 checked against the alert threshold is computed over this window, in seconds.
+ALERT_WINDOW = 300.0
+
+
+class LatencyStats(NamedTuple):
+    shard_id: int
+    samples: int
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+    """
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class LatencyRing:
+    """
+    A fixed-size ring buffer of latency samples for a single shard.
+
+    Timestamps and values are stored in preallocated arrays, so memory does not grow once the
+    buffer is full and old samples are overwritten.
+    """
+
+    __slots__ = ("times", "values", "index", "count", "alerting")
+
+    def __init__(self, capacity: int):
+        self.times = array("I", bytes(4 * capacity))
+        self.values = array("f", bytes(4 * capacity))
+        self.index = 0
+        self.count = 0
+        # Whether the shard is above the latency threshold, so it is only alerted once.
+        self.alerting = False
+
+    def add(self, timestamp: float, value: float):
+        self.times[self.index] = int(timestamp)
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def since(self, timestamp: float) -> List[float]:
+        """
+        Return samples taken after a time, from the newest to the oldest.
+        """
+        capacity = len(self.times)
+        values = []
+        for offset in range(1, self.count + 1):
+            position = (self.index - offset) % capacity
+            if self.times[position] < timestamp:
+                break
+            values.append(self.values[position])
+        return values
+
+    def series(self, timestamp: float):
+        """
+        Return ``(times, values)`` of samples taken after a time, from the oldest to the newest.
+        """
+        capacity = len(self.times)
+        times, values = [], []
+        for offset in range(self.count, 0, -1):
+            position = (self.index - offset) % capacity
+            if self.times[position] >= timestamp:
+                times.append(self.times[position])
+                values.append(self.values[position])
+        return times, values
+
+
+class LatencySampler:
+    """
+    Sample the heartbeat latency of every shard at a fixed interval.
+
+    A shard whose p95 latency over the last ``ALERT_WINDOW`` seconds goes above the threshold is
+    alerted once, then again only after going back under it.
+    """
+
+    def __init__(
+        self,
+        cog: "NowOnline",
+        *,
+        interval: float = SAMPLE_INTERVAL,
+        retention: float = RETENTION,
+    ):
+        self.cog = cog
+        self.interval = interval
+        self.capacity = int(retention // interval)
+        self.threshold = 1.0
+        self._rings: Dict[int, LatencyRing] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def load_settings(self):
+        self.threshold = await self.cog.config.latency_threshold()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        await self.cog.bot.wait_until_red_ready()
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                LOG.exception("Unable to sample shards latency.")
+            await asyncio.sleep(self.interval)
+
+    def sample(self):
+        now = time.time()
+        for shard_id, latency in self.cog.bot.latencies:
+            if not math.isfinite(latency):
+                # The shard is not connected, its outage is tracked by the shard monitor.
+                continue
+            ring = self._rings.get(shard_id)
+            if ring is None:
+                ring = self._rings[shard_id] = LatencyRing(self.capacity)
+            ring.add(now, latency)
+            self.cog.metrics.observe_latency(shard_id, latency)
+            self._check(shard_id, ring, now)
+
+    def _check(self, shard_id: int, ring: LatencyRing, now: float):
+        values = sorted(ring.since(now - ALERT_WINDOW))
+        p95 = percentile(values, 95)
+        if p95 <= self.threshold:
+            ring.alerting = False
+            return
+        if ring.alerting:
+            return
+        ring.alerting = True
+        self.cog.declare_event(
+            Event(
+                EVENT_TYPE.ON_SHARD_HIGH_LATENCY,
+                self.cog.bot,
+                shard_id=shard_id,
+                details=(
+                    f"p95 latency of {p95 * 1000:.0f} ms over the last "
+                    f"{ALERT_WINDOW / 60:.0f} minutes."
+                ),
+            )
+        )
+
+    def stats(self, window: float) -> List[LatencyStats]:
+        since = time.time() - window
+        stats = []
+        for shard_id, ring in sorted(self._rings.items()):
+            values = sorted(ring.since(since))
+            if not values:
+                continue
+            stats.append(
+                LatencyStats(
+                    shard_id,
+                    len(values),
+                    percentile(values, 50),
+                    percentile(values, 95),
+                    percentile(values, 99),
+                    values[-1],
+                )
+            )
+        return stats
+
+    def render_chart(self, window: float) -> discord.File:
+        """
+        Render the latency of every shard as a PNG chart. Requires matplotlib.
+        """
+        # Optional dependency, only needed for charts. This runs in a worker thread, so the
+        # figure is built directly rather than through pyplot and its global state.
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        since = time.time() - window
+        figure = Figure(figsize=(10, 5))
+        FigureCanvasAgg(figure)
+        axes = figure.subplots()
+        for shard_id, ring in sorted(self._rings.items()):
+            times, values = ring.series(since)
+            if times:
+                axes.plot(
+                    [(timestamp - since) / 3600 for timestamp in times],
+                    [value * 1000 for value in values],
+                    label=f"Shard {shard_id}",
+                    linewidth=1,
+                )
+        axes.axhline(self.threshold * 1000, color="red", linestyle="--", linewidth=1)
+        axes.set_xlabel("Hours")
+        axes.set_ylabel("Latency (ms)")
+        if len(self._rings) <= 16:
+            axes.legend(fontsize="small")
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png", bbox_inches="tight")
+        buffer.seek(0)
+        return discord.File(buffer, filename="latency.png")
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from array import array
+from collections import deque
+from typing import TYPE_CHECKING, Deque, List, NamedTuple, Optional
+
+from .const import LOG
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+# Time between two wakeups of the probe, in seconds.
+PROBE_INTERVAL = 0.5
+# Lag above which a wakeup is kept as a spike, in seconds.
+SPIKE_THRESHOLD = 0.25
+# The watchdog thread captures what runs once the loop is late by this many seconds.
+BLOCK_THRESHOLD = 1.0
+# Time between two checks of the watchdog thread, in seconds.
+WATCHDOG_INTERVAL = 0.1
+# Upper bounds of the histogram buckets, in seconds. The last bucket has no bound.
+HISTOGRAM_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Number of spikes kept for alerts and the looplag command.
+MAX_SPIKES = 50
+
+# Frames from these folders are skipped when looking for the code that blocks the loop.
+LIBRARY_PATHS = tuple(
+    os.path.normcase(path)
+    for path in {sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"]}
+)
+
+
+class LagSpike(NamedTuple):
+    timestamp: float
+    lag: float
+    # Task and line of code that were running, if the watchdog caught them.
+    culprit: Optional[str]
+
+
+def describe_frame(frame) -> str:
+    """
+    Find the innermost line of code outside the standard library and installed packages.
+    """
+    stack = traceback.extract_stack(frame)
+    for summary in reversed(stack):
+        if not os.path.normcase(summary.filename).startswith(LIBRARY_PATHS):
+            break
+    else:
+        summary = stack[-1]
+    return f"{os.path.basename(summary.filename)}:{summary.lineno} in {summary.name}"
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop wakes up, to find what blocks it.
+
+    A probe task sleeps for ``PROBE_INTERVAL`` seconds and compares the time it was scheduled
+    to wake up with the time it actually did, the lag is counted in a histogram. A watchdog
+    thread notices when the probe is late by more than ``BLOCK_THRESHOLD`` seconds, while the
+    loop is still blocked, and captures the name of the running task (such as
+    ``discord.py: on_member_join`` for listeners) along with the line of code being run.
+    """
+
+    def __init__(self, cog: "NowOnline", *, interval: float = PROBE_INTERVAL):
+        self.cog = cog
+        self.interval = interval
+        self.histogram = array("Q", bytes(8 * (len(HISTOGRAM_BOUNDS) + 1)))
+        self.max_lag = 0.0
+        self.spikes: Deque[LagSpike] = deque(maxlen=MAX_SPIKES)
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        # Monotonic time the probe should wake up at, read by the watchdog thread.
+        self._deadline = 0.0
+        self._culprit: Optional[str] = None
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._deadline = time.monotonic() + self.interval
+        # Each thread gets its own event, so a thread stopped right before a restart cannot miss
+        # it and keep running next to the new one.
+        self._stopped = threading.Event()
+        self._task = asyncio.create_task(self._probe())
+        self._thread = threading.Thread(
+            target=self._watch, args=(self._stopped,), name="NowOnline loop watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._thread = None
+
+    async def _probe(self):
+        while True:
+            self._deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(time.monotonic() - self._deadline)
+
+    def record(self, lag: float):
+        lag = max(lag, 0.0)
+        for index, bound in enumerate(HISTOGRAM_BOUNDS):
+            if lag <= bound:
+                break
+        else:
+            index = len(HISTOGRAM_BOUNDS)
+        self.histogram[index] += 1
+        self.max_lag = max(self.max_lag, lag)
+        culprit, self._culprit = self._culprit, None
+        if lag >= SPIKE_THRESHOLD:
+            self.spikes.append(LagSpike(time.time(), lag, culprit))
+            if lag >= BLOCK_THRESHOLD:
+                LOG.warning("The event loop was blocked for %.2fs by %s.", lag, culprit)
+
+    def _watch(self, stopped: threading.Event):
+        while not stopped.wait(WATCHDOG_INTERVAL):
+            if self._culprit is not None:
+                continue
+            if time.monotonic() - self._deadline < BLOCK_THRESHOLD:
+                continue
+            try:
+                self._culprit = self._capture()
+            except Exception:
+                LOG.debug("Unable to capture what blocks the event loop.", exc_info=True)
+
+    def _capture(self) -> Optional[str]:
+        """
+        Describe what the loop thread is running. Called from the watchdog thread.
+        """
+        task = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        parts = []
+        if task is not None:
+            parts.append(task.get_name())
+        if frame is not None:
+            parts.append(describe_frame(frame))
+        return " at ".join(parts) or None
+
+    def likely_culprit(self, since: float, until: Optional[float] = None) -> Optional[LagSpike]:
+        """
+        Return the largest spike between two times, if any.
+        """
+        until = until if until is not None else time.time()
+        spikes = [spike for spike in self.spikes if since <= spike.timestamp <= until]
+        return max(spikes, key=lambda spike: spike.lag, default=None)
+
+    def cause_of(self, timestamp: float, lookback: float = 60.0) -> Optional[str]:
+        """
+        Describe the spike that most likely caused a disconnection at a given time.
+        """
+        # The spike is recorded once the loop is unblocked, possibly after the disconnection.
+        spike = self.likely_culprit(timestamp - lookback, timestamp + BLOCK_THRESHOLD)
+        if spike is None:
+            return None
+        return f"Event loop blocked for {spike.lag:.1f}s by {spike.culprit or 'unknown code'}."
+
+    def histogram_lines(self) -> List[str]:
+        """
+        Format the histogram, one line per bucket that was hit.
+        """
+        lines = []
+        lower = 0.0
+        for index, count in enumerate(self.histogram):
+            upper = HISTOGRAM_BOUNDS[index] if index < len(HISTOGRAM_BOUNDS) else None
+            if count:
+                label = (
+                    f"{lower * 1000:.0f}–{upper * 1000:.0f} ms"
+                    if upper is not None
+                    else f"over {lower * 1000:.0f} ms"
+                )
+                lines.append(f"{label}: {count}")
+            lower = upper or lower
+        return lines
@@ -0,0 +1,256 @@
+import time
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from restscheduler import get_scheduler
+
+from .const import LOG
+from .shards import ShardState
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# Upper bounds of the heartbeat latency buckets, in seconds. The last bucket has no bound.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Metrics are only served on the loopback interface.
+HOST = "127.0.0.1"
+
+
+class LatencyHistogram:
+    """
+    Cumulative heartbeat latency buckets of a single shard.
+    """
+
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets = array("Q", bytes(8 * (len(LATENCY_BUCKETS) + 1)))
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+def format_labels(**labels) -> str:
+    """
+    Format labels, leaving out those set to None.
+    """
+    return ",".join(f'{name}="{value}"' for name, value in labels.items() if value is not None)
+
+
+class Metrics:
+    """
+    Counters updated by the listeners, rendered as OpenMetrics text when scraped.
+
+    Every value is kept in memory, so a scrape does not read anything from disk or Discord.
+    """
+
+    def __init__(self, cog: "NowOnline"):
+        self.cog = cog
+        # By event type and shard ID, -1 for bot-wide events.
+        self.events: Counter = Counter()
+        self.reconnects: Counter = Counter()
+        self.last_ready: Dict[int, float] = {}
+        self.latency: Dict[int, LatencyHistogram] = {}
+
+    def count_event(self, event_type: str, shard_id: Optional[int]):
+        self.events[event_type, -1 if shard_id is None else shard_id] += 1
+        if shard_id is None:
+            return
+        if event_type == "ON_SHARD_RESUMED" or (
+            event_type == "ON_SHARD_READY" and shard_id in self.last_ready
+        ):
+            self.reconnects[shard_id] += 1
+        if event_type in ("ON_SHARD_READY", "ON_SHARD_RESUMED"):
+            self.last_ready[shard_id] = time.time()
+
+    def observe_latency(self, shard_id: int, value: float):
+        histogram = self.latency.get(shard_id)
+        if histogram is None:
+            histogram = self.latency[shard_id] = LatencyHistogram()
+        histogram.observe(value)
+
+    def render(self) -> str:
+        now = time.time()
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples: List[Tuple[str, str, float]]):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {help_text}")
+            for suffix, labels, value in samples:
+                lines.append(
+                    f"{name}{suffix}{{{labels}}} {value}" if labels else f"{name}{suffix} {value}"
+                )
+
+        family(
+            "nowonline_shard_state",
+            "stateset",
+            "Current state of each shard.",
+            [
+                (
+                    "",
+                    format_labels(shard=status.shard_id, nowonline_shard_state=state.name.lower()),
+                    int(status.state is state),
+                )
+                for status in self.cog.shard_monitor.shards
+                for state in ShardState
+            ],
+        )
+        family(
+            "nowonline_events",
+            "counter",
+            "Gateway events and alerts seen since the cog was loaded.",
+            [
+                (
+                    "_total",
+                    format_labels(
+                        event_type=event_type.lower(), shard=None if shard_id == -1 else shard_id
+                    ),
+                    count,
+                )
+                for (event_type, shard_id), count in sorted(self.events.items())
+            ],
+        )
+        family(
+            "nowonline_shard_reconnects",
+            "counter",
+            "Times each shard was ready or resumed again after its first ready.",
+            [
+                ("_total", format_labels(shard=shard_id), count)
+                for shard_id, count in sorted(self.reconnects.items())
+            ],
+        )
+        family(
+            "nowonline_shard_seconds_since_ready",
+            "gauge",
+            "Seconds since each shard was last ready or resumed.",
+            [
+                ("", format_labels(shard=shard_id), round(now - timestamp, 3))
+                for shard_id, timestamp in sorted(self.last_ready.items())
+            ],
+        )
+        samples = []
+        for shard_id, counts in self.cog.availability.shards:
+            samples.append(("", format_labels(shard=shard_id, available="true"), counts.available))
+            samples.append(
+                ("", format_labels(shard=shard_id, available="false"), len(counts.unavailable))
+            )
+        family(
+            "nowonline_shard_guilds",
+            "gauge",
+            "Servers of each shard in cache, by availability.",
+            samples,
+        )
+        samples = []
+        for shard_id, histogram in sorted(self.latency.items()):
+            cumulative = 0
+            for index, count in enumerate(histogram.buckets):
+                cumulative += count
+                bound = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else "+Inf"
+                samples.append(("_bucket", format_labels(shard=shard_id, le=bound), cumulative))
+            samples.append(("_count", format_labels(shard=shard_id), histogram.count))
+            samples.append(("_sum", format_labels(shard=shard_id), round(histogram.sum, 6)))
+        family(
+            "nowonline_heartbeat_latency_seconds",
+            "histogram",
+            "Heartbeat latency of each shard, as sampled by NowOnline.",
+            samples,
+        )
+        stats = get_scheduler(self.cog.bot).stats()
+        family(
+            "nowonline_rest_queued",
+            "gauge",
+            "REST calls of every cog waiting in the shared scheduler, by priority.",
+            [
+                ("", format_labels(priority=queue.priority.name.lower()), queue.queued)
+                for queue in stats
+            ],
+        )
+        family(
+            "nowonline_rest_in_flight",
+            "gauge",
+            "REST calls of every cog being made, by priority.",
+            [
+                ("", format_labels(priority=queue.priority.name.lower()), queue.in_flight)
+                for queue in stats
+            ],
+        )
+        samples = []
+        for queue in stats:
+            priority = queue.priority.name.lower()
+            samples.append(
+                ("_total", format_labels(priority=priority, outcome="success"), queue.completed)
+            )
+            samples.append(
+                ("_total", format_labels(priority=priority, outcome="failure"), queue.failed)
+            )
+        family(
+            "nowonline_rest_calls",
+            "counter",
+            "REST calls of every cog made through the shared scheduler, by priority and outcome.",
+            samples,
+        )
+        family(
+            "nowonline_rest_wait_seconds",
+            "counter",
+            "Total time REST calls waited in the shared scheduler, by priority.",
+            [
+                (
+                    "_total",
+                    format_labels(priority=queue.priority.name.lower()),
+                    round(queue.wait_total, 6),
+                )
+                for queue in stats
+            ],
+        )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    A small HTTP server exposing the metrics at ``/metrics``, bound to localhost only.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        response = web.Response(text=self.metrics.render())
+        response.headers["Content-Type"] = CONTENT_TYPE
+        return response
+
+    async def start(self, port: int):
+        await self.stop()
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, HOST, port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        self.port = port
+        LOG.info("Serving metrics on http://%s:%s/metrics.", HOST, port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            self.port = None
@@ -1,17 +1,23 @@
+import time
 from datetime import datetime
 from enum import Enum
 from string import Template
-from typing import Optional, TypedDict
+from typing import Dict, Iterable, List, Optional, TypedDict
 
 import discord
 from redbot.core.bot import Red
-from redbot.core.commands import Context
+from redbot.core.commands import BadArgument, Context
+
+# Keeps a summary of every event type within the limit of an embed's description.
+SUMMARY_LINE_LIMIT = 450
 
 
 class EventTypeTyping(TypedDict):
     color: discord.Color
     emoji: str
     title: Template
+    # Used when events of this type are merged together.
+    summary: Template
 
 
 class EVENT_TYPE(Enum):
@@ -19,41 +25,85 @@ class EVENT_TYPE(Enum):
         "color": discord.Color.dark_green(),
         "emoji": "🔗",
         "title": Template("$bot is connected."),
+        "summary": Template("$bot connected"),
     }
     ON_READY = {
         "color": discord.Color.green(),
         "emoji": "⚡",
         "title": Template("$bot is ready."),
+        "summary": Template("$bot ready"),
     }
     ON_SHARD_CONNECT = {
         "color": discord.Color.dark_purple(),
         "emoji": "🔗",
         "title": Template("Shard $shard_id is connected."),
+        "summary": Template("$shards connected"),
     }
     ON_SHARD_READY = {
         "color": discord.Color.purple(),
         "emoji": "⚡",
         "title": Template("Shard $shard_id is ready."),
+        "summary": Template("$shards ready"),
     }
     ON_RESUMED = {
         "color": discord.Color.gold(),
         "emoji": "⏳",
         "title": Template("$bot has resumed his session."),
+        "summary": Template("$bot resumed"),
     }
     ON_SHARD_RESUMED = {
         "color": discord.Color.gold(),
         "emoji": "⏳",
         "title": Template("Shard $shard_id has resumed his session."),
+        "summary": Template("$shards resumed"),
     }
     ON_DISCONNECT = {
         "color": discord.Color.red(),
         "emoji": "🛑",
         "title": Template("$bot is disconnected."),
+        "summary": Template("$bot disconnected"),
     }
     ON_SHARD_DISCONNECT = {
         "color": discord.Color.red(),
         "emoji": "🛑",
         "title": Template("Shard $shard_id is disconnected."),
+        "summary": Template("$shards disconnected"),
+    }
+    ON_SHARD_DOWN = {
+        "color": discord.Color.dark_red(),
+        "emoji": "🔥",
+        "title": Template("Shard $shard_id is down."),
+        "summary": Template("$shards down"),
+    }
+    ON_SHARD_RECOVERED = {
+        "color": discord.Color.green(),
+        "emoji": "🩹",
+        "title": Template("Shard $shard_id has recovered."),
+        "summary": Template("$shards recovered"),
+    }
+    ON_SHARD_FLAPPING = {
+        "color": discord.Color.orange(),
+        "emoji": "〰️",
+        "title": Template("Shard $shard_id keeps reconnecting."),
+        "summary": Template("$shards flapping"),
+    }
+    ON_SHARD_HIGH_LATENCY = {
+        "color": discord.Color.orange(),
+        "emoji": "🐢",
+        "title": Template("Shard $shard_id has a high latency."),
+        "summary": Template("$shards with a high latency"),
+    }
+    ON_RESYNC = {
+        "color": discord.Color.blurple(),
+        "emoji": "🔄",
+        "title": Template("$bot is back, here is what changed."),
+        "summary": Template("$bot resynced"),
+    }
+    ON_SHARD_PARTIAL = {
+        "color": discord.Color.orange(),
+        "emoji": "🌗",
+        "title": Template("Shard $shard_id is missing servers."),
+        "summary": Template("$shards missing servers"),
     }
 
 
@@ -64,16 +114,51 @@ class Event:
     """
 
     def __init__(
-        self, event_type: EVENT_TYPE, bot: Red, *, shard_id: Optional[int] = None
+        self,
+        event_type: EVENT_TYPE,
+        bot: Red,
+        *,
+        shard_id: Optional[int] = None,
+        details: Optional[str] = None,
     ) -> None:
         self.event_type = event_type.name
         self.created_at = datetime.utcnow()
 
         self._shard_id: Optional[int] = shard_id
+        self.details: Optional[str] = details
+        # Set once the event is recorded in the outbox.
+        self.outbox_id: Optional[int] = None
 
         self.__bot: Red = bot
         self.__values: EventTypeTyping = event_type.value
 
+    def to_json(self):
+        return {
+            "event_type": self.event_type,
+            "created_at": self.created_at.timestamp(),
+            "shard_id": self._shard_id,
+            "details": self.details,
+        }
+
+    @classmethod
+    def from_json(cls, bot: Red, data: dict):
+        event = cls(
+            EVENT_TYPE[data["event_type"]],
+            bot,
+            shard_id=data["shard_id"],
+            details=data["details"],
+        )
+        event.created_at = datetime.fromtimestamp(data["created_at"])
+        return event
+
+    @property
+    def shard_id(self) -> Optional[int]:
+        return self._shard_id
+
+    @property
+    def values(self) -> EventTypeTyping:
+        return self.__values
+
     def to_embed(self):
         embed = discord.Embed(
             color=self.__values["color"],
@@ -82,6 +167,8 @@ class Event:
             ),
         )
         embed.description = f"Event triggered at: {self.created_at.strftime('%H:%M:%S')}"
+        if self.details:
+            embed.description += f"\n{self.details}"
         embed.set_footer(text=f"NowOnline | {self.event_type} | Shard: {self._shard_id}")
         return embed
 
@@ -92,20 +179,137 @@ class Case:
 
     A case is automatically created when the bot shutdown, which create an open case.
     It is then updated when the bot comes back to life.
-    Else, a case is automatically created after the bot comes suddenly back to life.
+    Else, a case is created when a shard disconnects and closed when it is back.
     """
 
-    def __init__(self, bot: Red, *, case_id: int):
+    def __init__(
+        self,
+        bot: Red,
+        *,
+        case_id: Optional[int],
+        shard_id: int = 0,
+        reason: str = "disconnect",
+        opened_at: Optional[float] = None,
+        closed_at: Optional[float] = None,
+    ):
         self.bot: Red = bot
-        self.case_id: int = case_id
+        # Only known once the case is saved.
+        self.case_id: Optional[int] = case_id
+        self.shard_id: int = shard_id
+        self.reason: str = reason
+        self.opened_at: float = opened_at or time.time()
+        self.closed_at: Optional[float] = closed_at
+
+    @property
+    def is_open(self) -> bool:
+        return self.closed_at is None
+
+    def duration(self, now: Optional[float] = None) -> float:
+        return (self.closed_at or now or time.time()) - self.opened_at
 
     def to_json(self):
-        return {"case_id": self.case_id}
+        return {
+            "shard_id": self.shard_id,
+            "reason": self.reason,
+            "opened_at": self.opened_at,
+            "closed_at": self.closed_at,
+        }
+
+    @classmethod
+    def from_json(cls, bot: Red, case_id: int, data: dict):
+        return cls(bot, case_id=case_id, **data)
+
+    def to_embed(self):
+        embed = discord.Embed(
+            color=discord.Color.red() if self.is_open else discord.Color.green(),
+            title=f"Case #{self.case_id} - Shard {self.shard_id}",
+        )
+        embed.add_field(name="Reason", value=self.reason.capitalize())
+        embed.add_field(name="Down since", value=f"<t:{int(self.opened_at)}:f>")
+        embed.add_field(
+            name="Back at",
+            value=f"<t:{int(self.closed_at)}:f>" if self.closed_at else "Still down",
+        )
+        embed.set_footer(text=f"NowOnline | Down for {self.duration():.0f} seconds")
+        return embed
 
     @classmethod
-    async def convert(cls, ctx: Context, argument: int):
+    async def convert(cls, ctx: Context, argument: str):
         """
         This function is automatically called when running a command requiring a case.
         It shouldn't be used manually.
         """
-        return cls(ctx.bot, case_id=argument)
+        if not argument.isdigit():
+            raise BadArgument("A case ID is a number.")
+        data = await ctx.cog.config.custom("case", argument).all()
+        if data["opened_at"] is None:
+            raise BadArgument(f"Case #{argument} does not exist.")
+        return cls.from_json(ctx.bot, int(argument), data)
+
+
+def format_shard_ranges(shard_ids: Iterable[int]) -> str:
+    """
+    Format shard IDs as compact ranges, such as ``Shards 0–31, 40``.
+    """
+    ids = sorted(set(shard_ids))
+    ranges: List[str] = []
+    start = previous = ids[0]
+    for shard_id in ids[1:] + [None]:
+        if shard_id is not None and shard_id == previous + 1:
+            previous = shard_id
+            continue
+        ranges.append(str(start) if start == previous else f"{start}–{previous}")
+        if shard_id is not None:
+            start = previous = shard_id
+    return f"{'Shards' if len(ids) > 1 else 'Shard'} {', '.join(ranges)}"
+
+
+class EventSummary:
+    """
+    Several events merged into a single message, used when events come in bursts.
+    Events of the same type are folded together, in the order their type first appeared.
+    """
+
+    def __init__(self, events: List[Event], bot: Red):
+        self.events = events
+        self.__bot: Red = bot
+
+    def to_embed(self):
+        if len(self.events) == 1:
+            return self.events[0].to_embed()
+        bot_name = self.__bot.user.name if self.__bot.user else "Bot"
+        by_type: Dict[str, List[Event]] = {}
+        for event in self.events:
+            by_type.setdefault(event.event_type, []).append(event)
+        lines = []
+        for events in by_type.values():
+            values = events[0].values
+            shard_ids = [event.shard_id for event in events if event.shard_id is not None]
+            text = values["summary"].safe_substitute(
+                bot=bot_name, shards=format_shard_ranges(shard_ids) if shard_ids else ""
+            )
+            if not shard_ids and len(events) > 1:
+                text += f" ({len(events)} times)"
+            if len(text) > SUMMARY_LINE_LIMIT:
+                text = text[: SUMMARY_LINE_LIMIT - 3] + "..."
+            lines.append(f"{values['emoji']} {text}")
+        first, last = self.events[0].created_at, self.events[-1].created_at
+        embed = discord.Embed(
+            color=self.events[-1].values["color"],
+            title=f"{len(self.events)} events on {bot_name}.",
+            description="\n".join(lines),
+        )
+        embed.add_field(
+            name="Between",
+            value=f"{first.strftime('%H:%M:%S')} and {last.strftime('%H:%M:%S')}",
+        )
+        # Bot-wide events are rare, their details are kept instead of being folded away.
+        for event in self.events:
+            if event.shard_id is None and event.details:
+                embed.add_field(
+                    name=event.values["title"].safe_substitute(bot=bot_name),
+                    value=event.details[:1024],
+                    inline=False,
+                )
+        embed.set_footer(text="NowOnline | Summary")
+        return embed
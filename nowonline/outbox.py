@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from redbot.core.bot import Red
+
+from .const import LOG
+from .no_class import Event
+
+# Records are written to disk at most this many seconds after being appended.
+FSYNC_INTERVAL = 0.5
+
+
+class Outbox:
+    """
+    An append-only file of the events waiting to be delivered.
+
+    Every declared event is written as an ``add`` record before being sent, and an ``ack``
+    record is appended once it was delivered. Records are buffered and written with a single
+    fsync every ``FSYNC_INTERVAL`` seconds, away from the event loop. Events still pending when
+    the cog loads are delivered again, the file is emptied once nothing is pending.
+    """
+
+    def __init__(self, path: Path, *, fsync_interval: float = FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._pending: Dict[int, dict] = {}
+        self._buffer: List[str] = []
+        self._next_id = 1
+        self._lock = asyncio.Lock()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def load(self, bot: Red) -> List[Event]:
+        """
+        Read the file and return the events that were never acknowledged, then compact it.
+        """
+        if not self.path.exists():
+            return []
+        with self.path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut if the process died while writing it.
+                    LOG.warning("Ignoring a corrupted record in the outbox.")
+                    continue
+                if record["op"] == "add":
+                    self._pending[record["id"]] = record["event"]
+                    self._next_id = max(self._next_id, record["id"] + 1)
+                elif record["op"] == "ack":
+                    for event_id in record["ids"]:
+                        self._pending.pop(event_id, None)
+        # Rewrite the file with pending events only, which also drops a cut last line.
+        with self.path.open("w", encoding="utf-8") as file:
+            file.writelines(
+                json.dumps({"op": "add", "id": event_id, "event": data}) + "\n"
+                for event_id, data in self._pending.items()
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        events = []
+        for event_id, data in self._pending.items():
+            try:
+                event = Event.from_json(bot, data)
+            except (KeyError, ValueError):
+                LOG.warning("Ignoring an unknown event in the outbox: %s", data)
+                continue
+            event.outbox_id = event_id
+            events.append(event)
+        return events
+
+    def record(self, event: Event):
+        event.outbox_id = self._next_id
+        self._next_id += 1
+        data = event.to_json()
+        self._pending[event.outbox_id] = data
+        self._append({"op": "add", "id": event.outbox_id, "event": data})
+
+    def ack(self, events: Iterable[Event]):
+        ids = [event.outbox_id for event in events if event.outbox_id is not None]
+        if not ids:
+            return
+        for event_id in ids:
+            self._pending.pop(event_id, None)
+        self._append({"op": "ack", "ids": ids})
+
+    def _append(self, record: dict):
+        self._buffer.append(json.dumps(record) + "\n")
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.fsync_interval, lambda: asyncio.create_task(self.flush())
+            )
+
+    async def flush(self):
+        """
+        Write buffered records to disk. The file is truncated instead when nothing is pending.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._lock:
+            lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self._write, lines, truncate=not self._pending)
+            )
+
+    def _write(self, lines: List[str], *, truncate: bool):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("w" if truncate else "a", encoding="utf-8") as file:
+            if not truncate:
+                file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,82 @@
+import struct
+import time
+from array import array
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from .const import LOG
+
+# Time the snapshot was taken and number of guild IDs that follow.
+HEADER = struct.Struct("<dQ")
+
+
+def diff_sorted(before: array, after: array) -> Tuple[List[int], List[int]]:
+    """
+    Compare two sorted arrays of IDs in a single pass, returning the IDs that were removed and
+    the IDs that were added.
+    """
+    removed, added = [], []
+    i = j = 0
+    while i < len(before) and j < len(after):
+        if before[i] == after[j]:
+            i += 1
+            j += 1
+        elif before[i] < after[j]:
+            removed.append(before[i])
+            i += 1
+        else:
+            added.append(after[j])
+            j += 1
+    removed.extend(before[i:])
+    added.extend(after[j:])
+    return removed, added
+
+
+class GuildSnapshot:
+    """
+    The set of guilds the bot was in at some point, as a sorted array of IDs.
+
+    It takes 8 bytes per guild and is compared with the current guilds in linear time, without
+    fetching anything from Discord.
+    """
+
+    __slots__ = ("taken_at", "guild_ids")
+
+    def __init__(self, guild_ids: array, taken_at: Optional[float] = None):
+        self.guild_ids = guild_ids
+        self.taken_at = taken_at or time.time()
+
+    @classmethod
+    def take(cls, guild_ids: Iterable[int]) -> "GuildSnapshot":
+        return cls(array("Q", sorted(guild_ids)))
+
+    def diff(self, other: "GuildSnapshot") -> Tuple[List[int], List[int]]:
+        """
+        Return the guilds left and joined between this snapshot and a later one.
+        """
+        return diff_sorted(self.guild_ids, other.guild_ids)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as file:
+            file.write(HEADER.pack(self.taken_at, len(self.guild_ids)))
+            self.guild_ids.tofile(file)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["GuildSnapshot"]:
+        """
+        Read a snapshot saved when the cog was unloaded, and delete the file.
+        """
+        if not path.exists():
+            return None
+        try:
+            with path.open("rb") as file:
+                taken_at, count = HEADER.unpack(file.read(HEADER.size))
+                guild_ids = array("Q")
+                guild_ids.fromfile(file, count)
+        except (OSError, EOFError, struct.error) as error:
+            LOG.warning("Ignoring the saved guild snapshot: %s", error)
+            return None
+        finally:
+            path.unlink(missing_ok=True)
+        return cls(guild_ids, taken_at)
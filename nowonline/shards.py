@@ -0,0 +1,191 @@
+import asyncio
+import time
+from datetime import timedelta
+from enum import IntEnum
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from redbot.core.utils.chat_formatting import humanize_timedelta
+
+from .const import LOG
+from .no_class import EVENT_TYPE, Event
+
+if TYPE_CHECKING:
+    from .core import NowOnline
+
+
+class ShardState(IntEnum):
+    UNKNOWN = 0
+    # Connected to the gateway, but not ready nor resumed yet.
+    CONNECTING = 1
+    UP = 2
+    DOWN = 3
+
+
+class ShardStatus:
+    """
+    The state of a single shard. Uses slots since one exists for every shard of the bot.
+    """
+
+    __slots__ = (
+        "shard_id",
+        "state",
+        "since",
+        "down_since",
+        "flaps",
+        "flaps_since",
+        "alerted",
+        "timer",
+    )
+
+    def __init__(self, shard_id: int):
+        self.shard_id = shard_id
+        self.state = ShardState.UNKNOWN
+        # Time of the last transition.
+        self.since = time.time()
+        # Start of the current outage, kept while the shard reconnects.
+        self.down_since: Optional[float] = None
+        # Short outages counted since ``flaps_since``.
+        self.flaps = 0
+        self.flaps_since = 0.0
+        # Whether the current outage was alerted.
+        self.alerted = False
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+def humanize_duration(seconds: float) -> str:
+    return humanize_timedelta(timedelta=timedelta(seconds=seconds)) or f"{seconds:.1f} seconds"
+
+
+class ShardMonitor:
+    """
+    Track the state of every shard and only alert on what matters.
+
+    A shard that comes back before ``down_threshold`` seconds is not alerted, it counts as a flap
+    instead. Reaching ``flap_threshold`` flaps within ``flap_window`` seconds raises a single
+    alert for this window. A shard staying down longer is alerted, along with the real duration
+    of the outage once it recovers.
+    """
+
+    def __init__(self, cog: "NowOnline"):
+        self.cog = cog
+        self.down_threshold = 30.0
+        self.flap_threshold = 3
+        self.flap_window = 300.0
+        self._shards: Dict[int, ShardStatus] = {}
+
+    async def load_settings(self):
+        self.down_threshold = await self.cog.config.down_threshold()
+        self.flap_threshold = await self.cog.config.flap_threshold()
+        self.flap_window = await self.cog.config.flap_window()
+
+    def get(self, shard_id: int) -> ShardStatus:
+        if shard_id not in self._shards:
+            self._shards[shard_id] = ShardStatus(shard_id)
+        return self._shards[shard_id]
+
+    @property
+    def shards(self):
+        return [self._shards[shard_id] for shard_id in sorted(self._shards)]
+
+    def not_up(self, shard_ids: Iterable[int]) -> List[int]:
+        return [
+            shard_id for shard_id in shard_ids if self.get(shard_id).state is not ShardState.UP
+        ]
+
+    def _transition(self, status: ShardStatus, state: ShardState):
+        LOG.debug("Shard %s: %s -> %s.", status.shard_id, status.state.name, state.name)
+        status.state = state
+        status.since = time.time()
+
+    def connecting(self, shard_id: int):
+        status = self.get(shard_id)
+        if status.state is not ShardState.UP:
+            self._transition(status, ShardState.CONNECTING)
+
+    def down(self, shard_id: int):
+        status = self.get(shard_id)
+        if status.state is ShardState.DOWN or status.down_since is not None:
+            # Still within the same outage, such as a failed reconnection.
+            self._transition(status, ShardState.DOWN)
+            return
+        self._transition(status, ShardState.DOWN)
+        status.down_since = status.since
+        self.cog.cases.open(shard_id)
+        status.alerted = False
+        status.timer = asyncio.get_running_loop().call_later(
+            self.down_threshold, self._still_down, status
+        )
+
+    def up(self, shard_id: int):
+        status = self.get(shard_id)
+        self._transition(status, ShardState.UP)
+        # Also closes a case opened by a shutdown, the first time the shard is ready.
+        self.cog.cases.close(shard_id)
+        if status.down_since is None:
+            return
+        duration = status.since - status.down_since
+        status.down_since = None
+        if status.timer:
+            status.timer.cancel()
+            status.timer = None
+        if status.alerted:
+            self.cog.declare_event(
+                Event(
+                    EVENT_TYPE.ON_SHARD_RECOVERED,
+                    self.cog.bot,
+                    shard_id=shard_id,
+                    details=(
+                        f"Down for {humanize_duration(duration)}.\n"
+                        + self.cog.availability.describe(shard_id)
+                    ),
+                )
+            )
+            return
+        outage_start = status.since - duration
+        if outage_start - status.flaps_since > self.flap_window:
+            status.flaps = 0
+            status.flaps_since = outage_start
+        status.flaps += 1
+        if status.flaps == self.flap_threshold:
+            self.cog.declare_event(
+                Event(
+                    EVENT_TYPE.ON_SHARD_FLAPPING,
+                    self.cog.bot,
+                    shard_id=shard_id,
+                    details=self._with_cause(
+                        f"Disconnected {status.flaps} times in "
+                        f"{humanize_duration(status.since - status.flaps_since)}.",
+                        outage_start,
+                    ),
+                )
+            )
+
+    def _with_cause(self, details: str, disconnected_at: float) -> str:
+        """
+        Add the likely cause of a disconnection, when the event loop was blocked right before.
+        """
+        cause = self.cog.loop_lag.cause_of(disconnected_at)
+        return f"{details}\nLikely cause: {cause}" if cause else details
+
+    def _still_down(self, status: ShardStatus):
+        status.timer = None
+        if status.down_since is None:
+            return
+        status.alerted = True
+        self.cog.declare_event(
+            Event(
+                EVENT_TYPE.ON_SHARD_DOWN,
+                self.cog.bot,
+                shard_id=status.shard_id,
+                details=self._with_cause(
+                    f"Down for more than {humanize_duration(self.down_threshold)}.",
+                    status.down_since,
+                ),
+            )
+        )
+
+    def stop(self):
+        for status in self._shards.values():
+            if status.timer:
+                status.timer.cancel()
+                status.timer = None
@@ -0,0 +1,3 @@
+import logging
+
+LOG = logging.getLogger("red.predeactor.remoteban")
@@ -0,0 +1,60 @@
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+@contextmanager
+def transaction(connection: sqlite3.Connection):
+    """
+    Run statements in a single write transaction, the connection being in autocommit mode.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+class SQLiteStore:
+    """
+    A SQLite database in WAL mode, queried from a worker thread so the event loop never blocks.
+
+    Subclasses set ``SCHEMA``, executed when the connection is opened.
+    """
+
+    SCHEMA: str = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, function: Callable[..., T], *args) -> T:
+        def locked():
+            with self._lock:
+                return function(self._connect(), *args)
+
+        return await asyncio.get_running_loop().run_in_executor(None, locked)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,267 @@
+import asyncio
+import heapq
+import itertools
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import discord
+from discord.abc import Snowflake
+from redbot.core.modlog import create_case
+from redbot.core.utils.mod import get_audit_reason
+
+from restscheduler import Priority as RestPriority
+
+from .const import LOG
+from .history import HistoryEntry, make_entry
+from .report import UserCase
+from .retry import (
+    ACTION_ERRORS,
+    ErrorKind,
+    GuildBuckets,
+    RetryPolicy,
+    classify_error,
+)
+from .scheduler import Priority, RunJob
+
+if TYPE_CHECKING:
+    from .remoteban import RemoteBan
+
+# Priority of the REST calls of a run, by priority of the run.
+REST_PRIORITIES = {
+    Priority.INTERACTIVE: RestPriority.CRITICAL,
+    Priority.NORMAL: RestPriority.MODERATION,
+    Priority.BULK: RestPriority.MODERATION,
+}
+
+
+class ActionRun:
+    """
+    A single ban or unban run, applying an action to every user in every guild.
+
+    Pairs failing with a transient error (server errors, rate limits, network issues) are not
+    retried on the spot, they are pushed back into a retry queue so the other pairs keep going.
+    A guild answering with a rate limit is paused for the time Discord asked for.
+
+    Runs go through the cog's scheduler, which lets runs with a higher priority go first and can
+    cancel a run between two pairs. Pairs left over by a cancellation are reported as skipped.
+    Each call then goes through the REST scheduler shared with the other cogs.
+    """
+
+    def __init__(
+        self,
+        cog: "RemoteBan",
+        action: Literal["unban", "ban"],
+        guilds: List[discord.Guild],
+        author: Union[discord.User, discord.Member, discord.ClientUser],
+        reason: str,
+        *,
+        create_modlog_case: bool = False,
+        policy: Optional[RetryPolicy] = None,
+        priority: Priority = Priority.NORMAL,
+    ):
+        self.cog = cog
+        self.action: Literal["unban", "ban"] = action
+        self.guilds = guilds
+        self.author = author
+        self.reason = reason
+        self.create_modlog_case = create_modlog_case
+        self.policy = policy or RetryPolicy()
+        self.priority = priority
+        self.buckets = GuildBuckets()
+
+        self.run_id = uuid.uuid4().hex
+        self._audit_reason = get_audit_reason(author, reason=reason, shorten=True)
+        # Written to the history in one batch once pairs are processed.
+        self._history: List[HistoryEntry] = []
+        self._retries: List[Tuple[float, int, int, UserCase, discord.Guild]] = []
+        self._counter = itertools.count()
+        self.job: Optional[RunJob] = None
+
+    async def run(self, users: Iterable[Union[discord.User, discord.Member]]) -> List[UserCase]:
+        """
+        Apply the action to every user in every guild of the run.
+
+        Guilds where the user is present, according to the presence index, are processed first.
+        """
+        users_cases = [UserCase(user, self.action) for user in users]
+
+        def pairs(present: bool):
+            for user_case in users_cases:
+                where = self.cog.presence.where(user_case.user.id)
+                for guild in self.guilds:
+                    if (guild.id in where) is present:
+                        yield user_case, guild
+
+        # Guilds where a user is a member come first, that is where a ban matters the most.
+        await self._process(
+            itertools.chain(pairs(True), pairs(False)), total=len(users_cases) * len(self.guilds)
+        )
+        return users_cases
+
+    async def run_pairs(self, pairs: Iterable[Tuple[Snowflake, discord.Guild]]) -> List[UserCase]:
+        """
+        Apply the action to arbitrary user/guild pairs, ignoring the guilds of the run.
+        """
+        users_cases: Dict[int, UserCase] = {}
+
+        def cases_pairs():
+            for user, guild in pairs:
+                if user.id not in users_cases:
+                    users_cases[user.id] = UserCase(user, self.action)
+                yield users_cases[user.id], guild
+
+        await self._process(cases_pairs())
+        return list(users_cases.values())
+
+    async def _process(
+        self, pairs: Iterable[Tuple[UserCase, discord.Guild]], total: Optional[int] = None
+    ):
+        scheduler = self.cog.scheduler
+        self.job = scheduler.register(self.action, self.priority, self.author.id, total)
+        try:
+            for user_case, guild in pairs:
+                if not await scheduler.turn(self.job):
+                    user_case.skipped_in(guild)
+                    continue
+                if self.buckets.is_paused(guild.id):
+                    # Do not spend an attempt on a guild we know is rate limited.
+                    self._schedule_retry(user_case, guild, 1, self.buckets.paused_until(guild.id))
+                    continue
+                await self._attempt(user_case, guild, 1)
+            await self._drain_retries()
+        finally:
+            await scheduler.finish(self.job)
+            await self._write_history()
+
+    async def _write_history(self):
+        entries, self._history = self._history, []
+        try:
+            await self.cog.history.append(entries)
+        except sqlite3.Error:
+            LOG.exception("Unable to write %s entries to the history.", len(entries))
+
+    def _record(
+        self, user_case: UserCase, guild: discord.Guild, error: Optional[Exception] = None
+    ):
+        self._history.append(
+            make_entry(
+                self.run_id,
+                self.action,
+                user_case.user.id,
+                self.author.id,
+                guild.id,
+                guild.name,
+                self.reason,
+                error,
+            )
+        )
+
+    def _schedule_retry(self, user_case: UserCase, guild: discord.Guild, attempt: int, at: float):
+        heapq.heappush(self._retries, (at, next(self._counter), attempt, user_case, guild))
+
+    async def _drain_retries(self):
+        while self._retries:
+            ready_at, _, attempt, user_case, guild = heapq.heappop(self._retries)
+            if self.job.cancelled:
+                user_case.skipped_in(guild)
+                continue
+            delay = max(ready_at, self.buckets.paused_until(guild.id)) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not await self.cog.scheduler.turn(self.job):
+                user_case.skipped_in(guild)
+                continue
+            await self._attempt(user_case, guild, attempt)
+
+    async def _attempt(self, user_case: UserCase, guild: discord.Guild, attempt: int):
+        try:
+            await self._apply(guild, user_case.user)
+        except ACTION_ERRORS as error:
+            kind, retry_after = classify_error(error)
+            if kind is ErrorKind.PERMANENT or not self.policy.can_retry(attempt):
+                user_case.failed_in(guild, error)
+                self._record(user_case, guild, error)
+                self.job.processed += 1
+                return
+            delay = self.policy.backoff(attempt)
+            if kind is ErrorKind.RATE_LIMITED and retry_after is not None:
+                self.buckets.pause(guild.id, retry_after)
+                delay = max(delay, retry_after)
+            LOG.debug(
+                "Transient error when trying to %s %s in %s (attempt %s), retrying in %.2fs: %s",
+                self.action,
+                user_case.user.id,
+                guild.id,
+                attempt,
+                delay,
+                error,
+            )
+            self._schedule_retry(user_case, guild, attempt + 1, time.monotonic() + delay)
+            return
+        if attempt > 1:
+            user_case.recovered_in(guild, attempt)
+        else:
+            user_case.banned_or_unbanned_in(guild)
+        self._record(user_case, guild)
+        self.job.processed += 1
+        if self.create_modlog_case:
+            await self._create_modlog_case(guild, user_case.user)
+
+    async def _apply(self, guild: discord.Guild, user: Union[discord.User, discord.Member]):
+        if self.action == "ban":
+            await self.cog.mirror.expect(guild.id, user.id)
+            try:
+                await self.cog.rest.run(
+                    guild.ban,
+                    user,
+                    reason=self._audit_reason,
+                    route="ban",
+                    guild_id=guild.id,
+                    priority=REST_PRIORITIES[self.priority],
+                )
+            except BaseException:
+                await self.cog.mirror.forget(guild.id, user.id)
+                raise
+        else:
+            await self.cog.rest.run(
+                guild.unban,
+                user,
+                reason=self._audit_reason,
+                route="unban",
+                guild_id=guild.id,
+                priority=REST_PRIORITIES[self.priority],
+            )
+
+    async def _create_modlog_case(
+        self, guild: discord.Guild, user: Union[discord.User, discord.Member]
+    ):
+        try:
+            await self.cog.rest.run(
+                create_case,
+                self.cog.bot,
+                guild,
+                datetime.now(),
+                self.action,
+                user,
+                self.author,
+                get_audit_reason(self.author, reason=self.reason),
+                route="modlog",
+                guild_id=guild.id,
+                priority=RestPriority.NOTIFICATION,
+            )
+        except ACTION_ERRORS as error:
+            LOG.warning(
+                "Unable to create a modlog case for %s in %s: %s", user.id, guild.id, error
+            )
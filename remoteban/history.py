@@ -0,0 +1,151 @@
+import sqlite3
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from .database import SQLiteStore, transaction
+
+# Only the latest rows are folded into summaries, so lookups do not depend on how active a
+# user or an author is. A summary is made of one row per guild.
+ROWS_PER_SUMMARY = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    action TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    guild_name TEXT,
+    success INTEGER NOT NULL,
+    reason TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS history_user ON history (user_id, created_at);
+CREATE INDEX IF NOT EXISTS history_author ON history (author_id, created_at);
+"""
+
+
+class HistoryEntry(NamedTuple):
+    """
+    The result of an action on a single user in a single guild.
+    """
+
+    run: str
+    created_at: float
+    action: str
+    user_id: int
+    author_id: int
+    guild_id: int
+    guild_name: Optional[str]
+    success: bool
+    reason: Optional[str]
+    error: Optional[str]
+
+
+class HistorySummary(NamedTuple):
+    """
+    The entries of a single run for a single user, folded together.
+    """
+
+    run: str
+    created_at: float
+    action: str
+    user_id: int
+    author_id: int
+    reason: Optional[str]
+    succeeded: int
+    failed: int
+
+
+class HistoryStore(SQLiteStore):
+    """
+    An append-only history of every ban and unban made by RemoteBan.
+
+    Entries are indexed by user and by author, lookups only read the rows of the requested user
+    whatever the size of the history is.
+    """
+
+    SCHEMA = SCHEMA
+
+    async def append(self, entries: Iterable[HistoryEntry]):
+        """
+        Write a batch of entries in a single transaction.
+        """
+        rows = list(entries)
+        if not rows:
+            return
+
+        def append(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.executemany(
+                    "INSERT INTO history (run, created_at, action, user_id, author_id, guild_id, "
+                    "guild_name, success, reason, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+        await self._run(append)
+
+    async def _summaries(self, column: str, value: int, limit: int) -> List[HistorySummary]:
+        def summaries(connection: sqlite3.Connection) -> List[HistorySummary]:
+            return [
+                HistorySummary(*row)
+                for row in connection.execute(
+                    "SELECT run, MIN(created_at) AS started_at, action, user_id, author_id, reason, "
+                    "SUM(success), SUM(1 - success) FROM ("
+                    f"SELECT * FROM history WHERE {column} = ? ORDER BY created_at DESC LIMIT ?"
+                    ") GROUP BY run, user_id ORDER BY started_at DESC LIMIT ?",
+                    (value, limit * ROWS_PER_SUMMARY, limit),
+                )
+            ]
+
+        return await self._run(summaries)
+
+    async def for_user(self, user_id: int, limit: int = 25) -> List[HistorySummary]:
+        """
+        The latest runs that affected a user.
+        """
+        return await self._summaries("user_id", user_id, limit)
+
+    async def by_author(self, author_id: int, limit: int = 25) -> List[HistorySummary]:
+        """
+        The latest actions requested by a user.
+        """
+        return await self._summaries("author_id", author_id, limit)
+
+    async def forget_user(self, user_id: int):
+        """
+        Delete everything about a user, only used for data deletion requests.
+        """
+
+        def forget(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+                connection.execute("DELETE FROM history WHERE author_id = ?", (user_id,))
+
+        await self._run(forget)
+
+
+def make_entry(
+    run: str,
+    action: str,
+    user_id: int,
+    author_id: int,
+    guild_id: int,
+    guild_name: Optional[str],
+    reason: Optional[str],
+    error: Optional[Exception] = None,
+) -> HistoryEntry:
+    return HistoryEntry(
+        run=run,
+        created_at=time.time(),
+        action=action,
+        user_id=user_id,
+        author_id=author_id,
+        guild_id=guild_id,
+        guild_name=guild_name,
+        success=error is None,
+        reason=reason,
+        error=str(error) if error is not None else None,
+    )
@@ -0,0 +1,479 @@
+import asyncio
+import sqlite3
+import time
+import uuid
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import discord
+
+from .const import LOG
+from .database import SQLiteStore, transaction
+from .engine import ActionRun
+from .report import UserCase
+
+if TYPE_CHECKING:
+    from .remoteban import RemoteBan
+
+# Time between two claims made by a worker, in seconds.
+POLL_INTERVAL = 1.0
+# Number of jobs claimed at once by a worker.
+CLAIM_SIZE = 50
+# A claimed job that is still not finished after this time is given back to other workers.
+CLAIM_TIMEOUT = 300.0
+# Pending jobs of a batch are given up if none of its jobs is claimed and nothing was claimed or
+# finished during this time.
+UNCLAIMED_TIMEOUT = 60.0
+# Once a batch is waited for this long, claims left unfinished for CLAIM_TIMEOUT are failed, for
+# when the instance that claimed them died and no other instance can take them over.
+BATCH_TIMEOUT = 900.0
+# Finished jobs are deleted after this time.
+RETENTION = 86400.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    origin INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    claimed_by INTEGER,
+    claimed_at REAL,
+    guild_name TEXT,
+    attempts INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, guild_id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+CREATE TABLE IF NOT EXISTS own_bans (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+"""
+
+
+class Job(NamedTuple):
+    id: int
+    batch: str
+    action: Literal["unban", "ban"]
+    user_id: int
+    guild_id: int
+    author_id: int
+    author: str
+    reason: str
+
+
+class JobResult(NamedTuple):
+    user_id: int
+    guild_id: int
+    guild_name: Optional[str]
+    status: str
+    attempts: Optional[int]
+    error: Optional[str]
+
+
+class JobAuthor(NamedTuple):
+    """
+    The author of a job published by another instance, used in audit log reasons.
+    """
+
+    id: int
+    name: str
+
+    def __str__(self):
+        return self.name
+
+
+class JobGuild(NamedTuple):
+    """
+    A guild reported by another instance, which may not be visible to this bot.
+    """
+
+    id: int
+    name: str
+
+
+class JobError(Exception):
+    """
+    An error reported by the instance that processed a job.
+    """
+
+
+class SharedJobQueue(SQLiteStore):
+    """
+    A table of ban/unban jobs stored in a SQLite database shared by several bots.
+
+    Each job is a single user/guild pair. Any instance able to act in a guild can claim its jobs,
+    the instance that published a batch waits for every job of it to be finished.
+    The database uses WAL mode so claims and reads from several processes do not block each other.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path: str, instance_id: Optional[int] = None):
+        super().__init__(path)
+        # The ID of the bot, only known once it is connected.
+        self.instance_id = instance_id
+
+    async def publish(
+        self,
+        action: Literal["unban", "ban"],
+        user_ids: Iterable[int],
+        guild_ids: Iterable[int],
+        author: discord.abc.User,
+        reason: str,
+    ) -> str:
+        """
+        Publish a job for every user in every guild, returns the ID of the batch.
+        """
+        batch = uuid.uuid4().hex
+        now = time.time()
+        guild_ids = list(guild_ids)
+        rows = [
+            (
+                batch,
+                self.instance_id,
+                action,
+                user_id,
+                guild_id,
+                author.id,
+                str(author),
+                reason,
+                now,
+            )
+            for user_id in user_ids
+            for guild_id in guild_ids
+        ]
+
+        def publish(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.executemany(
+                    "INSERT INTO jobs (batch, origin, action, user_id, guild_id, author_id, "
+                    "author, reason, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+        await self._run(publish)
+        return batch
+
+    async def claim(self, guild_ids: Iterable[int], limit: int = CLAIM_SIZE) -> List[Job]:
+        """
+        Claim pending jobs for the given guilds. Claims left unfinished for too long by another
+        instance are taken over.
+        """
+        guild_ids = list(guild_ids)
+        if not guild_ids:
+            return []
+        placeholders = ", ".join("?" for _ in guild_ids)
+
+        def claim(connection: sqlite3.Connection) -> List[Job]:
+            now = time.time()
+            with transaction(connection):
+                rows = connection.execute(
+                    "SELECT id, batch, action, user_id, guild_id, author_id, author, reason "
+                    "FROM jobs WHERE (status = 'pending' OR (status = 'claimed' AND claimed_at < ?)) "
+                    f"AND guild_id IN ({placeholders}) ORDER BY id LIMIT ?",
+                    (now - CLAIM_TIMEOUT, *guild_ids, limit),
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE jobs SET status = 'claimed', claimed_by = ?, claimed_at = ? WHERE id = ?",
+                    [(self.instance_id, now, row[0]) for row in rows],
+                )
+            return [Job(*row) for row in rows]
+
+        return await self._run(claim)
+
+    async def complete(self, results: List[Tuple[int, str, str, Optional[int], Optional[str]]]):
+        """
+        Write back the results of claimed jobs, as ``(job_id, status, guild_name, attempts, error)``.
+        """
+        now = time.time()
+
+        def complete(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.executemany(
+                    "UPDATE jobs SET status = ?, guild_name = ?, attempts = ?, error = ?, "
+                    "finished_at = ? WHERE id = ? AND claimed_by = ?",
+                    [
+                        (status, guild_name, attempts, error, now, job_id, self.instance_id)
+                        for job_id, status, guild_name, attempts, error in results
+                    ],
+                )
+
+        await self._run(complete)
+
+    async def progress(self, batch: str) -> Dict[str, int]:
+        """
+        Count the jobs of a batch per status.
+        """
+
+        def progress(connection: sqlite3.Connection) -> Dict[str, int]:
+            return dict(
+                connection.execute(
+                    "SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status", (batch,)
+                ).fetchall()
+            )
+
+        return await self._run(progress)
+
+    async def last_activity(self, batch: str) -> Optional[float]:
+        """
+        Return when a job of a batch was last published, claimed or finished.
+        """
+
+        def last_activity(connection: sqlite3.Connection) -> Optional[float]:
+            return connection.execute(
+                "SELECT MAX(COALESCE(finished_at, claimed_at, created_at)) FROM jobs "
+                "WHERE batch = ?",
+                (batch,),
+            ).fetchone()[0]
+
+        return await self._run(last_activity)
+
+    async def give_up(self, batch: str, reason: str, *, stale_claims: bool = False):
+        """
+        Fail every job of a batch that was never claimed, or those claimed for longer than
+        ``CLAIM_TIMEOUT`` instead if ``stale_claims`` is set.
+        """
+        now = time.time()
+
+        def give_up(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                    "WHERE batch = ? AND (status = 'pending' AND NOT ? "
+                    "OR ? AND status = 'claimed' AND claimed_at < ?)",
+                    (reason, now, batch, stale_claims, stale_claims, now - CLAIM_TIMEOUT),
+                )
+
+        await self._run(give_up)
+
+    async def expect_ban(self, guild_id: int, user_id: int, expires_at: float):
+        """
+        Mark a ban as issued by one of the instances, so none of them mirrors it.
+        """
+
+        def expect(connection: sqlite3.Connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO own_bans (guild_id, user_id, expires_at) VALUES (?, ?, ?)",
+                (guild_id, user_id, expires_at),
+            )
+
+        await self._run(expect)
+
+    async def forget_ban(self, guild_id: int, user_id: int):
+        def forget(connection: sqlite3.Connection):
+            connection.execute(
+                "DELETE FROM own_bans WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+            )
+
+        await self._run(forget)
+
+    async def is_own_ban(self, guild_id: int, user_id: int) -> bool:
+        """
+        Tell if a ban was marked by any instance and has not expired. The mark is kept, since
+        every instance in the guild receives the same ban.
+        """
+        now = time.time()
+
+        def is_own_ban(connection: sqlite3.Connection) -> bool:
+            return (
+                connection.execute(
+                    "SELECT 1 FROM own_bans WHERE guild_id = ? AND user_id = ? AND expires_at > ?",
+                    (guild_id, user_id, now),
+                ).fetchone()
+                is not None
+            )
+
+        return await self._run(is_own_ban)
+
+    async def results(self, batch: str) -> List[JobResult]:
+        def results(connection: sqlite3.Connection) -> List[JobResult]:
+            return [
+                JobResult(*row)
+                for row in connection.execute(
+                    "SELECT user_id, guild_id, guild_name, status, attempts, error FROM jobs "
+                    "WHERE batch = ? AND status IN ('done', 'failed') ORDER BY id",
+                    (batch,),
+                )
+            ]
+
+        return await self._run(results)
+
+    async def prune(self):
+        """
+        Delete finished jobs older than the retention time, and expired ban marks.
+        """
+        now = time.time()
+
+        def prune(connection: sqlite3.Connection):
+            with transaction(connection):
+                connection.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                    (now - RETENTION,),
+                )
+                connection.execute("DELETE FROM own_bans WHERE expires_at < ?", (now,))
+
+        await self._run(prune)
+
+
+class QueueWorker:
+    """
+    Drain the shared job queue for the guilds where this bot can ban, and report results back.
+    """
+
+    def __init__(self, cog: "RemoteBan", queue: SharedJobQueue):
+        self.cog = cog
+        self.queue = queue
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.queue.close()
+
+    async def _loop(self):
+        await self.cog.bot.wait_until_red_ready()
+        self.queue.instance_id = self.cog.bot.user.id
+        last_prune = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_prune > 3600:
+                    await self.queue.prune()
+                    last_prune = time.monotonic()
+                guilds = {
+                    guild.id: guild
+                    for guild in (await self.cog.obtain_guilds_where_bannable())["bannable"]
+                }
+                jobs = await self.queue.claim(guilds)
+                if jobs:
+                    await self.process(jobs, guilds)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOG.exception("Unable to process jobs from the shared queue.")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def process(self, jobs: List[Job], guilds: Dict[int, discord.Guild]):
+        create_modlog_case = await self.cog.config.send_modlog()
+        groups: Dict[Tuple[str, int, str, str], List[Job]] = {}
+        for job in jobs:
+            groups.setdefault((job.action, job.author_id, job.author, job.reason), []).append(job)
+
+        results = []
+        for (action, author_id, author_name, reason), group in groups.items():
+            author = self.cog.bot.get_user(author_id) or JobAuthor(author_id, author_name)
+            run = ActionRun(
+                self.cog,
+                action,  # type: ignore
+                [],
+                author,  # type: ignore
+                reason,
+                create_modlog_case=create_modlog_case,
+            )
+            users_cases = await run.run_pairs(
+                (discord.Object(job.user_id), guilds[job.guild_id]) for job in group
+            )
+            jobs_ids = {(job.user_id, job.guild_id): job.id for job in group}
+            for user_case in users_cases:
+                for guild in user_case.guilds_banned_or_unbanned:
+                    results.append(
+                        (
+                            jobs_ids[(user_case.user.id, guild.id)],
+                            "done",
+                            guild.name,
+                            user_case.recovered.get(guild, 1),
+                            None,
+                        )
+                    )
+                for guild, error in user_case.fails.items():
+                    results.append(
+                        (
+                            jobs_ids[(user_case.user.id, guild.id)],
+                            "failed",
+                            guild.name,
+                            None,
+                            str(error),
+                        )
+                    )
+                for guild in user_case.skipped:
+                    results.append(
+                        (
+                            jobs_ids[(user_case.user.id, guild.id)],
+                            "failed",
+                            guild.name,
+                            None,
+                            "Cancelled.",
+                        )
+                    )
+        await self.queue.complete(results)
+
+
+async def wait_for_batch(
+    queue: SharedJobQueue,
+    batch: str,
+    users: Iterable[discord.abc.User],
+    action: Literal["unban", "ban"],
+    bot,
+) -> List[UserCase]:
+    """
+    Wait until every job of a batch is finished and turn the results into user cases.
+
+    Pending jobs are only failed while none of the batch is claimed, since a worker reports the
+    results of a claim once it is done with all of it. Past ``BATCH_TIMEOUT``, jobs whose claim
+    went stale are failed, so the wait always ends even if the instance that claimed them is gone.
+    """
+    started = time.monotonic()
+    while True:
+        progress = await queue.progress(batch)
+        if not progress.get("pending") and not progress.get("claimed"):
+            break
+        if progress.get("pending") and not progress.get("claimed"):
+            last_activity = await queue.last_activity(batch)
+            if last_activity is not None and time.time() - last_activity > UNCLAIMED_TIMEOUT:
+                await queue.give_up(batch, "No instance was able to act in this guild.")
+        if progress.get("claimed") and time.monotonic() - started > BATCH_TIMEOUT:
+            await queue.give_up(
+                batch, "The instance acting in this guild stopped responding.", stale_claims=True
+            )
+        await asyncio.sleep(POLL_INTERVAL)
+
+    users_cases = {user.id: UserCase(user, action) for user in users}
+    for result in await queue.results(batch):
+        user_case = users_cases.get(result.user_id)
+        if user_case is None:
+            continue
+        guild = bot.get_guild(result.guild_id) or JobGuild(
+            result.guild_id, result.guild_name or str(result.guild_id)
+        )
+        if result.status == "done":
+            if result.attempts and result.attempts > 1:
+                user_case.recovered_in(guild, result.attempts)
+            else:
+                user_case.banned_or_unbanned_in(guild)
+        else:
+            user_case.failed_in(guild, JobError(result.error or "Unknown error"))
+    return list(users_cases.values())
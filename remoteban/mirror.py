@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, Union
+
+import discord
+
+from .const import LOG
+
+if TYPE_CHECKING:
+    from .remoteban import RemoteBan
+
+# Time during which bans are gathered before being mirrored together.
+MIRROR_WINDOW = 10.0
+# Time during which a ban issued by RemoteBan is recognized when its event comes back.
+OWN_BAN_EXPIRY = 120.0
+
+PendingMirror = Dict[int, Tuple[Union[discord.User, discord.Member], Set[int]]]
+
+
+class BanMirror:
+    """
+    Collect bans happening in registered guilds and mirror them in batches.
+
+    The first ban received opens a window of ``window`` seconds, every ban received during this
+    window is coalesced with it, then the whole batch is handed to :meth:`RemoteBan.mirror_bans`.
+    Bans issued by RemoteBan itself are marked with :meth:`expect` so their events are ignored.
+    With a shared queue, marks are also written to its database, so a ban issued by another
+    instance is not mirrored again by this one.
+    """
+
+    def __init__(self, cog: "RemoteBan", *, window: float = MIRROR_WINDOW):
+        self.cog = cog
+        self.window = window
+        self._pending: PendingMirror = {}
+        self._own_bans: Dict[Tuple[int, int], float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def expect(self, guild_id: int, user_id: int):
+        """
+        Mark a ban as issued by RemoteBan, so its ``on_member_ban`` does not get mirrored.
+        """
+        now = time.monotonic()
+        if len(self._own_bans) > 1000:
+            self._own_bans = {
+                pair: expiry for pair, expiry in self._own_bans.items() if expiry > now
+            }
+        self._own_bans[(guild_id, user_id)] = now + OWN_BAN_EXPIRY
+        if self.cog.worker:
+            try:
+                await self.cog.worker.queue.expect_ban(
+                    guild_id, user_id, time.time() + OWN_BAN_EXPIRY
+                )
+            except sqlite3.Error:
+                LOG.exception("Unable to share the mark of a ban in %s.", guild_id)
+
+    async def forget(self, guild_id: int, user_id: int):
+        self._own_bans.pop((guild_id, user_id), None)
+        if self.cog.worker:
+            try:
+                await self.cog.worker.queue.forget_ban(guild_id, user_id)
+            except sqlite3.Error:
+                LOG.exception("Unable to remove the shared mark of a ban in %s.", guild_id)
+
+    async def is_own_ban(self, guild_id: int, user_id: int) -> bool:
+        expiry = self._own_bans.pop((guild_id, user_id), None)
+        if expiry is not None and expiry > time.monotonic():
+            return True
+        if self.cog.worker:
+            try:
+                return await self.cog.worker.queue.is_own_ban(guild_id, user_id)
+            except sqlite3.Error:
+                LOG.exception("Unable to read the shared marks of bans.")
+        return False
+
+    def enqueue(self, guild: discord.Guild, user: Union[discord.User, discord.Member]):
+        _, origins = self._pending.setdefault(user.id, (user, set()))
+        origins.add(guild.id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, {}
+        # A new window may open while this batch is being processed.
+        self._flush_task = None
+        self._running.add(asyncio.current_task())  # type: ignore
+        LOG.debug("Mirroring a batch of %s ban(s).", len(batch))
+        try:
+            await self.cog.mirror_bans(batch)
+        except Exception:
+            LOG.exception("Unable to mirror a batch of %s ban(s).", len(batch))
+        finally:
+            self._running.discard(asyncio.current_task())  # type: ignore
+
+    def cancel(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        for task in list(self._running):
+            task.cancel()
+        self._pending.clear()
@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, Set
+
+import discord
+from redbot.core.bot import Red
+from redbot.core.utils import AsyncIter
+
+from .const import LOG
+
+
+class PresenceIndex:
+    """
+    A reverse index from user IDs to the registered guilds they are members of.
+
+    Built from the member cache of registered guilds, then kept up to date from member events,
+    so looking up where a user is does not require going through every guild.
+    """
+
+    def __init__(self):
+        self._index: Dict[int, Set[int]] = {}
+        self._guilds: Set[int] = set()
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def where(self, user_id: int) -> Set[int]:
+        return self._index.get(user_id, set())
+
+    def add(self, user_id: int, guild_id: int):
+        if guild_id in self._guilds:
+            self._index.setdefault(user_id, set()).add(guild_id)
+
+    def remove(self, user_id: int, guild_id: int):
+        guilds = self._index.get(user_id)
+        if guilds is None:
+            return
+        guilds.discard(guild_id)
+        if not guilds:
+            del self._index[user_id]
+
+    async def add_guild(self, guild: discord.Guild, *, chunk: bool = True):
+        """
+        Index the members of a guild, requesting them from Discord if they are not cached.
+        """
+        self._guilds.add(guild.id)
+        if chunk and not guild.chunked:
+            await guild.chunk()
+        async for member in AsyncIter(guild.members, steps=1000):
+            self.add(member.id, guild.id)
+
+    def remove_guild(self, guild_id: int):
+        self._guilds.discard(guild_id)
+        for user_id in [user_id for user_id, guilds in self._index.items() if guild_id in guilds]:
+            self.remove(user_id, guild_id)
+
+    async def sync(self, bot: Red, guild_ids: Iterable[int], *, rebuild: bool = False):
+        """
+        Make the index cover exactly the given guilds.
+
+        Parameters
+        ----------
+        rebuild: bool
+            Index every guild again, for when member events may have been missed.
+        """
+        guild_ids = set(guild_ids)
+        # Without the members intent, only the members already cached can be indexed.
+        chunk = bot.intents.members
+        if rebuild:
+            self._index.clear()
+            self._guilds.clear()
+        for guild_id in self._guilds - guild_ids:
+            self.remove_guild(guild_id)
+        for guild_id in guild_ids - self._guilds:
+            if guild := bot.get_guild(guild_id):
+                try:
+                    await self.add_guild(guild, chunk=chunk)
+                except discord.HTTPException as error:
+                    self._guilds.discard(guild_id)
+                    LOG.warning("Unable to index the members of %s: %s", guild_id, error)
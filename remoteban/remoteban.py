@@ -1,22 +1,59 @@
-from datetime import datetime
-from typing import Dict, Iterable, List, Literal, Optional, TypedDict, Union
+import asyncio
+import sqlite3
+import time
+from datetime import timedelta
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 import discord
 from discord.errors import HTTPException
 from redbot.core import Config, commands
 from redbot.core.bot import Red
-from redbot.core.modlog import create_case
-from redbot.core.utils.chat_formatting import bold, warning
-from redbot.core.utils.menus import DEFAULT_CONTROLS, menu
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import (
+    bold,
+    humanize_list,
+    inline,
+    pagify,
+)
 from redbot.core.utils.mod import get_audit_reason
 
-from .utils import allowed_to_ban
+from restscheduler import Priority as RestPriority
+from restscheduler import get_scheduler
+
+from .const import LOG
+from .engine import ActionRun
+from .history import HistoryStore, HistorySummary
+from .jobqueue import QueueWorker, SharedJobQueue, wait_for_batch
+from .mirror import BanMirror, PendingMirror
+from .presence import PresenceIndex
+from .report import BanReport, ReportMenu, ReportSource, UserCase
+from .scheduler import Priority, RunScheduler
+from .tempbans import ExpiryScheduler, TempBanRecord, is_already_lifted
+from .utils import allowed_to_ban, parse_flags
+
+# Time between two reconciliations of the registry with the guilds the bot is in, in seconds.
+RECONCILE_INTERVAL = 600.0
 
 
 class GlobalConfig(TypedDict):
     servers: List[int]
     allowed_users: List[int]
     send_modlog: bool
+    mirror_bans: bool
+    shared_queue: Optional[str]
+    tempbans: Dict[str, TempBanRecord]
+    groups: Dict[str, List[int]]
 
 
 class TypedGuildList(TypedDict):
@@ -39,53 +76,25 @@ class GuildBannableResult(TypedDict):
     not_found: List[int]
 
 
-DEFAULT_GLOBAL_CONFIG = GlobalConfig(servers=[], allowed_users=[], send_modlog=False)
+DEFAULT_GLOBAL_CONFIG = GlobalConfig(
+    servers=[],
+    allowed_users=[],
+    send_modlog=False,
+    mirror_bans=False,
+    shared_queue=None,
+    tempbans={},
+    groups={},
+)
 
 
 def yes_or_no(value: bool):
     return "Yes" if value else "No"
 
 
-def tick(text: str):
-    return f"✔️ {text}"
-
-
 def yes_or_no_emoji(value: bool):
     return "✔️" if value else "❌"
 
 
-class UserCase:
-    def __init__(self, user: Union[discord.User, discord.Member], action: Literal["unban", "ban"]):
-        self.user = user
-        self.action: Literal["unban", "ban"] = action
-        self.guilds_banned_or_unbanned: List[discord.Guild] = []
-        self.fails: Dict[discord.Guild, Exception] = {}
-
-    def banned_or_unbanned_in(self, guild: discord.Guild):
-        self.guilds_banned_or_unbanned.append(guild)
-
-    def failed_in(self, guild: discord.Guild, exception: Exception):
-        self.fails[guild] = exception
-
-    def to_embed(self):
-        description = f"{'Banned' if self.action == 'ban' else 'Unbanned'} in {len(self.guilds_banned_or_unbanned)} guild(s), failed in {len(self.fails)} guild(s).\n\n{bold('Results')}\n"
-        description += "\n".join(
-            [f"✔️ {guild.name} ({guild.id})" for guild in self.guilds_banned_or_unbanned]
-        )
-        if self.fails:
-            description += "\n" + "\n".join(
-                [
-                    f"❌ In {guild[0].name} ({guild[0].id}): {str(guild[1])}"
-                    for guild in self.fails.items()
-                ]
-            )
-        return discord.Embed(
-            color=discord.Colour.dark_red(),
-            title=f"{'Ban' if self.action == 'ban' else 'Unban'} Result For {str(self.user)}",
-            description=description,
-        )
-
-
 class RemoteBan(commands.Cog):
     """
     Ban users remotely. Available to owner(s) of the bot only.
@@ -96,8 +105,121 @@ class RemoteBan(commands.Cog):
         self.config = Config.get_conf(self, identifier=5578554655885, force_registration=True)
         self.config.register_global(**DEFAULT_GLOBAL_CONFIG)
         self.__has_accepted_conditions: bool = False
+        self.mirror = BanMirror(self)
+        self.worker: Optional[QueueWorker] = None
+        self.expiry_scheduler = ExpiryScheduler(self)
+        self.history = HistoryStore(str(cog_data_path(self) / "history.db"))
+        self.presence = PresenceIndex()
+        self.scheduler = RunScheduler()
+        # Shared with the other cogs, so bans go before their notifications.
+        self.rest = get_scheduler(bot)
+        self._presence_tasks: Set[asyncio.Task] = set()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        # Registered guilds not found on the last reconciliation pass.
+        self._missing_guilds: Set[int] = set()
+        self._bannable_cache: Optional[GuildBannableResult] = None
+        # Bumped on every invalidation so a resolution started before it is not cached.
+        self._bannable_generation: int = 0
         super().__init__(*args, **kwargs)
 
+    async def cog_load(self):
+        await self.start_shared_queue()
+        self.expiry_scheduler.load(await self.config.tempbans())
+        self.expiry_scheduler.start()
+        self.sync_presence(rebuild=True)
+        self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+
+    async def cog_unload(self):
+        self.mirror.cancel()
+        if self._reconcile_task:
+            self._reconcile_task.cancel()
+        for task in self._presence_tasks:
+            task.cancel()
+        self.expiry_scheduler.stop()
+        self.history.close()
+        if self.worker:
+            self.worker.stop()
+
+    async def start_shared_queue(self):
+        """
+        Start draining the shared queue if one is set, stopping the previous worker if any.
+        """
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+        if path := await self.config.shared_queue():
+            self.worker = QueueWorker(self, SharedJobQueue(path))
+            self.worker.start()
+
+    async def _reconcile_loop(self):
+        await self.bot.wait_until_red_ready()
+        while True:
+            try:
+                await self.reconcile_registry()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOG.exception("Unable to reconcile the registered guilds.")
+            await asyncio.sleep(RECONCILE_INTERVAL)
+
+    async def reconcile_registry(self) -> List[int]:
+        """
+        Remove registered guilds the bot is no longer in, drop unregistered guilds from groups,
+        then refresh the cached permission state. Return the IDs of the removed guilds.
+
+        This catches guilds left while the cog was not loaded, each setting is written at most
+        once whatever the number of removed guilds. The guild cache is cleared while shards
+        identify again, so nothing is removed unless every shard is connected, and a guild must
+        be missing on two passes in a row.
+        """
+        if not self.bot.is_ready() or any(shard.is_closed() for shard in self.bot.shards.values()):
+            LOG.debug("Not every shard is connected, skipping the reconciliation.")
+            self._missing_guilds.clear()
+            return []
+        async with self.config.servers() as registered, self.config.groups() as groups:
+            missing = {guild_id for guild_id in registered if self.bot.get_guild(guild_id) is None}
+            removed = [
+                guild_id
+                for guild_id in registered
+                if guild_id in missing and guild_id in self._missing_guilds
+            ]
+            self._missing_guilds = missing.difference(removed)
+            if removed:
+                registered[:] = [guild_id for guild_id in registered if guild_id not in removed]
+                for guild_id in removed:
+                    self.presence.remove_guild(guild_id)
+                LOG.info("Removed %s guild(s) I am no longer in from the registry.", len(removed))
+            # Groups may also refer to guilds unregistered by other means.
+            kept = set(registered)
+            for name, guild_ids in groups.items():
+                if not kept.issuperset(guild_ids):
+                    groups[name] = [guild_id for guild_id in guild_ids if guild_id in kept]
+        self.invalidate_bannable_cache()
+        await self.obtain_guilds_where_bannable()
+        return removed
+
+    def sync_presence(self, *, rebuild: bool = False):
+        """
+        Update the presence index with the registered guilds in the background.
+
+        Parameters
+        ----------
+        rebuild: bool
+            Index every registered guild again, for when member events may have been missed.
+        """
+
+        async def sync():
+            await self.bot.wait_until_red_ready()
+            await self.presence.sync(self.bot, await self.config.servers(), rebuild=rebuild)
+
+        if rebuild:
+            # A rebuild supersedes any sync still running.
+            for task in self._presence_tasks:
+                task.cancel()
+        task = asyncio.create_task(sync())
+        self._presence_tasks.add(task)
+        task.add_done_callback(self._presence_tasks.discard)
+
     async def translate_users(self, users_list: Iterable[Union[discord.User, int]]) -> UserTranslator:
         not_found = []
         users = []
@@ -145,6 +267,8 @@ class RemoteBan(commands.Cog):
             if fetched_guild.id in guilds:
                 raise commands.UserFeedbackCheckFailure("This guild is already registered.")
             guilds.append(fetched_guild.id)
+        self.invalidate_bannable_cache()
+        self.sync_presence()
         return True
 
     async def add_user(self, user: int):
@@ -164,12 +288,44 @@ class RemoteBan(commands.Cog):
     async def remove_server(self, guild: Union[int, discord.Guild]):
         guild_id = guild.id if isinstance(guild, discord.Guild) else guild
         async with self.config.servers() as guilds:
-            if guild not in guilds:
+            if guild_id not in guilds:
                 raise commands.UserFeedbackCheckFailure("This guild is not registered.")
             guilds.remove(guild_id)
+        self.invalidate_bannable_cache()
+        self.presence.remove_guild(guild_id)
         return True
 
+    def invalidate_bannable_cache(self):
+        """
+        Drop the cached result of :meth:`obtain_guilds_where_bannable`.
+
+        Must be called whenever the registry or the bot's permissions in a guild may change.
+        """
+        self._bannable_generation += 1
+        self._bannable_cache = None
+
+    def is_cached_guild(self, guild_id: int) -> bool:
+        """
+        Tell if a guild is part of the cached result, in which case it must be invalidated when
+        something changes in this guild.
+        """
+        return self._bannable_cache is not None and guild_id in self._bannable_cache["all"]
+
     async def obtain_guilds_where_bannable(self) -> GuildBannableResult:
+        """
+        Return registered guilds, sorted by whether the bot can ban in them or not.
+
+        The result is cached until the registry or the bot's permissions change.
+        """
+        if self._bannable_cache is not None:
+            return self._bannable_cache
+        generation = self._bannable_generation
+        result = await self._resolve_guilds_where_bannable()
+        if generation == self._bannable_generation:
+            self._bannable_cache = result
+        return result
+
+    async def _resolve_guilds_where_bannable(self) -> GuildBannableResult:
         guilds_config = await self.config.servers()
         guilds = []
         not_found_guilds = []
@@ -192,111 +348,267 @@ class RemoteBan(commands.Cog):
     async def ban_users(
         self,
         users: UserTranslator,
-        guilds: GuildBannableResult,
+        guilds: List[discord.Guild],
         ban_author: discord.User,
         reason: str,
+        *,
+        priority: Priority = Priority.NORMAL,
     ) -> List[UserCase]:
-        create_modlog_case = await self.config.send_modlog()
-        users_cases: List[UserCase] = []
-
-        for user in users["users"]:
-            user_case = UserCase(user, "ban")
-            users_cases.append(user_case)  # I love immutable objects... :')
-            for guild in guilds:
-                try:
-                    await guild.ban(
-                        user, reason=get_audit_reason(ban_author, reason=reason, shorten=True)
-                    )
-                    if create_modlog_case:
-                        await create_case(
-                            self.bot,
-                            guild,
-                            datetime.now(),
-                            "ban",
-                            user,
-                            ban_author,
-                            get_audit_reason(ban_author, reason=reason),
-                        )
-                    user_case.banned_or_unbanned_in(guild)
-                except (discord.HTTPException, discord.Forbidden) as error:
-                    user_case.failed_in(guild, error)
-        return users_cases
-
-    @staticmethod
-    def get_all_embeds(
-        users_cases: List[UserCase],
-        fetched_users: UserTranslator,
-        guilds_removed: Optional[List[str]],
-        action: Literal["unban", "ban"],
-    ) -> List[discord.Embed]:
-        wording = "unban" if action == "unban" else "ban"
-        total_fails = sum(len(user.fails) for user in users_cases)
-        total_success = sum(len(user.guilds_banned_or_unbanned) for user in users_cases)
-        first_embed = discord.Embed(
-            color=discord.Color.dark_orange(),
-            title="Summary",
-            description=(
-                (
-                    "A total of {users_count} user(s) have been processed.\n\n"
-                    "A total of {total_success} {wording}, for a total of {total_fails} failure(s).\n"
-                    "A more in depth result is available in this menu."
-                ).format(
-                    users_count=bold(str(len(fetched_users["users"]))),
-                    total_success=bold(str(total_success)),
-                    wording=bold(wording),
-                    total_fails=bold(str(total_fails)),
-                )
-            ),
+        run = ActionRun(
+            self,
+            "ban",
+            guilds,
+            ban_author,
+            reason,
+            create_modlog_case=await self.config.send_modlog(),
+            priority=priority,
         )
-        if guilds_removed:
-            first_embed.add_field(
-                name=warning("One or more guilds have been removed"),
-                value=(
-                    "These guilds did not process bans because I am missing permissions to ban users or an error happened:\n"
-                    + "\n".join([f"- {guild}" for guild in guilds_removed])
-                ),
+        return await run.run(users["users"])
+
+    async def mirror_bans(self, batch: PendingMirror):
+        """
+        Ban a batch of users that were banned in one or more registered guilds, in every other
+        registered guild.
+        """
+        guilds = (await self.obtain_guilds_where_bannable())["bannable"]
+        by_origins: Dict[FrozenSet[int], List[Union[discord.User, discord.Member]]] = {}
+        for user, origins in batch.values():
+            by_origins.setdefault(frozenset(origins), []).append(user)
+        for origins, users in by_origins.items():
+            targets = [guild for guild in guilds if guild.id not in origins]
+            if not targets:
+                continue
+            origin_names = humanize_list(
+                [
+                    guild.name if (guild := self.bot.get_guild(guild_id)) else str(guild_id)
+                    for guild_id in origins
+                ]
             )
-        else:
-            first_embed.add_field(
-                name=tick("All guilds have processed bans"),
-                value="No errors related to guild's permissions occured when banning users in guilds.",
+            users_cases = await self.ban_users(
+                UserTranslator(users=users, not_found=[], errored={}),
+                targets,
+                self.bot.user,
+                f"Ban mirrored from {origin_names}.",
+            )
+            LOG.info(
+                "Mirrored %s ban(s) from %s into %s guild(s), %s failure(s).",
+                len(users),
+                origin_names,
+                len(targets),
+                sum(len(case.fails) for case in users_cases),
             )
-        embeds = [first_embed]
-        embeds.extend(user.to_embed() for user in users_cases)
-        return embeds
 
     async def unban_users(
         self,
         users: UserTranslator,
-        guilds: GuildBannableResult,
+        guilds: List[discord.Guild],
         unban_author: discord.User,
         reason: str,
+        *,
+        priority: Priority = Priority.NORMAL,
     ) -> List[UserCase]:
-        create_modlog_case = await self.config.send_modlog()
-        users_cases: List[UserCase] = []
+        run = ActionRun(
+            self,
+            "unban",
+            guilds,
+            unban_author,
+            reason,
+            create_modlog_case=await self.config.send_modlog(),
+            priority=priority,
+        )
+        return await run.run(users["users"])
 
-        for user in users["users"]:
-            user_case = UserCase(user, "unban")
-            users_cases.append(user_case)  # I love immutable objects... :')
-            for guild in guilds:
-                try:
-                    await guild.unban(
-                        user, reason=get_audit_reason(unban_author, reason, shorten=True)
-                    )
-                    if create_modlog_case:
-                        await create_case(
-                            self.bot,
-                            guild,
-                            datetime.now(),
-                            "unban",
-                            user,
-                            unban_author,
-                            get_audit_reason(unban_author, reason=reason),
-                        )
-                    user_case.banned_or_unbanned_in(guild)
-                except (discord.HTTPException, discord.Forbidden) as error:
-                    user_case.failed_in(guild, error)
-        return users_cases
+    async def dispatch_action(
+        self,
+        action: Literal["unban", "ban"],
+        users: List[Union[discord.User, discord.Member, discord.Object]],
+        guild_ids: List[int],
+        author: Union[discord.User, discord.Member, discord.ClientUser],
+        reason: str,
+        *,
+        priority: Priority = Priority.NORMAL,
+    ) -> List[UserCase]:
+        """
+        Apply an action to users in the given registered guilds.
+
+        When a shared queue is set, the work is published for every participating instance
+        instead of being done by this bot alone, and the priority is not kept.
+        """
+        if self.worker:
+            batch = await self.worker.queue.publish(
+                action, (user.id for user in users), guild_ids, author, reason
+            )
+            return await wait_for_batch(self.worker.queue, batch, users, action, self.bot)
+        targets = set(guild_ids)
+        guilds = [
+            guild
+            for guild in (await self.obtain_guilds_where_bannable())["bannable"]
+            if guild.id in targets
+        ]
+        apply = self.ban_users if action == "ban" else self.unban_users
+        return await apply(
+            UserTranslator(users=users, not_found=[], errored={}),
+            guilds,
+            author,
+            reason,
+            priority=priority,
+        )
+
+    async def run_action_command(
+        self,
+        ctx: commands.Context,
+        action: Literal["unban", "ban"],
+        users: List[Union[discord.User, int]],
+        reason: str,
+    ):
+        """
+        Apply an action in registered guilds and send the report, for the `ban` and `unban`
+        commands.
+        """
+        flags, reason = parse_flags(
+            reason, ["for", "group", "except"] if action == "ban" else ["group", "except"]
+        )
+        reason = reason or "No reason providen"
+        duration = None
+        if "for" in flags:
+            try:
+                duration = commands.parse_timedelta(flags["for"][-1], minimum=timedelta(minutes=1))
+            except commands.BadArgument as error:
+                raise commands.UserFeedbackCheckFailure(str(error))
+            if duration is None:
+                raise commands.UserFeedbackCheckFailure(
+                    f"`{flags['for'][-1]}` is not a valid duration, use something like `7d`."
+                )
+        targets = await self.resolve_targets(flags.get("group", []), flags.get("except", []))
+        async with ctx.typing():
+            guilds = await self.obtain_guilds_where_bannable()
+            fetched_users = await self.translate_users(users)
+            result = await self.dispatch_action(
+                action,
+                fetched_users["users"],
+                [guild_id for guild_id in guilds["all"] if guild_id in targets],
+                ctx.author,
+                reason,
+                priority=Priority.INTERACTIVE if len(users) == 1 else Priority.BULK,
+            )
+            if self.worker:
+                # Other instances may act in guilds where this bot cannot.
+                guilds_not_processed = []
+            else:
+                guilds_not_processed = [
+                    str(guild.id) for guild in guilds["missing_permission"] if guild.id in targets
+                ] + [str(guild) for guild in guilds["not_found"] if guild in targets]
+            await self.update_tempbans(result, duration, ctx.author, reason)
+        report = BanReport(
+            result,
+            action=action,
+            not_found_users=fetched_users["not_found"],
+            errored_users=fetched_users["errored"],
+            guilds_removed=guilds_not_processed,
+        )
+        await ReportMenu(ReportSource(report), timeout=60, clear_reactions_after=True).start(ctx)
+
+    async def resolve_targets(self, groups: List[str], excepted: List[str]) -> Set[int]:
+        """
+        Resolve the guilds targeted by an action, from the union of the given groups minus the
+        excepted groups. No group means every registered guild.
+        """
+        saved_groups: Dict[str, List[int]] = await self.config.groups()
+        unknown = [name for name in groups + excepted if name.lower() not in saved_groups]
+        if unknown:
+            raise commands.UserFeedbackCheckFailure(
+                f"Unknown group(s): {humanize_list([inline(name) for name in unknown])}."
+            )
+        if groups:
+            targets = set().union(*(saved_groups[name.lower()] for name in groups))
+        else:
+            targets = set(await self.config.servers())
+        for name in excepted:
+            targets.difference_update(saved_groups[name.lower()])
+        return targets
+
+    async def update_tempbans(
+        self,
+        users_cases: List[UserCase],
+        duration: Optional[timedelta],
+        author: discord.abc.User,
+        reason: str,
+    ):
+        """
+        Record the expiry of temporary bans. Any other ban or unban of a user cancels the
+        temporary ban it may have.
+        """
+        expires_at = time.time() + duration.total_seconds() if duration else None
+        async with self.config.tempbans() as tempbans:
+            for user_case in users_cases:
+                if expires_at is None or user_case.action == "unban":
+                    tempbans.pop(str(user_case.user.id), None)
+                    continue
+                if not user_case.guilds_banned_or_unbanned:
+                    continue
+                tempbans[str(user_case.user.id)] = TempBanRecord(
+                    expires_at=expires_at,
+                    guilds=[guild.id for guild in user_case.guilds_banned_or_unbanned],
+                    author_id=author.id,
+                    reason=reason,
+                )
+                self.expiry_scheduler.push(expires_at, user_case.user.id)
+
+    async def expire_tempbans(self, due: List[Tuple[float, int]]) -> List[Tuple[float, int]]:
+        """
+        Unban users whose temporary ban expired, in as few fan-outs as possible.
+
+        The records of users that could not be unbanned everywhere are kept with the guilds left,
+        and their deadlines are returned to be tried again.
+        """
+        tempbans: Dict[str, TempBanRecord] = await self.config.tempbans()
+        by_guilds: Dict[FrozenSet[int], List[discord.Object]] = {}
+        expired: Dict[str, float] = {}
+        left: Dict[str, List[int]] = {}
+        for expires_at, user_id in due:
+            record = tempbans.get(str(user_id))
+            if record is None or record["expires_at"] != expires_at:
+                # The temporary ban was lifted or replaced since this deadline was scheduled.
+                continue
+            expired[str(user_id)] = expires_at
+            by_guilds.setdefault(frozenset(record["guilds"]), []).append(discord.Object(user_id))
+        for guild_ids, users in by_guilds.items():
+            users_cases = await self.dispatch_action(
+                "unban",
+                users,
+                list(guild_ids),
+                self.bot.user,
+                "Temporary ban expired.",
+                priority=Priority.BULK,
+            )
+            LOG.info(
+                "Lifted %s temporary ban(s) in %s guild(s), %s failure(s).",
+                len(users),
+                len(guild_ids),
+                sum(len(case.fails) for case in users_cases),
+            )
+            for user_case in users_cases:
+                guilds = [
+                    guild.id
+                    for guild, error in user_case.fails.items()
+                    if not is_already_lifted(error)
+                ]
+                guilds.extend(guild.id for guild in user_case.skipped)
+                if guilds:
+                    left[str(user_case.user.id)] = guilds
+        retry = []
+        if expired:
+            async with self.config.tempbans() as tempbans:
+                for user_id, expires_at in expired.items():
+                    record = tempbans.get(user_id)
+                    if record is None or record["expires_at"] != expires_at:
+                        continue
+                    if user_id in left:
+                        record["guilds"] = left[user_id]
+                        retry.append((expires_at, int(user_id)))
+                    else:
+                        del tempbans[user_id]
+        return retry
 
     @commands.group(name="remoteban", aliases=["rban"])
     @allowed_to_ban()
@@ -315,18 +627,19 @@ class RemoteBan(commands.Cog):
     ):
         """
         Ban an user from set guilds.
+
+        Options can be given before the reason:
+        - `--for <duration>`: Ban temporarily, the users will be unbanned once it is over.
+        - `--group <name>`: Only ban in the guilds of this group. Can be repeated.
+        - `--except <name>`: Do not ban in the guilds of this group. Can be repeated.
+
+        Examples:
+        - `[p]rban ban 1234567890 --for 7d Spamming`
+        - `[p]rban ban 1234567890 --group gaming --except eu Raiding`
         """
         if not users:
             return await ctx.send_help()
-        async with ctx.typing():
-            guilds = await self.obtain_guilds_where_bannable()
-            fetched_users = await self.translate_users(users)
-            result = await self.ban_users(fetched_users, guilds["bannable"], ctx.author, reason)
-        guilds_not_processed = [str(guild.id) for guild in guilds["missing_permission"]] + [
-            str(guild) for guild in guilds["not_found"]
-        ]
-        embeds = self.get_all_embeds(result, fetched_users, guilds_not_processed, "ban")
-        await menu(ctx, embeds, DEFAULT_CONTROLS, timeout=60)
+        await self.run_action_command(ctx, "ban", users, reason)
 
     @rban.command(name="unban")
     async def unban_user(
@@ -338,18 +651,169 @@ class RemoteBan(commands.Cog):
     ):
         """
         Unban an user from set guilds.
+
+        Options can be given before the reason:
+        - `--group <name>`: Only unban in the guilds of this group. Can be repeated.
+        - `--except <name>`: Do not unban in the guilds of this group. Can be repeated.
         """
         if not users:
             return await ctx.send_help()
-        async with ctx.typing():
-            guilds = await self.obtain_guilds_where_bannable()
-            fetched_users = await self.translate_users(users)
-            result = await self.unban_users(fetched_users, guilds["bannable"], ctx.author, reason)
-        guilds_not_processed = [str(guild.id) for guild in guilds["missing_permission"]] + [
-            str(guild) for guild in guilds["not_found"]
+        await self.run_action_command(ctx, "unban", users, reason)
+
+    @rban.command(name="jobs")
+    async def list_jobs(self, ctx: commands.Context):
+        """
+        List ban and unban runs in progress, in the order they are processed.
+        """
+        jobs = self.scheduler.jobs
+        if not jobs:
+            return await ctx.send("There is no run in progress.")
+        lines = [
+            f"{bold(f'#{job.id}')} - {job.action.capitalize()} by "
+            f"{self.bot.get_user(job.author_id) or job.author_id}, started "
+            f"<t:{int(job.started_at)}:R> - {job.processed}/{job.total or '?'} pair(s) processed "
+            f"- Priority: {job.priority.name.lower()}" + (" (cancelling)" if job.cancelled else "")
+            for job in jobs
+        ]
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @rban.command(name="cancel")
+    async def cancel_job(self, ctx: commands.Context, job_id: int):
+        """
+        Cancel a ban or unban run in progress.
+
+        The run stops before its next user/guild pair, what was already done is kept and reported.
+        Use `[p]rban jobs` to find the ID of a run.
+        """
+        if not await self.scheduler.cancel(job_id):
+            return await ctx.send("There is no run in progress with this ID.")
+        await ctx.send(f"Run #{job_id} will stop before its next user/guild pair.")
+
+    @rban.command(name="tempbans")
+    async def list_tempbans(self, ctx: commands.Context):
+        """
+        List temporary bans that are still running.
+        """
+        tempbans: Dict[str, TempBanRecord] = await self.config.tempbans()
+        if not tempbans:
+            return await ctx.send("There is no temporary ban running.")
+        lines = [
+            f"{user_id} - Expires <t:{int(record['expires_at'])}:R> in "
+            f"{len(record['guilds'])} guild(s) - {record['reason']}"
+            for user_id, record in sorted(tempbans.items(), key=lambda item: item[1]["expires_at"])
         ]
-        embeds = self.get_all_embeds(result, fetched_users, guilds_not_processed, "unban")
-        await menu(ctx, embeds, DEFAULT_CONTROLS, timeout=60)
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    def format_history(self, summaries: List[HistorySummary]) -> str:
+        lines = []
+        for summary in summaries:
+            author = self.bot.get_user(summary.author_id)
+            lines.append(
+                f"<t:{int(summary.created_at)}:f> - {bold(summary.action.capitalize())} of "
+                f"{summary.user_id} by {author or summary.author_id} in {summary.succeeded} "
+                f"guild(s), failed in {summary.failed} guild(s).\nReason: {summary.reason}"
+            )
+        return "\n\n".join(lines)
+
+    @rban.command(name="history")
+    async def show_user_history(self, ctx: commands.Context, user: Union[discord.User, int]):
+        """
+        Show the latest bans and unbans made against an user across registered guilds.
+        """
+        user_id = user if isinstance(user, int) else user.id
+        summaries = await self.history.for_user(user_id)
+        if not summaries:
+            return await ctx.send("There is no history for this user.")
+        for page in pagify(self.format_history(summaries), delims=["\n\n"]):
+            await ctx.send(page)
+
+    @rban.command(name="actionsby")
+    async def show_author_history(self, ctx: commands.Context, user: Union[discord.User, int]):
+        """
+        Show the latest bans and unbans requested by an user.
+        """
+        user_id = user if isinstance(user, int) else user.id
+        summaries = await self.history.by_author(user_id)
+        if not summaries:
+            return await ctx.send("This user has not banned or unbanned anyone.")
+        for page in pagify(self.format_history(summaries), delims=["\n\n"]):
+            await ctx.send(page)
+
+    def where_is(self, user_id: int) -> List[discord.Member]:
+        """
+        Return the members of an user in registered guilds, from the presence index.
+        """
+        members = []
+        for guild_id in self.presence.where(user_id):
+            guild = self.bot.get_guild(guild_id)
+            if guild and (member := guild.get_member(user_id)):
+                members.append(member)
+        return sorted(members, key=lambda member: member.guild.name.lower())
+
+    @rban.command(name="whereis")
+    async def where_is_user(self, ctx: commands.Context, user: Union[discord.User, int]):
+        """
+        Show the registered guilds an user is a member of, and when they joined them.
+        """
+        user_id = user if isinstance(user, int) else user.id
+        members = self.where_is(user_id)
+        if not members:
+            return await ctx.send("This user is not a member of any registered guild.")
+        lines = [
+            f"{member.guild.name} ({member.guild.id}) - Joined "
+            + (
+                f"<t:{int(member.joined_at.timestamp())}:f>"
+                if member.joined_at
+                else "at an unknown date"
+            )
+            for member in members
+        ]
+        for page in pagify(f"{bold(str(members[0]))} is a member of:\n" + "\n".join(lines)):
+            await ctx.send(page)
+
+    @rban.command(name="kick")
+    async def kick_user(
+        self,
+        ctx: commands.Context,
+        user: Union[discord.User, int],
+        *,
+        reason: str = "No reason providen",
+    ):
+        """
+        Kick an user from every registered guild they are a member of.
+        """
+        user_id = user if isinstance(user, int) else user.id
+        members = self.where_is(user_id)
+        if not members:
+            return await ctx.send("This user is not a member of any registered guild.")
+        audit_reason = get_audit_reason(ctx.author, reason=reason, shorten=True)
+        kicked = []
+        failed = []
+        async with ctx.typing():
+            for member in members:
+                if not member.guild.me.guild_permissions.kick_members:
+                    failed.append(f"{member.guild.name}: Missing permission to kick.")
+                    continue
+                try:
+                    await self.rest.run(
+                        member.guild.kick,
+                        member,
+                        reason=audit_reason,
+                        route="kick",
+                        guild_id=member.guild.id,
+                        priority=RestPriority.CRITICAL,
+                    )
+                except discord.HTTPException as error:
+                    failed.append(f"{member.guild.name}: {error}")
+                else:
+                    kicked.append(member.guild.name)
+        message = f"Kicked from {len(kicked)} guild(s): {humanize_list(kicked) or 'None'}."
+        if failed:
+            message += f"\nFailed in {len(failed)} guild(s):\n" + "\n".join(failed)
+        for page in pagify(message):
+            await ctx.send(page)
 
     @rban.group(name="set")
     @commands.is_owner()
@@ -370,24 +834,27 @@ class RemoteBan(commands.Cog):
     async def list_servers_in_remoteban(self, ctx: commands.Context):
         """
         List registered guilds.
+
+        Guilds I am no longer in are removed in the background, they are listed until then.
         """
-        guilds = await self.config.servers()
-        guild_obj: List[TypedGuildList] = []
-        for guild_id in guilds:
-            guild = self.bot.get_guild(guild_id)
-            if not guild:
-                await self.remove_server(guild)
-                continue
-            can_ban = guild.me.guild_permissions.ban_members
-            guild_obj.append(
-                TypedGuildList(
-                    guild_id=guild_id,
-                    guild_name=guild.name,
-                    guild_owner=guild.owner,
-                    can_ban=can_ban,
-                )
+        guilds = await self.obtain_guilds_where_bannable()
+        resolved = {guild.id: guild for guild in guilds["bannable"] + guilds["missing_permission"]}
+        bannable = set(guild.id for guild in guilds["bannable"])
+        guild_obj: List[TypedGuildList] = [
+            TypedGuildList(
+                guild_id=guild_id,
+                guild_name=resolved[guild_id].name,
+                guild_owner=resolved[guild_id].owner,
+                can_ban=guild_id in bannable,
             )
-        await ctx.send(
+            for guild_id in guilds["all"]
+            if guild_id in resolved
+        ]
+        not_found = "".join(
+            f"\n{guild_id} - Not found, will be removed shortly"
+            for guild_id in guilds["not_found"]
+        )
+        message = (
             (
                 "These guilds will remote ban users you want to ban:\n"
                 "{guilds}".format(
@@ -398,10 +865,13 @@ class RemoteBan(commands.Cog):
                         ]
                     )
                 )
+                + not_found
             )
-            if guild_obj
+            if guilds["all"]
             else "There is no guilds registered."
         )
+        for page in pagify(message):
+            await ctx.send(page)
 
     @settings.command(name="removeserver", aliases=["removeserv", "rms", "rm"])
     async def remove_server_in_remoteban(self, ctx: commands.Context, guild: int):
@@ -423,6 +893,114 @@ class RemoteBan(commands.Cog):
         await self.config.send_modlog.set(state)
         await ctx.tick()
 
+    @settings.command(name="mirror")
+    async def set_mirror_bans(self, ctx: commands.Context, *, state: bool = None):
+        """
+        Determine if bans made in a registered guild should be applied in all other registered guilds.
+
+        Bans happening within a few seconds are grouped together before being mirrored.
+        """
+        if state is None:
+            return await ctx.send(
+                f"Mirror bans across registered guilds: {yes_or_no(await self.config.mirror_bans())}"
+            )
+        await self.config.mirror_bans.set(state)
+        await ctx.tick()
+
+    @settings.command(name="sharedqueue")
+    async def set_shared_queue(self, ctx: commands.Context, *, path: str = None):
+        """
+        Set the SQLite database used to share bans with other bots, or disable it.
+
+        Every bot using the same file will process bans for the guilds where it can ban, and
+        bans made with `rban ban` will be split between them. Leave empty to disable.
+        """
+        if path is None:
+            await self.config.shared_queue.clear()
+            await self.start_shared_queue()
+            return await ctx.send("Bans will no longer be shared with other bots.")
+        queue = SharedJobQueue(path)
+        try:
+            await queue.progress("")
+        except sqlite3.Error as error:
+            return await ctx.send(f"I cannot use this database: {error}")
+        finally:
+            queue.close()
+        await self.config.shared_queue.set(path)
+        await self.start_shared_queue()
+        await ctx.send("Bans will now be shared with bots using the same database.")
+
+    @settings.group(name="group", aliases=["groups"])
+    async def group_manager(self, ctx: commands.Context):
+        """
+        Manage groups of registered guilds, so bans can target only some of them.
+
+        Use groups with `--group <name>` and `--except <name>` in `rban ban` and `rban unban`.
+        """
+
+    @group_manager.command(name="add")
+    async def add_guilds_to_group(self, ctx: commands.Context, name: str, *guild_ids: int):
+        """
+        Add guilds to a group, creating the group if needed.
+        """
+        if not guild_ids:
+            return await ctx.send_help()
+        registered = await self.config.servers()
+        not_registered = [str(guild_id) for guild_id in guild_ids if guild_id not in registered]
+        if not_registered:
+            return await ctx.send(
+                f"These guilds are not registered: {humanize_list(not_registered)}."
+            )
+        async with self.config.groups() as groups:
+            group = groups.setdefault(name.lower(), [])
+            group.extend(guild_id for guild_id in guild_ids if guild_id not in group)
+        await ctx.tick()
+
+    @group_manager.command(name="remove", aliases=["rm"])
+    async def remove_guilds_from_group(self, ctx: commands.Context, name: str, *guild_ids: int):
+        """
+        Remove guilds from a group.
+        """
+        if not guild_ids:
+            return await ctx.send_help()
+        async with self.config.groups() as groups:
+            if name.lower() not in groups:
+                return await ctx.send("This group does not exist.")
+            groups[name.lower()] = [
+                guild_id for guild_id in groups[name.lower()] if guild_id not in guild_ids
+            ]
+        await ctx.tick()
+
+    @group_manager.command(name="delete", aliases=["del"])
+    async def delete_group(self, ctx: commands.Context, name: str):
+        """
+        Delete a group. Guilds stay registered.
+        """
+        async with self.config.groups() as groups:
+            if groups.pop(name.lower(), None) is None:
+                return await ctx.send("This group does not exist.")
+        await ctx.tick()
+
+    @group_manager.command(name="list", aliases=["ls"])
+    async def list_groups(self, ctx: commands.Context):
+        """
+        List groups and their guilds.
+        """
+        groups: Dict[str, List[int]] = await self.config.groups()
+        if not groups:
+            return await ctx.send("There is no group.")
+        lines = []
+        for name, guild_ids in sorted(groups.items()):
+            guilds_names = [
+                guild.name if (guild := self.bot.get_guild(guild_id)) else str(guild_id)
+                for guild_id in guild_ids
+            ]
+            lines.append(
+                f"{bold(name)} ({len(guild_ids)} guild(s)): {humanize_list(guilds_names) or 'Empty'}"
+            )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
     @settings.group(name="users", aliases=["u", "user"])
     async def user_manager(self, ctx: commands.Context):
         """
@@ -480,3 +1058,62 @@ class RemoteBan(commands.Cog):
         async with self.config.servers() as guilds:
             if guild.id in guilds:
                 guilds.remove(guild.id)
+        self.invalidate_bannable_cache()
+        self.presence.remove_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        # A registered guild that was not found may now be available.
+        self.invalidate_bannable_cache()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Guild objects are recreated when the bot identifies again, and member events may have
+        # been missed in the meantime.
+        self.invalidate_bannable_cache()
+        self.sync_presence(rebuild=True)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions and self.is_cached_guild(after.guild.id):
+            self.invalidate_bannable_cache()
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        if self.is_cached_guild(role.guild.id):
+            self.invalidate_bannable_cache()
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if after.id != self.bot.user.id or before.roles == after.roles:
+            return
+        if self.is_cached_guild(after.guild.id):
+            self.invalidate_bannable_cache()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.presence.add(member.id, member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.presence.remove(member.id, member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_ban(self, guild: discord.Guild, user: Union[discord.User, discord.Member]):
+        if not await self.config.mirror_bans():
+            return
+        if await self.bot.cog_disabled_in_guild(self, guild):
+            return
+        if guild.id not in await self.config.servers():
+            return
+        # Checked last, it may query the shared queue.
+        if await self.mirror.is_own_ban(guild.id, user.id):
+            return
+        self.mirror.enqueue(guild, user)
+
+    async def red_delete_data_for_user(self, *, requester, user_id: int):
+        if requester != "discord_deleted_user":
+            return
+        async with self.config.tempbans() as tempbans:
+            tempbans.pop(str(user_id), None)
+        await self.history.forget_user(user_id)
@@ -0,0 +1,299 @@
+import csv
+import io
+from typing import Dict, Iterable, List, Literal, Optional, Tuple, Union
+
+import discord
+from redbot.core.utils.chat_formatting import bold, text_to_file, warning
+from redbot.vendored.discord.ext import menus
+
+# Discord allows 4096 characters in an embed's description, we keep some room for safety.
+DESCRIPTION_LIMIT = 3900
+ERROR_TEXT_LIMIT = 200
+
+
+def tick(text: str):
+    return f"✔️ {text}"
+
+
+def short_error(error: Exception) -> str:
+    text = str(error) or type(error).__name__
+    if len(text) > ERROR_TEXT_LIMIT:
+        text = text[: ERROR_TEXT_LIMIT - 3] + "..."
+    return text
+
+
+class UserCase:
+    def __init__(
+        self,
+        user: Union[discord.User, discord.Member, discord.Object],
+        action: Literal["unban", "ban"],
+    ):
+        self.user = user
+        self.action: Literal["unban", "ban"] = action
+        self.guilds_banned_or_unbanned: List[discord.Guild] = []
+        self.fails: Dict[discord.Guild, Exception] = {}
+        # Guilds where the action only succeeded after being retried, with the number of attempts.
+        self.recovered: Dict[discord.Guild, int] = {}
+        # Guilds that were not processed because the run was cancelled.
+        self.skipped: List[discord.Guild] = []
+
+    def banned_or_unbanned_in(self, guild: discord.Guild):
+        self.guilds_banned_or_unbanned.append(guild)
+
+    def recovered_in(self, guild: discord.Guild, attempts: int):
+        self.guilds_banned_or_unbanned.append(guild)
+        self.recovered[guild] = attempts
+
+    def failed_in(self, guild: discord.Guild, exception: Exception):
+        self.fails[guild] = exception
+
+    def skipped_in(self, guild: discord.Guild):
+        self.skipped.append(guild)
+
+    def to_rows(self) -> Iterable[Tuple[str, ...]]:
+        """
+        Yield one row per user/guild pair, used for the CSV detail of a report.
+        """
+        for guild in self.guilds_banned_or_unbanned:
+            attempts = self.recovered.get(guild, 1)
+            yield (
+                str(self.user.id),
+                str(self.user),
+                str(guild.id),
+                guild.name,
+                "recovered" if attempts > 1 else "success",
+                str(attempts),
+                "",
+            )
+        for guild, error in self.fails.items():
+            yield (
+                str(self.user.id),
+                str(self.user),
+                str(guild.id),
+                guild.name,
+                "failed",
+                "",
+                str(error),
+            )
+        for guild in self.skipped:
+            yield (
+                str(self.user.id),
+                str(self.user),
+                str(guild.id),
+                guild.name,
+                "skipped",
+                "",
+                "",
+            )
+
+
+class BanReport:
+    """
+    An aggregated view of a ban/unban run.
+
+    Results are folded per guild and per error so the size of the report depends on the number
+    of guilds and distinct errors rather than the number of users. The full detail of every
+    user/guild pair is only produced when the CSV file is generated.
+    """
+
+    CSV_HEADER = ("user_id", "user", "guild_id", "guild", "result", "attempts", "error")
+
+    def __init__(
+        self,
+        users_cases: List[UserCase],
+        *,
+        action: Literal["unban", "ban"],
+        not_found_users: Optional[List[int]] = None,
+        errored_users: Optional[Dict[int, Exception]] = None,
+        guilds_removed: Optional[List[str]] = None,
+    ):
+        self.users_cases = users_cases
+        self.action: Literal["unban", "ban"] = action
+        self.not_found_users = not_found_users or []
+        self.errored_users = errored_users or {}
+        self.guilds_removed = guilds_removed or []
+
+        self.total_success = 0
+        self.total_recovered = 0
+        self.total_fails = 0
+        self.total_skipped = 0
+        # guild_id: [guild_name, successes, failures, recovered]
+        self.per_guild: Dict[int, List[Union[str, int]]] = {}
+        # error text: [occurrences, set of guild IDs]
+        self.per_error: Dict[str, List[Union[int, set]]] = {}
+        self._aggregate()
+
+    def _aggregate(self):
+        for case in self.users_cases:
+            for guild in case.guilds_banned_or_unbanned:
+                self.per_guild.setdefault(guild.id, [guild.name, 0, 0, 0])[1] += 1
+                self.total_success += 1
+            for guild in case.recovered:
+                self.per_guild[guild.id][3] += 1
+                self.total_recovered += 1
+            for guild, error in case.fails.items():
+                self.per_guild.setdefault(guild.id, [guild.name, 0, 0, 0])[2] += 1
+                entry = self.per_error.setdefault(short_error(error), [0, set()])
+                entry[0] += 1
+                entry[1].add(guild.id)
+                self.total_fails += 1
+            self.total_skipped += len(case.skipped)
+
+    @property
+    def wording(self) -> str:
+        return "unban" if self.action == "unban" else "ban"
+
+    def guild_lines(self) -> List[str]:
+        return [
+            f"{'✔️' if not fails else '❌'} {name} ({guild_id}): {success} success "
+            f"({recovered} after retrying), {fails} failure(s)"
+            for guild_id, (name, success, fails, recovered) in sorted(
+                self.per_guild.items(), key=lambda item: (-item[1][2], item[1][0])
+            )
+        ]
+
+    def error_lines(self) -> List[str]:
+        return [
+            f"❌ {count} time(s) in {len(guilds)} guild(s): {error}"
+            for error, (count, guilds) in sorted(
+                self.per_error.items(), key=lambda item: -item[1][0]
+            )
+        ]
+
+    def summary_embed(self) -> discord.Embed:
+        embed = discord.Embed(
+            color=discord.Color.dark_orange(),
+            title="Summary",
+            description=(
+                (
+                    "A total of {users_count} user(s) have been processed.\n\n"
+                    "A total of {total_success} {wording}, for a total of {total_fails} failure(s).\n"
+                    "{total_recovered} {wording} only succeeded after being retried.\n"
+                    "A more in depth result is available in this menu and in the attached file."
+                ).format(
+                    users_count=bold(str(len(self.users_cases))),
+                    total_success=bold(str(self.total_success)),
+                    wording=bold(self.wording),
+                    total_fails=bold(str(self.total_fails)),
+                    total_recovered=bold(str(self.total_recovered)),
+                )
+            ),
+        )
+        if self.guilds_removed:
+            removed = "\n".join(f"- {guild}" for guild in self.guilds_removed)
+            if len(removed) > 900:
+                removed = removed[:900].rsplit("\n", 1)[0] + "\n- ..."
+            embed.add_field(
+                name=warning("One or more guilds have been removed"),
+                value=(
+                    "These guilds did not process bans because I am missing permissions to ban users or an error happened:\n"
+                    + removed
+                ),
+                inline=False,
+            )
+        else:
+            embed.add_field(
+                name=tick("All guilds have processed bans"),
+                value="No errors related to guild's permissions occured when banning users in guilds.",
+                inline=False,
+            )
+        if self.total_skipped:
+            embed.add_field(
+                name=warning("This run was cancelled"),
+                value=f"{self.total_skipped} {self.wording}(s) were not processed.",
+                inline=False,
+            )
+        if self.not_found_users or self.errored_users:
+            embed.add_field(
+                name=warning("Some users could not be processed"),
+                value=(
+                    f"{len(self.not_found_users)} user(s) could not be found and "
+                    f"{len(self.errored_users)} user(s) could not be fetched."
+                ),
+                inline=False,
+            )
+        return embed
+
+    def to_file(self) -> discord.File:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.CSV_HEADER)
+        for case in self.users_cases:
+            writer.writerows(case.to_rows())
+        for user_id in self.not_found_users:
+            writer.writerow((str(user_id), "", "", "", "not_found", "", ""))
+        for user_id, error in self.errored_users.items():
+            writer.writerow((str(user_id), "", "", "", "errored", "", str(error)))
+        return text_to_file(buffer.getvalue(), filename=f"{self.wording}_report.csv")
+
+
+def paginate_lines(lines: List[str], limit: int = DESCRIPTION_LIMIT) -> List[Tuple[int, int]]:
+    """
+    Split a list of lines into ``(start, end)`` slices whose joined length fits in ``limit``.
+
+    Only the boundaries are computed, pages are joined when they are displayed.
+    """
+    pages = []
+    start = 0
+    length = 0
+    for index, line in enumerate(lines):
+        line_length = min(len(line), limit) + 1
+        if index > start and length + line_length > limit:
+            pages.append((start, index))
+            start = index
+            length = 0
+        length += line_length
+    if start < len(lines):
+        pages.append((start, len(lines)))
+    return pages
+
+
+class ReportSource(menus.PageSource):
+    """
+    Lazily render the pages of a :class:`BanReport`. Embeds are only built when a page is shown.
+    """
+
+    def __init__(self, report: BanReport):
+        self.report = report
+        self._sections: List[Tuple[str, List[str]]] = [
+            ("Results by guild", report.guild_lines()),
+            ("Permanent failures by error", report.error_lines()),
+        ]
+        # Page 0 is the summary, then (section index, start, end) for each page.
+        self._pages: List[Optional[Tuple[int, int, int]]] = [None]
+        for section_index, (_, lines) in enumerate(self._sections):
+            self._pages.extend((section_index, start, end) for start, end in paginate_lines(lines))
+
+    def is_paginating(self) -> bool:
+        return len(self._pages) > 1
+
+    def get_max_pages(self) -> int:
+        return len(self._pages)
+
+    async def get_page(self, page_number: int):
+        return page_number
+
+    async def format_page(self, menu: menus.MenuPages, page: int) -> discord.Embed:
+        if page == 0:
+            embed = self.report.summary_embed()
+        else:
+            section_index, start, end = self._pages[page]
+            title, lines = self._sections[section_index]
+            embed = discord.Embed(
+                color=discord.Colour.dark_red(),
+                title=f"{title} - {self.report.wording.capitalize()}",
+                description="\n".join(line[:DESCRIPTION_LIMIT] for line in lines[start:end]),
+            )
+        embed.set_footer(text=f"Page {page + 1}/{self.get_max_pages()}")
+        return embed
+
+
+class ReportMenu(menus.MenuPages):
+    """
+    Menu showing a :class:`ReportSource`, the CSV detail is attached to the first message.
+    """
+
+    async def send_initial_message(self, ctx, channel):
+        page = await self._source.get_page(0)
+        kwargs = await self._get_kwargs_from_page(page)
+        return await channel.send(**kwargs, file=self._source.report.to_file())  # type: ignore
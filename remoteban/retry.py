@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+import discord
+
+# Errors that may be raised by a single ban/unban call and which are handled by the engine.
+ACTION_ERRORS = (
+    discord.HTTPException,
+    discord.RateLimited,
+    asyncio.TimeoutError,
+    aiohttp.ClientError,
+)
+
+
+class ErrorKind(Enum):
+    PERMANENT = "permanent"
+    TRANSIENT = "transient"
+    RATE_LIMITED = "rate_limited"
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Extract the time to wait from a rate limit error, if Discord gave one.
+    """
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def classify_error(error: Exception) -> Tuple[ErrorKind, Optional[float]]:
+    """
+    Tell if an error is worth retrying.
+
+    Returns
+    -------
+    Tuple[ErrorKind, Optional[float]]: The kind of error and, for rate limits, the time to wait
+    given by Discord.
+    """
+    if isinstance(error, discord.RateLimited):
+        return ErrorKind.RATE_LIMITED, error.retry_after
+    if isinstance(error, (discord.Forbidden, discord.NotFound)):
+        return ErrorKind.PERMANENT, None
+    if isinstance(error, discord.HTTPException):
+        if error.status == 429:
+            return ErrorKind.RATE_LIMITED, get_retry_after(error)
+        if error.status >= 500:
+            return ErrorKind.TRANSIENT, None
+        return ErrorKind.PERMANENT, None
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError)):
+        return ErrorKind.TRANSIENT, None
+    return ErrorKind.PERMANENT, None
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff with a retry budget per user/guild pair.
+
+    Parameters
+    ----------
+    max_attempts: int
+        The maximum number of calls made for a single pair, including the first one.
+    base_delay: float
+        The base of the exponential backoff, in seconds.
+    max_delay: float
+        The maximum time to wait between two attempts, in seconds.
+    """
+
+    def __init__(self, *, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def can_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+    def backoff(self, attempt: int) -> float:
+        """
+        The time to wait after the given failed attempt (starting at 1), using full jitter.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class GuildBuckets:
+    """
+    Keep track of guilds that must not be called until a rate limit is over.
+    """
+
+    def __init__(self):
+        self._paused_until: Dict[int, float] = {}
+
+    def pause(self, guild_id: int, delay: float):
+        until = time.monotonic() + delay
+        if until > self._paused_until.get(guild_id, 0):
+            self._paused_until[guild_id] = until
+
+    def paused_until(self, guild_id: int) -> float:
+        return self._paused_until.get(guild_id, 0)
+
+    def is_paused(self, guild_id: int) -> bool:
+        return self.paused_until(guild_id) > time.monotonic()
@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import time
+from enum import IntEnum
+from typing import Dict, List, Literal, Optional
+
+
+class Priority(IntEnum):
+    """
+    Priority of a run, lower values go first.
+    """
+
+    # A command acting on a single user, usually an urgent ban.
+    INTERACTIVE = 0
+    # Mirrored bans and jobs from the shared queue.
+    NORMAL = 1
+    # Commands acting on several users and background work such as lifting temporary bans.
+    BULK = 2
+
+
+class RunJob:
+    """
+    A run known by the scheduler, which can be listed and cancelled.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        action: Literal["unban", "ban"],
+        priority: Priority,
+        author_id: int,
+        total: Optional[int],
+    ):
+        self.id = job_id
+        self.action: Literal["unban", "ban"] = action
+        self.priority = priority
+        self.author_id = author_id
+        self.total = total
+        self.processed = 0
+        self.started_at = time.time()
+        self.cancelled = False
+
+
+class RunScheduler:
+    """
+    Order the pairs of concurrent runs by priority.
+
+    Before each user/guild pair, a run waits for every run with a higher priority to finish, so
+    an urgent ban does not compete for rate limits with a bulk job. Runs with the same priority
+    go on concurrently. A cancelled run stops waiting and is expected to stop at its next pair.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[int, RunJob] = {}
+        self._counter = itertools.count(1)
+        self._changed = asyncio.Condition()
+
+    @property
+    def jobs(self) -> List[RunJob]:
+        return sorted(self._jobs.values(), key=lambda job: (job.priority, job.id))
+
+    def get(self, job_id: int) -> Optional[RunJob]:
+        return self._jobs.get(job_id)
+
+    def register(
+        self,
+        action: Literal["unban", "ban"],
+        priority: Priority,
+        author_id: int,
+        total: Optional[int] = None,
+    ) -> RunJob:
+        job = RunJob(next(self._counter), action, priority, author_id, total)
+        self._jobs[job.id] = job
+        return job
+
+    def _can_go(self, job: RunJob) -> bool:
+        return job.cancelled or all(
+            other.priority >= job.priority for other in self._jobs.values() if not other.cancelled
+        )
+
+    async def turn(self, job: RunJob) -> bool:
+        """
+        Wait until the job may process its next pair. Return ``False`` if it was cancelled.
+        """
+        if not self._can_go(job):
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._can_go(job))
+        return not job.cancelled
+
+    async def cancel(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.cancelled:
+            return False
+        job.cancelled = True
+        async with self._changed:
+            self._changed.notify_all()
+        return True
+
+    async def finish(self, job: RunJob):
+        self._jobs.pop(job.id, None)
+        async with self._changed:
+            self._changed.notify_all()
@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, TypedDict
+
+import discord
+
+from .const import LOG
+
+if TYPE_CHECKING:
+    from .remoteban import RemoteBan
+
+# Once a deadline is due, the scheduler waits this long and lifts every deadline passed meanwhile
+# in the same fan-out. Bans are lifted late by up to this time, never early.
+COALESCE_WINDOW = 10.0
+# Time before retrying deadlines whose expiry failed, doubled on every consecutive failure.
+RETRY_DELAY = 30.0
+RETRY_MAX_DELAY = 1800.0
+
+
+class TempBanRecord(TypedDict):
+    expires_at: float
+    guilds: List[int]
+    author_id: int
+    reason: str
+
+
+class ExpiryScheduler:
+    """
+    Unban users when their temporary ban expires.
+
+    Deadlines are kept in a min-heap rebuilt from the stored records when the cog loads, the
+    scheduler sleeps until the closest one. Entries of the heap are not removed when a record
+    changes; an entry is only acted upon if it still matches the stored record.
+    Every deadline passed within ``coalesce_window`` of the first due one is lifted in the same
+    fan-out. Deadlines that could not be lifted in every guild are pushed back after a backoff,
+    their records being still stored with the guilds left.
+    """
+
+    def __init__(self, cog: "RemoteBan", *, coalesce_window: float = COALESCE_WINDOW):
+        self.cog = cog
+        self.coalesce_window = coalesce_window
+        self._heap: List[Tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+        self._retries: Set[asyncio.TimerHandle] = set()
+
+    def load(self, records: Dict[str, TempBanRecord]):
+        self._heap = [(record["expires_at"], int(user_id)) for user_id, record in records.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def push(self, expires_at: float, user_id: int):
+        heapq.heappush(self._heap, (expires_at, user_id))
+        # Only needed when the new deadline is the closest one, but cheap anyway.
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+
+    def _retry_later(self, due: List[Tuple[float, int]]):
+        delay = min(RETRY_DELAY * 2**self._failures, RETRY_MAX_DELAY)
+        self._failures += 1
+
+        def retry():
+            self._retries.discard(handle)
+            for expires_at, user_id in due:
+                self.push(expires_at, user_id)
+
+        handle = asyncio.get_running_loop().call_later(delay, retry)
+        self._retries.add(handle)
+
+    async def _loop(self):
+        await self.cog.bot.wait_until_red_ready()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.sleep(self.coalesce_window)
+            now = time.time()
+            due: List[Tuple[float, int]] = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            try:
+                left = await self.cog.expire_tempbans(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOG.exception("Unable to lift %s temporary ban(s), retrying later.", len(due))
+                self._retry_later(due)
+                continue
+            if left:
+                LOG.warning(
+                    "Unable to lift %s temporary ban(s) in every guild, retrying later.", len(left)
+                )
+                self._retry_later(left)
+            else:
+                self._failures = 0
+
+
+def is_already_lifted(error: Exception) -> bool:
+    """
+    Tell if an unban failed because the user was not banned anymore.
+
+    Errors reported by other instances of the shared queue only keep their message.
+    """
+    if isinstance(error, discord.NotFound):
+        return True
+    return str(error).startswith("404 Not Found")
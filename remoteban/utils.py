@@ -1,4 +1,5 @@
-from typing import Dict, List, Optional
+import re
+from typing import Dict, List, Optional, Tuple
 
 import discord
 from redbot.core import Config, commands
@@ -64,3 +65,26 @@ def allowed_to_ban():
         return ctx.author.id in is_ok
 
     return commands.check(predicate)
+
+
+FLAG_PATTERN = re.compile(r"--(?P<name>[a-z]+)\s+(?P<value>\S+)\s*")
+
+
+def parse_flags(text: str, allowed: List[str]) -> Tuple[Dict[str, List[str]], str]:
+    """
+    Extract ``--name value`` flags placed at the beginning of a text, such as a reason.
+
+    Returns
+    -------
+    Tuple[Dict[str, List[str]], str]: The values given for each flag, and the rest of the text.
+    """
+    flags: Dict[str, List[str]] = {}
+    while match := FLAG_PATTERN.match(text):
+        if match["name"] not in allowed:
+            raise commands.UserFeedbackCheckFailure(
+                f"Unknown option `--{match['name']}`. Available options: "
+                + (", ".join(f"`--{flag}`" for flag in allowed) or "None")
+            )
+        flags.setdefault(match["name"], []).append(match["value"])
+        text = text[match.end() :]
+    return flags, text
@@ -0,0 +1,9 @@
+from .scheduler import (
+    Priority,
+    QueueStats,
+    RestScheduler,
+    TokenBucket,
+    get_scheduler,
+)
+
+__all__ = ["Priority", "QueueStats", "RestScheduler", "TokenBucket", "get_scheduler"]
@@ -0,0 +1,370 @@
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from weakref import WeakKeyDictionary
+
+from redbot.core.bot import Red
+
+from .const import LOG
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """
+    Priority of a REST call, lower values go first.
+    """
+
+    # Moderation a moderator is waiting for, such as banning a raider.
+    CRITICAL = 0
+    # Other moderation, such as bans of a bulk run or leaving a guild that is not allowed.
+    MODERATION = 1
+    # Alerts, notifications, direct messages and modlog cases.
+    NOTIFICATION = 2
+    BACKGROUND = 3
+
+
+# Maximum number of calls in flight, all priorities together.
+MAX_CONCURRENCY = 8
+# Maximum number of calls in flight for each priority, so lower priorities leave slots free.
+PRIORITY_CONCURRENCY = {
+    Priority.CRITICAL: 8,
+    Priority.MODERATION: 6,
+    Priority.NOTIFICATION: 3,
+    Priority.BACKGROUND: 2,
+}
+# Calls per second and burst size, for all calls, each route and each guild. Discord's own rate
+# limits are still handled by discord.py, these only spread calls so they are rarely reached.
+GLOBAL_RATE = (40.0, 40)
+ROUTE_RATE = (10.0, 20)
+GUILD_RATE = (5.0, 10)
+# Routes with their own rate. Discord limits messages by channel, which guild buckets cover.
+ROUTE_RATES = {"send": GLOBAL_RATE}
+# Guild buckets are dropped once full past this number of guilds.
+MAX_GUILD_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Allow ``rate`` calls per second on average, and bursts of up to ``capacity`` calls.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Set when Discord asked to wait, no token is given before this time.
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Return the time to wait for a token, 0 if one is available.
+        """
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class Waiter:
+    __slots__ = ("priority", "route", "guild_id", "seq", "future", "queued_at")
+
+    def __init__(self, priority: Priority, route: str, guild_id: Optional[int], seq: int):
+        self.priority = priority
+        self.route = route
+        self.guild_id = guild_id
+        # Order of submission, so calls of a priority go in order.
+        self.seq = seq
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class Counters:
+    __slots__ = ("queued", "submitted", "completed", "failed", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class QueueStats(NamedTuple):
+    priority: Priority
+    queued: int
+    in_flight: int
+    submitted: int
+    completed: int
+    failed: int
+    # Total and maximum time calls waited in the queue, in seconds.
+    wait_total: float
+    wait_max: float
+
+
+def is_global_limit(error: Exception) -> bool:
+    """
+    Tell if a rate limit error applies to every call of the bot rather than to a single route.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    return (
+        headers.get("X-RateLimit-Global", "").lower() == "true"
+        or headers.get("X-RateLimit-Scope") == "global"
+    )
+
+
+class RestScheduler:
+    """
+    Run the REST calls of every cog through a single queue.
+
+    A call waits until a slot is free, within the global and per-priority concurrency caps, and
+    until the global bucket, the bucket of its route and the bucket of its guild have a token.
+    Each priority has a heap of calls in order of submission. A call blocked by a bucket is
+    parked until the bucket allows it, so it does not hold back calls of other routes or guilds
+    and is not looked at again meanwhile. A call failing with a ``retry_after`` pauses its route
+    in its guild for that long, or every call for a global rate limit.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = MAX_CONCURRENCY,
+        priority_concurrency: Optional[Dict[Priority, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.priority_concurrency = priority_concurrency or dict(PRIORITY_CONCURRENCY)
+        self._queues: Dict[Priority, List[Tuple[int, Waiter]]] = {
+            priority: [] for priority in Priority
+        }
+        # Calls blocked by a bucket, by the time the bucket allows them.
+        self._parked: List[Tuple[float, int, Waiter]] = []
+        self._in_flight: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._global = TokenBucket(*GLOBAL_RATE)
+        self._route_rates: Dict[str, Tuple[float, int]] = dict(ROUTE_RATES)
+        self._routes: Dict[str, TokenBucket] = {}
+        self._guilds: Dict[int, TokenBucket] = {}
+        # Pauses of a route in a single guild, by route and guild ID.
+        self._pauses: Dict[Tuple[str, int], float] = {}
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._counters: Dict[Priority, Counters] = {priority: Counters() for priority in Priority}
+
+    def configure_route(self, route: str, rate: float, capacity: int):
+        """
+        Set the calls per second and burst size of a route.
+        """
+        self._route_rates[route] = (rate, capacity)
+        self._routes.pop(route, None)
+
+    def _route_bucket(self, route: str) -> TokenBucket:
+        bucket = self._routes.get(route)
+        if bucket is None:
+            bucket = self._routes[route] = TokenBucket(*self._route_rates.get(route, ROUTE_RATE))
+        return bucket
+
+    def _guild_bucket(self, guild_id: int) -> TokenBucket:
+        bucket = self._guilds.get(guild_id)
+        if bucket is None:
+            if len(self._guilds) >= MAX_GUILD_BUCKETS:
+                now = time.monotonic()
+                self._guilds = {
+                    key: value for key, value in self._guilds.items() if not value.is_full(now)
+                }
+                self._pauses = {key: until for key, until in self._pauses.items() if until > now}
+            bucket = self._guilds[guild_id] = TokenBucket(*GUILD_RATE)
+        return bucket
+
+    def pause(self, delay: float, *, route: Optional[str] = None, guild_id: Optional[int] = None):
+        """
+        Stop giving tokens for some time to a route in a guild, to a route or a guild as a whole,
+        or to every call if neither is given.
+        """
+        until = time.monotonic() + delay
+        if route is not None and guild_id is not None:
+            key = (route, guild_id)
+            self._pauses[key] = max(self._pauses.get(key, 0.0), until)
+        else:
+            if route is not None:
+                bucket = self._route_bucket(route)
+            elif guild_id is not None:
+                bucket = self._guild_bucket(guild_id)
+            else:
+                bucket = self._global
+            bucket.paused_until = max(bucket.paused_until, until)
+        self._pump()
+
+    async def run(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        route: str,
+        guild_id: Optional[int] = None,
+        priority: Priority = Priority.NOTIFICATION,
+        **kwargs,
+    ) -> T:
+        """
+        Wait for a turn, then call and await ``func(*args, **kwargs)``.
+
+        Parameters
+        ----------
+        route: str
+            A short name for the kind of call, such as ``"ban"`` or ``"send"``.
+        guild_id: Optional[int]
+            The guild the call acts on, if any.
+        priority: Priority
+            The priority class of the call.
+        """
+        waiter = Waiter(priority, route, guild_id, next(self._seq))
+        counters = self._counters[priority]
+        counters.submitted += 1
+        counters.queued += 1
+        heapq.heappush(self._queues[priority], (waiter.seq, waiter))
+        self._pump()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Given a slot right as it was cancelled.
+                self._release(priority)
+            else:
+                # Dropped from the heaps when next seen.
+                counters.queued -= 1
+            raise
+        waited = time.monotonic() - waiter.queued_at
+        counters.wait_total += waited
+        counters.wait_max = max(counters.wait_max, waited)
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as error:
+            counters.failed += 1
+            retry_after = getattr(error, "retry_after", None)
+            if isinstance(retry_after, (int, float)) and retry_after > 0:
+                if is_global_limit(error):
+                    self.pause(retry_after)
+                else:
+                    self.pause(retry_after, route=route, guild_id=guild_id)
+            raise
+        finally:
+            self._release(priority)
+        counters.completed += 1
+        return result
+
+    def _release(self, priority: Priority):
+        self._in_flight[priority] -= 1
+        self._pump()
+
+    def _delay(self, waiter: Waiter, now: float) -> float:
+        """
+        Return the time before the buckets of a call allow it, 0 if they do.
+        """
+        delay = max(self._global.delay(now), self._route_bucket(waiter.route).delay(now))
+        if waiter.guild_id is not None:
+            delay = max(
+                delay,
+                self._guild_bucket(waiter.guild_id).delay(now),
+                self._pauses.get((waiter.route, waiter.guild_id), 0.0) - now,
+            )
+        return delay
+
+    def _take(self, waiter: Waiter, now: float):
+        self._global.take(now)
+        self._route_bucket(waiter.route).take(now)
+        if waiter.guild_id is not None:
+            self._guild_bucket(waiter.guild_id).take(now)
+            self._pauses.pop((waiter.route, waiter.guild_id), None)
+
+    def _pump(self):
+        """
+        Give turns to as many waiting calls as slots and buckets allow.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        # Parked calls whose buckets may allow them now go back in order.
+        while self._parked and self._parked[0][0] <= now:
+            _, seq, waiter = heapq.heappop(self._parked)
+            if not waiter.future.done():
+                heapq.heappush(self._queues[waiter.priority], (seq, waiter))
+        in_flight = sum(self._in_flight.values())
+        for priority in Priority:
+            queue = self._queues[priority]
+            limit = self.priority_concurrency.get(priority, 1)
+            while queue and in_flight < self.max_concurrency:
+                if self._in_flight[priority] >= limit:
+                    break
+                seq, waiter = heapq.heappop(queue)
+                if waiter.future.done():
+                    continue
+                delay = self._delay(waiter, now)
+                if delay > 0:
+                    heapq.heappush(self._parked, (now + delay, seq, waiter))
+                    continue
+                self._take(waiter, now)
+                self._counters[priority].queued -= 1
+                self._in_flight[priority] += 1
+                in_flight += 1
+                waiter.future.set_result(None)
+        if self._parked:
+            self._timer = asyncio.get_running_loop().call_later(
+                max(self._parked[0][0] - now, 0.0), self._pump
+            )
+
+    def stats(self) -> List[QueueStats]:
+        stats = []
+        for priority in Priority:
+            counters = self._counters[priority]
+            stats.append(
+                QueueStats(
+                    priority,
+                    counters.queued,
+                    self._in_flight[priority],
+                    counters.submitted,
+                    counters.completed,
+                    counters.failed,
+                    counters.wait_total,
+                    counters.wait_max,
+                )
+            )
+        return stats
+
+
+_schedulers: "WeakKeyDictionary[Red, RestScheduler]" = WeakKeyDictionary()
+
+
+def get_scheduler(bot: Red) -> RestScheduler:
+    """
+    Return the scheduler shared by every cog of a bot, creating it the first time.
+    """
+    scheduler = _schedulers.get(bot)
+    if scheduler is None:
+        scheduler = _schedulers[bot] = RestScheduler()
+        LOG.debug("Created the REST scheduler.")
+    return scheduler